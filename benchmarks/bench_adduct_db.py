@@ -0,0 +1,49 @@
+'''
+Benchmark building adduct ions for a compound table, build_adduct_db vs a loop of compute_adducts_formulae.
+
+Compounds are the formulae of lib/formula_coordinate, with their masses.
+The ions of both are checked to be the same.
+
+Usage (from repository root, or with mass2chem installed):
+    PYTHONPATH=. python benchmarks/bench_adduct_db.py [repeats]
+'''
+
+import sys
+import time
+
+from mass2chem.formula import compute_adducts_formulae
+from mass2chem.adduct_db import build_adduct_db
+from mass2chem.lib.formula_coordinate import formula_coordinate
+
+
+def make_compounds():
+    # formulae without repeated elements or additive compounds, which the two parse differently
+    compounds = []
+    for mass, formula, name in formula_coordinate:
+        if '(' not in formula and '·' not in formula:
+            compounds.append({'id': 'C%d' % len(compounds), 'formula': formula, 'neutral_mass': mass})
+    return compounds
+
+
+def run(repeats=3):
+    compounds = make_compounds()
+    print("%d compounds" % len(compounds))
+    print("mode\tmethod\tions\tseconds")
+    for mode in ('pos', 'neg'):
+        loop_time, build_time = [], []
+        for ii in range(repeats):
+            t0 = time.time()
+            expected = [(c['id'], ion, formula) for c in compounds
+                        for mz, ion, formula in compute_adducts_formulae(c['neutral_mass'], c['formula'], mode, False)]
+            loop_time.append(time.time() - t0)
+            t0 = time.time()
+            DB = build_adduct_db(compounds, mode=mode, primary_only=False, use_cache=False)
+            build_time.append(time.time() - t0)
+        found = list(zip(DB.compound_ids.tolist(), DB.ions.tolist(), DB.formulas.tolist()))
+        assert found == expected, "ions differ"
+        print("%s\t%s\t%d\t%.3f" % (mode, 'compute_adducts_formulae_loop', len(expected), min(loop_time)))
+        print("%s\t%s\t%d\t%.3f" % (mode, 'build_adduct_db', len(found), min(build_time)))
+
+
+if __name__ == '__main__':
+    run(*[int(x) for x in sys.argv[1:]])
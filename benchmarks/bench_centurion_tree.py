@@ -0,0 +1,69 @@
+'''
+Benchmark recall and speed of m/z searches from m/z 50 to 5000.
+
+Compares the legacy three-bin centurion_tree search, 
+the centurion_tree search with tolerance-derived neighbor span, 
+and batched queries on SortedMassIndex.
+Ground truth is brute force comparison with numpy.
+
+Usage (from repository root, or with mass2chem installed):
+    PYTHONPATH=. python benchmarks/bench_centurion_tree.py [number_peaks] [limit_ppm]
+'''
+
+import sys
+import time
+import numpy as np
+
+from mass2chem.search import build_centurion_tree, find_all_matches_centurion_indexed_list
+from mass2chem.mass_index import SortedMassIndex
+
+
+def legacy_find_all_matches(query_mz, mz_centurion_tree, limit_ppm=5, key='mz'):
+    # three bins only, as in mass2chem <= 0.5.1
+    q = int(query_mz * 100)
+    mz_tol = query_mz * limit_ppm * 0.000001
+    results = []
+    for ii in (q-1, q, q+1):
+        for peak in mz_centurion_tree.get(ii, []):
+            if abs(peak[key]-query_mz) < mz_tol:
+                results.append(peak)
+    return results
+
+
+def make_peaks(low, high, N, limit_ppm, rng):
+    mzs = rng.uniform(low, high, N)
+    # half of the peaks have a partner at a random distance within the tolerance
+    shifts = rng.uniform(-0.99, 0.99, N//2) * limit_ppm * 0.000001 * mzs[:N//2]
+    mzs = np.concatenate([mzs, mzs[:N//2] + shifts])
+    return [{'id_number': ii, 'mz': float(x)} for ii, x in enumerate(mzs)]
+
+
+def run(N=20000, limit_ppm=5, ranges=((50, 500), (500, 1000), (1000, 2000), (2000, 3000), (3000, 5000))):
+    rng = np.random.default_rng(0)
+    print("m/z range\tmethod\trecall\tseconds")
+    for low, high in ranges:
+        peaks = make_peaks(low, high, N, limit_ppm, rng)
+        queries = np.array([p['mz'] for p in peaks[:N//2]])
+        mzs = np.array([p['mz'] for p in peaks])
+        truth = 0
+        for q in queries:
+            truth += int(np.sum(np.abs(mzs - q) < q * limit_ppm * 0.000001))
+
+        mztree = build_centurion_tree(peaks)
+        index = SortedMassIndex.from_peaks(peaks)
+        for name, func in (('legacy_3_bins', legacy_find_all_matches),
+                           ('centurion_tree', find_all_matches_centurion_indexed_list)):
+            t0 = time.time()
+            found = sum(len(func(q, mztree, limit_ppm)) for q in queries)
+            print("%d-%d\t%s\t%.4f\t%.3f" %(low, high, name, found/truth, time.time()-t0))
+
+        t0 = time.time()
+        query_numbers, _ = index.find_all_batch(queries, limit_ppm)
+        print("%d-%d\t%s\t%.4f\t%.3f" %(low, high, 'SortedMassIndex_batch', len(query_numbers)/truth, time.time()-t0))
+
+
+if __name__ == '__main__':
+    args = [float(x) for x in sys.argv[1:]]
+    if len(args) > 0:
+        args[0] = int(args[0])
+    run(*args)
@@ -0,0 +1,148 @@
+'''
+Precomputed adduct ions of compound databases, for bulk annotation of feature tables.
+
+build_adduct_db takes a compound table (id, formula, neutral mass), e.g. from HMDB,
+and computes all adduct ions for a given mode and primary_only setting, as formula.compute_adducts_formulae does.
+Adducts are computed for all compounds at once, from formula.AdductTable and the element-count matrix of formulae.
+The result, AdductDB, is a flat table of ions with a sorted m/z index, and is cached to disk,
+keyed by the compound table and parameters, so that it is built only once.
+
+Example
+-------
+DB = build_adduct_db(list_compounds, mode='pos', primary_only=True)
+matches = DB.annotate_features(list_features, limit_ppm=5)
+'''
+
+import os
+import numpy as np
+
+from .formula import get_adduct_table
+from .formula_matrix import parse_formula_matrix, matrix_to_hill_formulas
+from .mass_index import SortedMassIndex
+from .cache import get_cache_dir, inputs_key
+
+
+def _compound_columns(compounds, id_key, formula_key, mass_key):
+    # compounds as list of dictionaries, dictionary of arrays or DataFrame
+    if isinstance(compounds, list):
+        return ([c[id_key] for c in compounds], [c[formula_key] for c in compounds],
+                [float(c[mass_key]) for c in compounds])
+    return (list(compounds[id_key]), list(compounds[formula_key]),
+            [float(x) for x in compounds[mass_key]])
+
+
+class AdductDB:
+    '''
+    Flat table of adduct ions, as aligned arrays compound_ids, ions, formulas and mz,
+    with a SortedMassIndex on mz.
+    '''
+    _array_fields = ('compound_ids', 'ions', 'formulas', 'mz')
+
+    def __init__(self, compound_ids, ions, formulas, mz):
+        self.compound_ids = np.asarray(compound_ids, dtype=str)
+        self.ions = np.asarray(ions, dtype=str)
+        self.formulas = np.asarray(formulas, dtype=str)
+        self.mz = np.asarray(mz, dtype=np.float64)
+        self.index = SortedMassIndex(self.mz)
+
+    def __len__(self):
+        return len(self.mz)
+
+    def save(self, path):
+        '''Save to a .npz file, without pickled objects.'''
+        np.savez(path, **{k: getattr(self, k) for k in self._array_fields})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(*[data[k] for k in cls._array_fields])
+
+    def annotate(self, query_mzs, limit_ppm=5):
+        '''
+        Return all ions within limit_ppm of query_mzs, as a dictionary of aligned arrays,
+        {'query_number': [], 'compound_id': [], 'ion': [], 'formula': [], 'mz': [], 'ppm': []},
+        where query_number is position in query_mzs, and ppm is signed, 1000000 * (query_mz - ion_mz)/query_mz.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        query_numbers, rows = self.index.find_all_batch(query_mzs, limit_ppm)
+        return {
+            'query_number': query_numbers,
+            'compound_id': self.compound_ids[rows],
+            'ion': self.ions[rows],
+            'formula': self.formulas[rows],
+            'mz': self.mz[rows],
+            'ppm': 1000000 * (query_mzs[query_numbers] - self.mz[rows]) / query_mzs[query_numbers],
+        }
+
+    def annotate_features(self, list_features, limit_ppm=5, mz_key='mz'):
+        '''
+        Annotate a feature table, list of feature dictionaries or a table with column mz_key
+        (dictionary of arrays, DataFrame, PeakArray).
+        Return as annotate, with 'query_number' being the row number of features.
+        '''
+        if isinstance(list_features, list):
+            mzs = [f[mz_key] for f in list_features]
+        else:
+            mzs = list_features[mz_key]
+        return self.annotate(mzs, limit_ppm)
+
+
+def build_adduct_db(compounds, mode='pos', primary_only=True,
+                    id_key='id', formula_key='formula', mass_key='neutral_mass',
+                    adduct_table=None, use_cache=True, cache_dir=None):
+    '''
+    Build an AdductDB from a compound table.
+    The ions are the same as from compute_adducts_formulae for each compound, in the same order,
+    except for formulae of repeated elements or additive compounds, e.g. 'CH3COOH' or 'C2H4O2·HCl'.
+    These are parsed by formula_matrix.parse_formula_matrix, which sums repeated elements and removes
+    additive compounds, while formula.parse_chemformula_dict keeps the last count of an element,
+    e.g. M+H[1+] of 'CH3COOH' is C2H5O2 here, but CH2O from compute_adducts_formulae.
+
+    Input
+    =====
+    compounds: list of dictionaries, e.g. [{'id': 'HMDB0000122', 'formula': 'C6H12O6', 'neutral_mass': 180.06339}, ...],
+            or a DataFrame or dictionary of arrays with the same columns.
+    mode: ionization mode, 'pos' or 'neg'.
+    primary_only: only primary ions if True. See formula.compute_adducts_formulae.
+    id_key, formula_key, mass_key: keys or columns for compound ID, formula and neutral mass.
+    adduct_table: formula.AdductTable for user-defined adducts, replacing mode and primary_only.
+    use_cache: reuse a DB cached on disk for the same inputs, and cache newly built DB.
+    cache_dir: see cache.get_cache_dir.
+
+    Return
+    ======
+    AdductDB instance.
+    '''
+    ids, formulas, masses = _compound_columns(compounds, id_key, formula_key, mass_key)
+    if adduct_table is None:
+        adduct_table = get_adduct_table(mode, primary_only)
+    if use_cache:
+        key = inputs_key('adduct_db', adduct_table.definitions, ids, formulas, masses)
+        cache_file = os.path.join(get_cache_dir(cache_dir), 'adduct_db_' + key + '.npz')
+        if os.path.exists(cache_file):
+            return AdductDB.load(cache_file)
+
+    # adducts are computed once per unique formula;
+    # formulae parsed with repeated elements summed and additive compounds removed, see docstring
+    unique_formulas, formula_numbers = np.unique(np.asarray(formulas, dtype=str), return_inverse=True)
+    formula_numbers = formula_numbers.ravel()
+    neutral_matrix, elements = parse_formula_matrix(unique_formulas, handle_negative_number=False)
+    valid = adduct_table.check_valid(neutral_matrix, elements)
+    ion_formulas = np.full(valid.shape, '', dtype=object)
+    for jj in range(len(adduct_table)):
+        _valid = valid[:, jj]
+        result_matrix, result_elements, _ = adduct_table.compute_formula_matrix(jj, neutral_matrix[_valid], elements)
+        ion_formulas[_valid, jj] = matrix_to_hill_formulas(result_matrix, result_elements)
+
+    # rows ordered by compound, then adduct
+    compound_numbers, adduct_numbers = np.nonzero(valid[formula_numbers])
+    DB = AdductDB(np.asarray(ids, dtype=str)[compound_numbers],
+                  np.asarray(adduct_table.ions, dtype=str)[adduct_numbers],
+                  ion_formulas[formula_numbers[compound_numbers], adduct_numbers].astype(str),
+                  adduct_table.compute_mz(masses)[compound_numbers, adduct_numbers])
+    if use_cache:
+        # write to a temporary file first, so that concurrent jobs never read a partial file
+        tmp_file = cache_file + '.%d.tmp.npz' % os.getpid()
+        DB.save(tmp_file)
+        os.replace(tmp_file, cache_file)
+    return DB
@@ -0,0 +1,107 @@
+'''
+Disk cache location and keys for precomputed tables, e.g. adduct databases.
+
+The cache directory is, in order of precedence,
+the cache_dir argument to a function, environment variable MASS2CHEM_CACHE_DIR, or ~/.cache/mass2chem.
+
+Whole tables are cached as files keyed by inputs_key, e.g. adduct_db.build_adduct_db.
+Many small results, e.g. isotope patterns of formulae, are cached in a size-bounded DiskCache.
+'''
+
+import os
+import time
+import hashlib
+import sqlite3
+from contextlib import closing
+
+from . import __version__
+
+
+def get_cache_dir(cache_dir=None):
+    '''
+    Return the cache directory, created if not existing.
+    '''
+    if not cache_dir:
+        cache_dir = os.environ.get('MASS2CHEM_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'mass2chem'))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def inputs_key(*items):
+    '''
+    Return a hex digest identifying the inputs, from their repr, and the version of mass2chem,
+    so that results are recomputed when the package is updated.
+    Items should have stable repr, e.g. strings, numbers, tuples and lists of them.
+    '''
+    h = hashlib.sha1(__version__.encode())
+    for x in items:
+        h.update(b'\x00' + repr(x).encode())
+    return h.hexdigest()
+
+
+class DiskCache:
+    '''
+    Size-bounded store of bytes by string key, in a SQLite file, shared by processes and jobs.
+    When the total size of values exceeds max_bytes, least recently used entries are evicted.
+
+    Example
+    -------
+    cache = DiskCache(os.path.join(get_cache_dir(), 'isotope_patterns.sqlite'), max_bytes=2**28)
+    cache.set_many({'key1': b'...'})
+    cache.get_many(['key1', 'key2'])        # {'key1': b'...'}
+    '''
+    def __init__(self, path, max_bytes=2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        with closing(self._connect()) as con, con:
+            con.execute('CREATE TABLE IF NOT EXISTS cache '
+                        '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+            con.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get_many(self, keys, chunk_size=500):
+        '''Return dictionary of found keys and their values; access time of found keys is updated.'''
+        found = {}
+        now = time.time()
+        with closing(self._connect()) as con, con:
+            for start in range(0, len(keys), chunk_size):
+                chunk = list(keys[start: start + chunk_size])
+                marks = ','.join('?' * len(chunk))
+                found.update(con.execute('SELECT key, value FROM cache WHERE key IN (%s)' % marks, chunk))
+                con.execute('UPDATE cache SET accessed = ? WHERE key IN (%s)' % marks, [now] + chunk)
+        return found
+
+    def set_many(self, items):
+        '''Store dictionary of keys and values (bytes), then evict if over max_bytes.'''
+        now = time.time()
+        with closing(self._connect()) as con, con:
+            con.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                            [(k, v, len(v), now) for k, v in items.items()])
+            self._evict(con)
+
+    def _evict(self, con):
+        total = con.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # evict down to 90% of max_bytes, so that eviction is not run on every insert
+        evicted = []
+        for key, size in con.execute('SELECT key, size FROM cache ORDER BY accessed'):
+            if total <= 0.9 * self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        con.executemany('DELETE FROM cache WHERE key = ?', evicted)
+
+    def total_bytes(self):
+        with closing(self._connect()) as con:
+            return con.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def __len__(self):
+        with closing(self._connect()) as con:
+            return con.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def clear(self):
+        with closing(self._connect()) as con, con:
+            con.execute('DELETE FROM cache')
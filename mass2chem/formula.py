@@ -13,9 +13,12 @@ Primary goal in the Mummichog suite is to compute:
 
 import re
 from collections import namedtuple
+from functools import lru_cache
 import warnings
+import numpy as np
 
 from .source_data import NIST_isotope_data
+from .formula_matrix import formula_dicts_to_matrix, align_formula_matrix, hill_order, check_formula_changes
 """
 Isotope information sourced from:
 
@@ -182,6 +185,188 @@ def dict_to_hill_formula(d):
     return formula
 
 
+# Adduct definitions, (ion, formula change, charge, number of M).
+# The formula change includes all atoms gained or lost, and m/z is computed in AdductTable as
+# (number of M * mw + mass of formula change - charge * ELECTRON) / abs(charge),
+# e.g. M+Na[1+] = mw + Na - ELECTRON; M+2H[2+] = mw/2 + PROTON.
+# Isotopes are written as (C13) etc. in formula changes, as in dict_to_hill_formula.
+# Use {'C':-1, '(C13)':1} to force check that C exists in formula.
+# The 'multimer' lists are not used by default; they can be added by AdductTable.extend.
+#
+# Compared to the rounded constants used before (mass2chem <= 0.5.1), m/z values of most adducts
+# move by less than 0.1 mDa, M(Cl37)+H[1+] and M(Cl37)-H[-] by -0.15 mDa. These move by more, for any mw:
+#   M+K[1+] +0.381 mDa and M+K-2H[-] +0.358 mDa; the constants 37.9555 and 38.9628 were off the exact mass of 39K.
+#   M+Cl[-] +0.502, M+Cl37[-] +0.552, M+Br[-] +0.587, M+Br81[-] +0.539, M+HCOO[-] +0.558 and M+CH3COO[-] +0.558 mDa;
+#   the mass of the gained electron was not added to these anions, and Cl, Br constants were rounded.
+# Values are pinned in tests/test_formula.py, TestAdductTable.test_mz_changes.
+ADDUCT_DEFINITIONS = {
+    'pos': {
+        'primary': [
+            ('M[1+]', {}, 1, 1),                                    # e not changing formula
+            ('M+H[1+]', {'H': 1}, 1, 1),
+            ('M+Na[1+]', {'Na': 1}, 1, 1),
+            ('M+H2O+H[1+]', {'H': 3, 'O': 1}, 1, 1),
+            ('M+NH4[1+]', {'H': 4, 'N': 1}, 1, 1),
+        ],
+        'extended': [
+            ('M(C13)[1+]', {'C': -1, '(C13)': 1}, 1, 1),
+            ('M(C13)+H[1+]', {'C': -1, '(C13)': 1, 'H': 1}, 1, 1),
+            ('M+2H[2+]', {'H': 2}, 2, 1),
+            ('M+3H[3+]', {'H': 3}, 3, 1),
+            ('M(C13)+2H[2+]', {'C': -1, '(C13)': 1, 'H': 2}, 2, 1),
+            ('M(C13)+3H[3+]', {'C': -1, '(C13)': 1, 'H': 3}, 3, 1),
+            # Sulfur:  32S (95.02%), 33S (0.75%), 34S (4.21%), .
+            ('M(S34)+H[1+]', {'S': -1, '(S34)': 1, 'H': 1}, 1, 1),
+            # Chlorine has two stable isotopes, 35Cl (75.77%) and 37Cl (24.23%)
+            ('M(Cl37)+H[1+]', {'Cl': -1, '(Cl37)': 1, 'H': 1}, 1, 1),
+            ('M+H+Na[2+]', {'H': 1, 'Na': 1}, 2, 1),
+            ('M+K[1+]', {'K': 1}, 1, 1),
+            ('M+NaCl[1+]', {'Na': 1, 'Cl': 1, 'H': 1}, 1, 1),           # M+NaCl+H
+            ('M-H2O+H[1+]', {'H': -1, 'O': -1}, 1, 1),
+            ('M-H4O2+H[1+]', {'H': -3, 'O': -2}, 1, 1),
+            ('M-NH3+H[1+]', {'H': -2, 'N': -1}, 1, 1),
+            ('M-CO+H[1+]', {'H': 1, 'C': -1, 'O': -1}, 1, 1),
+            ('M-CO2+H[1+]', {'H': 1, 'C': -1, 'O': -2}, 1, 1),
+            ('M-HCOOH+H[1+]', {'H': -1, 'C': -1, 'O': -2}, 1, 1),
+            ('M+HCOONa[1+]', {'H': 2, 'C': 1, 'O': 2, 'Na': 1}, 1, 1),  # M+HCOONa+H
+            ('M-C3H4O2+H[1+]', {'H': -3, 'C': -3, 'O': -2}, 1, 1),
+            ('M+HCOOK[1+]', {'H': 2, 'C': 1, 'O': 2, 'K': 1}, 1, 1),    # M+HCOOK+H
+            # removed, too infrequent
+            # (mw - 67.9874 + PROTON, 'M-HCOONa+H[1+]', 'HCO2Na'),
+            # (mw - 83.9613 + PROTON, 'M-HCOOK+H[1+]', 'HCO2K'),
+        ],
+        'multimer': [
+            ('2M+H[1+]', {'H': 1}, 1, 2),
+            ('2M+Na[1+]', {'Na': 1}, 1, 2),
+            ('2M+NH4[1+]', {'H': 4, 'N': 1}, 1, 2),
+        ],
+    },
+    'neg': {
+        'primary': [
+            ('M-H[-]', {'H': -1}, -1, 1),
+            ('M[-]', {}, -1, 1),
+            ('M-H2O-H[-]', {'H': -3, 'O': -1}, -1, 1),
+            ('M+Cl[-]', {'Cl': 1}, -1, 1),
+        ],
+        'extended': [
+            ('M(C13)-H[-]', {'C': -1, '(C13)': 1, 'H': -1}, -1, 1),
+            ('M+Cl37[-]', {'(Cl37)': 1}, -1, 1),
+            ('M(Cl37)-H[-]', {'Cl': -1, '(Cl37)': 1, 'H': -1}, -1, 1),
+            ('M(S34)-H[-]', {'S': -1, '(S34)': 1, 'H': -1}, -1, 1),
+            ('M-2H[2-]', {'H': -2}, -2, 1),
+            ('M+Na-2H[-]', {'H': -2, 'Na': 1}, -1, 1),
+            ('M+K-2H[-]', {'H': -2, 'K': 1}, -1, 1),
+            ('M+Br[-]', {'Br': 1}, -1, 1),
+            ('M+Br81[-]', {'(Br81)': 1}, -1, 1),
+            ('M+ACN-H[-]', {'C': 2, 'H': 2, 'N': 1}, -1, 1),
+            ('M+HCOO[-]', {'C': 1, 'H': 1, 'O': 2}, -1, 1),
+            ('M+CH3COO[-]', {'C': 2, 'H': 3, 'O': 2}, -1, 1),
+            ('M-H+O[-]', {'H': -1, 'O': 1}, -1, 1),
+        ],
+        'multimer': [
+            ('2M-H[-]', {'H': -1}, -1, 2),
+            ('2M+Cl[-]', {'Cl': 1}, -1, 2),
+        ],
+    },
+}
+
+
+def _element_mass(name, massDict=atom_mass_dict):
+    # isotopes as '(C13)' in formula changes are '[13C]' in NIST data
+    m = re.fullmatch(r'\(([A-Z][a-z]*)(\d+)\)', name)
+    if m:
+        name = '[%s%s]' % (m.group(2), m.group(1))
+    return massDict[name]
+
+
+class AdductTable:
+    '''
+    Adducts of one ionization mode as arrays, so that adducts of many compounds are computed at once.
+
+    Attributes
+    ----------
+    ions: list of ion names, e.g. 'M+H[1+]'.
+    delta_formulas: list of formula change dictionaries.
+    charges: signed charges, int array.
+    multipliers: number of M in the ion, e.g. 2 for 2M+H[1+], int array.
+    mass_offsets: mass of formula change minus charge * ELECTRON, float array.
+    delta_matrix, elements: formula changes as an element-count matrix and its columns.
+
+    Example
+    -------
+    table = get_adduct_table('pos', primary_only=True).extend(ADDUCT_DEFINITIONS['pos']['multimer'])
+    mz = table.compute_mz(neutral_masses)      # shape (number of masses, number of adducts)
+    '''
+    def __init__(self, definitions):
+        '''
+        definitions: list of (ion, formula change, charge, number of M), as in ADDUCT_DEFINITIONS.
+        '''
+        self.definitions = [(ion, dict(delta), int(charge), int(multiplier))
+                            for ion, delta, charge, multiplier in definitions]
+        self.ions = [x[0] for x in self.definitions]
+        self.delta_formulas = [x[1] for x in self.definitions]
+        self.charges = np.array([x[2] for x in self.definitions], dtype=int)
+        self.multipliers = np.array([x[3] for x in self.definitions], dtype=int)
+        self.delta_matrix, self.elements = formula_dicts_to_matrix(self.delta_formulas)
+        element_masses = np.array([_element_mass(x) for x in self.elements], dtype=np.float64)
+        self.mass_offsets = self.delta_matrix @ element_masses - self.charges * ELECTRON
+        for x in (self.charges, self.multipliers, self.delta_matrix, self.mass_offsets):
+            x.setflags(write=False)         # tables are shared by get_adduct_table
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def extend(self, definitions):
+        '''
+        Return a new AdductTable with added definitions, e.g. user-defined adducts or multimers,
+        [('2M+H[1+]', {'H': 1}, 1, 2), ...].
+        '''
+        return AdductTable(self.definitions + list(definitions))
+
+    def compute_mz(self, masses):
+        '''
+        Return m/z of all adducts for an array of neutral masses, shape (len(masses), len(self)).
+        '''
+        masses = np.asarray(masses, dtype=np.float64)
+        return (masses[:, None] * self.multipliers + self.mass_offsets) / np.abs(self.charges)
+
+    def compute_formula_matrix(self, adduct_number, neutral_matrix, elements):
+        '''
+        Apply one adduct to an element-count matrix of neutral formulae.
+
+        Return
+        ======
+        result_matrix, result_elements, valid;
+        valid is a boolean array, False where the result has negative or no atoms, as add_formula_dict.
+        '''
+        result_elements = hill_order(set(elements) | set(self.elements))
+        result_matrix = (align_formula_matrix(neutral_matrix, elements, result_elements)
+                         * self.multipliers[adduct_number]
+                         + align_formula_matrix(self.delta_matrix[adduct_number: adduct_number+1],
+                                                self.elements, result_elements))
+        valid = (result_matrix >= 0).all(axis=1) & (result_matrix > 0).any(axis=1)
+        return result_matrix, result_elements, valid
+
+    def check_valid(self, neutral_matrix, elements):
+        '''
+        Return boolean array of shape (number of formulae, number of adducts),
+        True where the adduct is valid for the neutral formula, as in compute_adducts_formulae.
+        '''
+        return check_formula_changes(neutral_matrix, elements, self.delta_matrix, self.elements,
+                                     multipliers=self.multipliers, nonempty=True)
+
+
+@lru_cache(maxsize=None)
+def get_adduct_table(mode='pos', primary_only=False):
+    '''
+    Return the AdductTable for mode, 'pos' or 'neg', built once from ADDUCT_DEFINITIONS.
+    '''
+    definitions = ADDUCT_DEFINITIONS[mode]['primary']
+    if not primary_only:
+        definitions = definitions + ADDUCT_DEFINITIONS[mode]['extended']
+    return AdductTable(definitions)
+
+
 def __get_adduct_list__(mw, mode, primary_only):
     '''
     Return list of adduct or isotope, [(mz, ion, formula_change_dictionary), ...].
@@ -189,87 +374,11 @@ def __get_adduct_list__(mw, mode, primary_only):
     Enforcing primary ions because others are not valid without them;
     but logic implemented in search functions, not here.
     '''
+    table = get_adduct_table(mode, primary_only)
+    return [Ion(*L) for L in zip(table.compute_mz([mw])[0].tolist(), table.ions, table.delta_formulas)]
 
-    if mode == 'pos': 
-        primaryList = [
-            (mw - ELECTRON, 'M[1+]', {}),                              # e not changing formula
-            (mw + PROTON, 'M+H[1+]', {'H': 1}),                        #  
-            (mw + 21.9820 + PROTON, 'M+Na[1+]', {'Na': 1}),            # Na = 21.9820 + PROTON = 22.9893
-            (mw + 18.0106 + PROTON, 'M+H2O+H[1+]', {'H': 3, 'O':1}),   #  
-            (mw + 18.033823, 'M+NH4[1+]', {'H': 4, 'N': 1}),
-            ]
-        if primary_only:
-            return [Ion(*L) for L in primaryList]
-
-        else:
-            extendedList = [
-                # Use {'C':-1} to force check that C exists in formula
-                (mw +1.0034 - ELECTRON, 'M(C13)[1+]', {'C':-1, '(C13)':1}), 
-                (mw +1.0034 + PROTON, 'M(C13)+H[1+]', {'C':-1, '(C13)':1, 'H':1}),
-                
-                (mw/2 + PROTON, 'M+2H[2+]', {'H': 2}),
-                (mw/3 + PROTON, 'M+3H[3+]', {'H': 3}),
-
-                (mw/2 + 0.5017 + PROTON, 'M(C13)+2H[2+]', {'C':-1, '(C13)':1, 'H':2}),
-                (mw/3 + 0.3344 + PROTON, 'M(C13)+3H[3+]', {'C':-1, '(C13)':1, 'H':3}),
-                # Sulfur:  32S (95.02%), 33S (0.75%), 34S (4.21%), .
-                (mw +1.9958 + PROTON, 'M(S34)+H[1+]', {'S':-1, '(S34)':1, 'H':1}),
-                # Chlorine has two stable isotopes, 35Cl (75.77%) and 37Cl (24.23%)
-                (mw +1.9972 + PROTON, 'M(Cl37)+H[1+]', {'Cl':-1, '(Cl37)':1, 'H':1}),
-                
-                (mw/2 + 10.991 + PROTON, 'M+H+Na[2+]', {'H':1, 'Na':1}),
-                (mw + 37.9555 + PROTON, 'M+K[1+]', {'K':1}),         # K = 37.9555 + PROTON = 38.9628
-                (mw + 57.9586 + PROTON, 'M+NaCl[1+]', {'Na': 1, 'Cl': 1}), 
-                
-                (mw - 18.0106 + PROTON, 'M-H2O+H[1+]', {'H': -1, 'O': -1}), 
-                (mw - 36.0212 + PROTON, 'M-H4O2+H[1+]', {'H': -3, 'O': -2}),
-                (mw - 17.0265 + PROTON, 'M-NH3+H[1+]', {'H': -2, 'N': -1}),
-                (mw - 27.9950 + PROTON, 'M-CO+H[1+]', {'H': 1, 'C': -1, 'O': -1}),
-                (mw - 43.9898 + PROTON, 'M-CO2+H[1+]', {'H': 1, 'C': -1, 'O': -2}),
-                (mw - 46.0054 + PROTON, 'M-HCOOH+H[1+]', {'H': -1, 'C': -1, 'O': -2}),
-                (mw + 67.9874 + PROTON, 'M+HCOONa[1+]', {'H': 1, 'C': 1, 'O': 2, 'Na': 1}),
-                (mw - 72.0211 + PROTON, 'M-C3H4O2+H[1+]', {'H': -3, 'C': -3, 'O': -2}),
-                (mw + 83.9613 + PROTON, 'M+HCOOK[1+]', {'H': 1, 'C': 1, 'O': 2, 'K': 1}),
-
-                # removed, too infrequent
-                # (mw - 67.9874 + PROTON, 'M-HCOONa+H[1+]', 'HCO2Na'),
-                # (mw - 83.9613 + PROTON, 'M-HCOOK+H[1+]', 'HCO2K'),
-                ]
-            return [Ion(*L) for L in primaryList + extendedList]
-
-    elif mode == 'neg':
-        primaryList = [
-            (mw - PROTON, 'M-H[-]', {'H': -1}),       
-            (mw + ELECTRON, 'M[-]', {}), 
-            (mw - 18.0106 - PROTON, 'M-H2O-H[-]', {'H': -3, 'O':-1}),   
-            (mw + 34.9689, 'M+Cl[-]', {'Cl':1}),
-            ]
-        if primary_only:
-            return [Ion(*L) for L in primaryList]
 
-        else:
-            extendedList = [
-                (mw + 1.0034 - PROTON, 'M(C13)-H[-]', {'C':-1, '(C13)':1, 'H':-1}),
-                (mw + 36.9659, 'M+Cl37[-]', {'(Cl37)':1}),
-                (mw + 1.9972 - PROTON, 'M(Cl37)-H[-]', {'Cl':-1, '(Cl37)':1, 'H':-1}),
-                (mw + 1.9958 - PROTON, 'M(S34)-H[-]', {'S':-1, '(S34)':1, 'H':-1}),
-
-                (mw/2 - PROTON, 'M-2H[2-]', {'H': -2}),
-                (mw + 22.9893 - 2*PROTON, 'M+Na-2H[-]', {'H':-2, 'Na':1}),
-                (mw + 38.9628 - 2*PROTON, 'M+K-2H[-]', {'H':-2, 'K':1}),
-                
-                (mw + 78.9183, 'M+Br[-]', {'Br':1}),
-                (mw + 80.9163, 'M+Br81[-]', {'(Br81)':1}),
-
-                (mw + 40.01926853323, 'M+ACN-H[-]', {'C':2, 'H':2, 'N':1}),
-                (mw + 1.007825 + 12 + 2*15.99491, 'M+HCOO[-]', {'C':1, 'H':1, 'O':2}),
-                (mw + 59.013295, 'M+CH3COO[-]', {'C':2, 'H':3, 'O':2}),
-                (mw - PROTON + 15.99491, 'M-H+O[-]', {'H': -1, 'O':1}),
-                ]
-            return [Ion(*L) for L in primaryList + extendedList]
-
-
-def compute_adducts_formulae(mw, neutral_formula,  mode='pos', primary_only=False):
+def compute_adducts_formulae(mw, neutral_formula,  mode='pos', primary_only=False, adduct_table=None):
     '''
     Calculating isotopes and adducts, return m/z and formulae.
 
@@ -284,40 +393,39 @@ def compute_adducts_formulae(mw, neutral_formula,  mode='pos', primary_only=Fals
     {'C': 3, 'H': 6, 'N': 2, 'O': 2} changed by {'C': -1, 'H': 1, 'O': -1} 
         = {'C': 2, 'H': 5, 'N': 2, 'O': 1}
 
+    Adducts are defined in ADDUCT_DEFINITIONS;
+    adduct_table, an AdductTable, can be given for user-defined adducts, and replaces mode and primary_only.
+
     Return
     -------
     List of adducts: e.g. [(58.53894096677, 'M+2H[2+]', result_formula), ...,]
 
     '''
+    if adduct_table is None:
+        adduct_table = get_adduct_table(mode, primary_only)
     dict_neutral_formula = parse_chemformula_dict(neutral_formula)
     adducts2get = []
-    for x in __get_adduct_list__(mw, mode, primary_only):
-        # ['mz', 'ion', 'delta_formula']
-        result = add_formula_dict(dict_neutral_formula, x.delta_formula)
+    for mz, ion, delta, multiplier in zip(adduct_table.compute_mz([mw])[0].tolist(), adduct_table.ions,
+                                          adduct_table.delta_formulas, adduct_table.multipliers.tolist()):
+        result = add_formula_dict({k: v * multiplier for k, v in dict_neutral_formula.items()}, delta)
         if result:
-            adducts2get.append( [x.mz, x.ion, dict_to_hill_formula(result)] )
+            adducts2get.append( [mz, ion, dict_to_hill_formula(result)] )
 
     return adducts2get
 
 
 def calculate_formula_diff(FM_D1, FM_D2):
     '''
-    Calculate the differences between two formula dictionaries (FM_D1 - FM_D2), and return a formula dictionary documenting the differences
-    
+    Calculate the differences between two formula dictionaries (FM_D1 - FM_D2), and return a formula dictionary documenting the differences.
+    The input dictionaries are not modified.
+    For many pairs of formulae, see reaction_network.find_reaction_edges.
     '''
-    unique_elements = set(list(FM_D1.keys()) + list(FM_D2.keys()))
-    
-    for e in unique_elements:      # update the dictionary with keys that present in another formula
-        if e not in FM_D1:
-            FM_D1.update({e:0})
-        if e not in FM_D2:
-            FM_D2.update({e:0})
-    
-    diff_dict = {key: FM_D1[key] - FM_D2.get(key, 0) for key in FM_D1}
+    unique_elements = set(FM_D1) | set(FM_D2)
+    diff_dict = {key: FM_D1.get(key, 0) - FM_D2.get(key, 0) for key in unique_elements}
     diff_dict = {k:v for k,v in diff_dict.items() if v !=0} # remove those with zero
-    if not all([x > 0 for x in diff_dict.values()]) or not all([x < 0 for x in diff_dict.values()]):
+    if not (all([x > 0 for x in diff_dict.values()]) or all([x < 0 for x in diff_dict.values()])):
         warnings.warn('the differences between the two formulas are not all positive or all negative values')
-    
+
     return(diff_dict)
 
 def adjust_salt_formula(F, export_str = True):
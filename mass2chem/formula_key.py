@@ -0,0 +1,257 @@
+'''
+Packed integer keys of chemical formulae.
+
+A formula key packs the element counts of a formula into one or two 64-bit words,
+each element a fixed bit field storing count + bias, so that negative counts (formula changes) are allowed.
+Keys are compared and hashed as integers, and formulae are added or subtracted by integer arithmetic,
+e.g. key(C6H12O6) - key(H2O) = key(C6H10O5).
+Arrays of keys are numpy arrays, of uint64 for one-word layouts or of a structured type of words otherwise,
+which can be sorted, deduplicated (np.unique) and joined without building strings or dictionaries.
+
+FormulaCodec converts between keys, element-count matrices (see formula_matrix) and Hill formula strings.
+Conversions to and from strings go through interning caches, so each distinct formula is formatted or parsed once.
+
+Example
+-------
+codec = FormulaCodec()
+keys = codec.from_hill(['C6H12O6', 'C5H10O5'])
+codec.to_hill(codec.subtract(keys, codec.from_hill(['H2O', 'H2O'])))
+    ['C6H10O5', 'C5H8O4']
+'''
+
+import re
+import numpy as np
+
+from .formula_matrix import parse_formula_matrix, hill_order
+
+# Bits per element, in two 64-bit words. An element of b bits holds counts in [-2**(b-1), 2**(b-1)).
+DEFAULT_LAYOUT = [
+    [('C', 10), ('H', 11), ('N', 8), ('O', 9), ('P', 6), ('S', 6), ('F', 7), ('Cl', 5)],
+    [('Br', 4), ('I', 5), ('Na', 4), ('K', 4), ('Si', 5), ('B', 4), ('Se', 4), ('Mg', 4), ('Ca', 4), ('Fe', 4),
+     ('[13C]', 10), ('D', 7), ('[15N]', 5)],
+]
+
+
+# isotopes as '(C13)' in Hill strings of formula.dict_to_hill_formula
+_PAREN_ISOTOPE_PATTERN = re.compile(r'\(([A-Z][a-z]?)(\d+)\)')
+
+
+def _isotope_name(name):
+    # '(C13)', as in formula.dict_to_hill_formula, is '[13C]' in formula_matrix
+    if name.startswith('(') and name.endswith(')'):
+        symbol = name[1:-1].rstrip('0123456789')
+        return '[%s%s]' % (name[1 + len(symbol):-1], symbol)
+    return name
+
+
+class FormulaCodec:
+    '''
+    Encoder and decoder of packed formula keys, for a layout of elements and bits.
+
+    Keys are numpy arrays of self.dtype; a single key is a Python int (words combined, first word highest),
+    as used by encode, decode and the interning caches.
+    Counts outside the range of a field raise ValueError when encoded,
+    but are not checked in add and subtract, which are plain integer arithmetic.
+    '''
+    def __init__(self, layout=DEFAULT_LAYOUT):
+        '''
+        layout: list of words, each a list of (element, bits), total bits of a word not over 64.
+        '''
+        self.layout = [list(word) for word in layout]
+        self.number_words = len(self.layout)
+        self.elements, self._word, self._shift, self._bits = [], [], [], []
+        for ii, word in enumerate(self.layout):
+            shift = 0
+            for element, bits in word:
+                self.elements.append(element)
+                self._word.append(ii)
+                self._shift.append(shift)
+                self._bits.append(bits)
+                shift += bits
+            if shift > 64:
+                raise ValueError("Word %d of layout has %d bits, over 64." % (ii, shift))
+        self._word = np.array(self._word)
+        self._shift = np.array(self._shift, dtype=np.uint64)
+        self._bits = np.array(self._bits)
+        self._bias = 2 ** (self._bits - 1)
+        self._column = {x: jj for jj, x in enumerate(self.elements)}
+        # bias of each word, the key of empty formula
+        self._word_bias = [sum(int(self._bias[jj]) << int(self._shift[jj])
+                               for jj in np.flatnonzero(self._word == ii)) for ii in range(self.number_words)]
+        if self.number_words == 1:
+            self.dtype = np.dtype(np.uint64)
+        else:
+            self.dtype = np.dtype([('w%d' % ii, np.uint64) for ii in range(self.number_words)])
+        self._hill_cache = {}
+        self._key_cache = {}
+
+    @classmethod
+    def fit(cls, matrix, elements):
+        '''
+        Return a FormulaCodec with a layout for the elements of nonzero counts in an element-count matrix,
+        each of bits enough for the sum or difference of any two rows, packed into as few words as fit in order.
+        '''
+        if hasattr(matrix, 'toarray'):
+            matrix = matrix.toarray()
+        max_counts = np.abs(np.asarray(matrix, dtype=np.int64)).max(axis=0, initial=0)
+        layout, word, shift = [], [], 0
+        for x, max_count in zip(elements, max_counts.tolist()):
+            if max_count:
+                bits = max_count.bit_length() + 2
+                if shift + bits > 64:
+                    layout.append(word)
+                    word, shift = [], 0
+                word.append((_isotope_name(x), bits))
+                shift += bits
+        layout.append(word)
+        return cls(layout)
+
+    def words(self, keys):
+        '''List of word arrays of keys.'''
+        if self.number_words == 1:
+            return [keys]
+        return [keys['w%d' % ii] for ii in range(self.number_words)]
+
+    def _from_words(self, words):
+        if self.number_words == 1:
+            return words[0]
+        keys = np.empty(len(words[0]), dtype=self.dtype)
+        for ii, w in enumerate(words):
+            keys['w%d' % ii] = w
+        return keys
+
+    def encode_matrix(self, matrix, elements):
+        '''
+        Return keys of an element-count matrix (numpy array or scipy.sparse), columns named by elements.
+        '''
+        if hasattr(matrix, 'toarray'):
+            matrix = matrix.toarray()
+        matrix = np.asarray(matrix, dtype=np.int64)
+        fields = np.tile(self._bias, (matrix.shape[0], 1))
+        for jj, x in enumerate(elements):
+            name = _isotope_name(x)
+            if name in self._column:
+                fields[:, self._column[name]] += matrix[:, jj]
+            elif matrix[:, jj].any():
+                raise ValueError("Element %s is not in the layout of FormulaCodec." % x)
+        out_of_range = ((fields < 0) | (fields >= 2 * self._bias)).any(axis=0)
+        if out_of_range.any():
+            raise ValueError("Counts out of range for elements %s."
+                             % [self.elements[cc] for cc in np.flatnonzero(out_of_range)])
+        words = [np.zeros(matrix.shape[0], dtype=np.uint64) for ii in range(self.number_words)]
+        for cc in range(len(self.elements)):
+            words[self._word[cc]] |= fields[:, cc].astype(np.uint64) << self._shift[cc]
+        return self._from_words(words)
+
+    def decode_matrix(self, keys):
+        '''
+        Return element-count matrix of keys, and its columns, self.elements.
+        '''
+        words = self.words(np.asarray(keys, dtype=self.dtype))
+        matrix = np.empty((len(words[0]), len(self.elements)), dtype=np.int64)
+        for cc in range(len(self.elements)):
+            field = (words[self._word[cc]] >> self._shift[cc]) & np.uint64(2 ** int(self._bits[cc]) - 1)
+            matrix[:, cc] = field.astype(np.int64) - self._bias[cc]
+        return matrix, list(self.elements)
+
+    def add(self, keys1, keys2):
+        '''Keys of the sums of formulae, elementwise.'''
+        words = [w1 + w2 - np.uint64(b) for w1, w2, b in
+                 zip(self.words(keys1), self.words(keys2), self._word_bias)]
+        return self._from_words(words)
+
+    def subtract(self, keys1, keys2):
+        '''Keys of the differences of formulae (keys1 - keys2), elementwise.'''
+        words = [w1 - w2 + np.uint64(b) for w1, w2, b in
+                 zip(self.words(keys1), self.words(keys2), self._word_bias)]
+        return self._from_words(words)
+
+    def unique(self, keys, return_inverse=False):
+        '''
+        Sorted unique keys, as np.unique, but sorting words by np.lexsort, faster than on structured arrays.
+        '''
+        keys = np.asarray(keys, dtype=self.dtype)
+        words = self.words(keys)
+        order = np.lexsort(words[::-1])
+        is_new = np.zeros(len(keys), dtype=bool)
+        is_new[:1] = True
+        for w in words:
+            sorted_w = w[order]
+            is_new[1:] |= sorted_w[1:] != sorted_w[:-1]
+        unique_keys = keys[order[is_new]]
+        if not return_inverse:
+            return unique_keys
+        inverse = np.empty(len(keys), dtype=np.intp)
+        inverse[order] = np.cumsum(is_new) - 1
+        return unique_keys, inverse
+
+    def to_int(self, keys):
+        '''List of keys as Python ints.'''
+        words = [w.tolist() for w in self.words(np.asarray(keys, dtype=self.dtype))]
+        if self.number_words == 1:
+            return words[0]
+        result = words[0]
+        for w in words[1:]:
+            result = [(a << 64) | b for a, b in zip(result, w)]
+        return result
+
+    def from_int(self, list_ints):
+        '''Array of keys from Python ints.'''
+        mask = (1 << 64) - 1
+        words = [np.array([(x >> (64 * (self.number_words - 1 - ii))) & mask for x in list_ints], dtype=np.uint64)
+                 for ii in range(self.number_words)]
+        return self._from_words(words)
+
+    def encode(self, formula_dict):
+        '''Key of a formula dictionary, as Python int.'''
+        elements = list(formula_dict)
+        return self.to_int(self.encode_matrix([[formula_dict[x] for x in elements]], elements))[0]
+
+    def decode(self, key):
+        '''Formula dictionary of a key, without elements of zero count.'''
+        row = self.decode_matrix(self.from_int([key]))[0][0]
+        return {self.elements[jj]: int(row[jj]) for jj in np.flatnonzero(row)}
+
+    def _format_hill(self, keys):
+        # Hill strings of keys, formatted from decoded counts
+        matrix, elements = self.decode_matrix(keys)
+        order = [elements.index(x) for x in hill_order(elements)]
+        matrix = matrix[:, order]
+        names = [elements[jj] for jj in order]
+        rows, cols = np.nonzero(matrix)
+        counts = matrix[rows, cols].tolist()
+        pieces = [names[c] + (str(n) if n != 1 else '') for c, n in zip(cols.tolist(), counts)]
+        bounds = np.searchsorted(rows, np.arange(matrix.shape[0] + 1)).tolist()
+        return [''.join(pieces[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def to_hill(self, keys):
+        '''
+        Return list of Hill formula strings of keys: C, H, other elements in alphabetical order,
+        and isotopes in brackets. Formatted once per distinct key, through the interning cache.
+        '''
+        list_ints = self.to_int(keys)
+        cache = self._hill_cache
+        missing = list({x for x in list_ints if x not in cache})
+        if missing:
+            cache.update(zip(missing, self._format_hill(self.from_int(missing))))
+            for x in missing:
+                self._key_cache.setdefault(cache[x], x)
+        return [cache[x] for x in list_ints]
+
+    def from_hill(self, formulas):
+        '''
+        Return array of keys of formula strings, parsed by formula_matrix.parse_formula_matrix,
+        once per distinct string, through the interning cache.
+        Isotopes written as '(C13)', as in formula.dict_to_hill_formula, are read as '[13C]'.
+        '''
+        cache = self._key_cache
+        missing = list({x for x in formulas if x not in cache})
+        if missing:
+            matrix, elements = parse_formula_matrix([_PAREN_ISOTOPE_PATTERN.sub(r'[\2\1]', x) for x in missing])
+            cache.update(zip(missing, self.to_int(self.encode_matrix(matrix, elements))))
+        return self.from_int([cache[x] for x in formulas])
+
+    def clear_cache(self):
+        '''Empty the interning caches.'''
+        self._hill_cache.clear()
+        self._key_cache.clear()
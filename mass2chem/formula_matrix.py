@@ -0,0 +1,278 @@
+'''
+Chemical formulae in bulk, as element-count matrices.
+
+A list of N formulae is represented as an integer matrix of N rows and one column per element or isotope,
+together with the list of column names, e.g.
+parse_formula_matrix(['C6H12O6', 'C2H5NO2'])
+    (array([[ 6, 12,  0,  6],
+            [ 2,  5,  1,  2]], dtype=int32), ['C', 'H', 'N', 'O'])
+
+Parsing follows the rules of formula.parse_chemformula_dict_comprehensive:
+isotopes in brackets (e.g. [13C]) are separate columns, negative counts are allowed,
+repeated elements are summed, and additive compounds after '·' are removed by default.
+All unique formulae are joined and parsed by one pass of regular expression searches,
+and operations on formulae become array operations on the matrix,
+e.g. monoisotopic masses are the product of the matrix and a vector of element masses, see calculate_formula_masses.
+'''
+
+import re
+import numpy as np
+from scipy import sparse as sp
+
+from .source_data.NIST_isotope_data import NIST_ISOTOPE_DATA
+
+# masses of all elements and isotopes (e.g. '[13C]', 'D') in NIST_ISOTOPE_DATA, as a vector
+NIST_NAMES = list(NIST_ISOTOPE_DATA['elements']) + list(NIST_ISOTOPE_DATA['isotopes'])
+NIST_MASS_VECTOR = np.array(
+    [NIST_ISOTOPE_DATA['elements'][x] for x in NIST_ISOTOPE_DATA['elements']]
+    + [NIST_ISOTOPE_DATA['isotopes'][x] for x in NIST_ISOTOPE_DATA['isotopes']], dtype=np.float64)
+_NIST_COLUMN = {x: ii for ii, x in enumerate(NIST_NAMES)}
+
+# a newline delimits formulae in the joined string; it is not part of any formula.
+# Names and counts are found by two searches, which give aligned lists of plain strings.
+_NAME_PATTERN_NEGATIVE = re.compile(r'\n|\[\d*[A-Z][a-z]*\]|[A-Z][a-z]*')
+_COUNT_PATTERN_NEGATIVE = re.compile(r'(?:\n|\[\d*[A-Z][a-z]*\]|[A-Z][a-z]*)(-?\d*)')
+_NAME_PATTERN = re.compile(r'\n|[A-Z][a-z]*')
+_COUNT_PATTERN = re.compile(r'(?:\n|[A-Z][a-z]*)(\d*)')
+_ADDITIVE_PATTERN = re.compile(r'·[^\n]*')
+
+
+def hill_order(elements):
+    '''
+    Sort element names in Hill order, C, H and others in alphabetical order.
+    Isotopes in brackets, e.g. '[13C]', come after elements.
+    '''
+    others = sorted(x for x in elements if x not in ('C', 'H'))
+    return [x for x in ('C', 'H') if x in elements] + others
+
+
+def _parse_tokens(formulas, remove_additive_cpd, handle_negative_number):
+    '''
+    Return row numbers, name numbers and counts of all (element, count) tokens in formulas,
+    and the list of names.
+    '''
+    joined = '\n'.join(formulas)
+    if remove_additive_cpd:
+        joined = _ADDITIVE_PATTERN.sub('', joined)
+    if handle_negative_number:
+        names = _NAME_PATTERN_NEGATIVE.findall(joined)
+        counts = _COUNT_PATTERN_NEGATIVE.findall(joined)
+    else:
+        names = _NAME_PATTERN.findall(joined)
+        counts = _COUNT_PATTERN.findall(joined)
+
+    # few distinct names and counts, converted by dictionary lookups
+    found = sorted(set(names) - {'\n'})
+    numbering = {x: ii for ii, x in enumerate(found)}
+    numbering['\n'] = -1
+    name_numbers = np.fromiter(map(numbering.__getitem__, names), dtype=np.intp, count=len(names))
+    values = {x: int(x) if x else 1 for x in set(counts)}
+    counts = np.fromiter(map(values.__getitem__, counts), dtype=np.int64, count=len(counts))
+    is_newline = name_numbers == -1
+    rows = np.cumsum(is_newline)[~is_newline]
+    return rows, name_numbers[~is_newline], counts[~is_newline], found
+
+
+def parse_formula_matrix(formulas, elements=None, remove_additive_cpd=True, handle_negative_number=True,
+                         dtype=np.int32, sparse=False):
+    '''
+    Parse a list of formulae into an element-count matrix.
+    Same rules as formula.parse_chemformula_dict_comprehensive.
+    Duplicate formulae are parsed once.
+
+    Input
+    =====
+    formulas: list, array or pandas Series of formula strings, e.g. ['C6H12O6', '[13C]6H12O6', 'C-2H-2O-2'].
+            Missing values (non-strings, e.g. NaN) give rows of zeros.
+    elements: list of column names. Default all elements and isotopes found, in Hill order.
+            ValueError is raised if a formula has elements not in this list.
+    remove_additive_cpd: remove additive compounds, e.g. '[13C]4H12N2·2HCl' is parsed as '[13C]4H12N2'.
+    handle_negative_number: parse negative counts and isotopes in brackets.
+            If False, formulae are parsed as formula.parse_chemformula_dict_comprehensive does in this case.
+    dtype: integer type of matrix.
+    sparse: return a scipy.sparse CSR matrix instead of a numpy array.
+
+    Return
+    ======
+    matrix, elements; matrix of shape (len(formulas), len(elements)).
+    '''
+    formulas = [x if isinstance(x, str) else '' for x in formulas]
+    numbering = {x: ii for ii, x in enumerate(dict.fromkeys(formulas))}
+    inverse = np.fromiter(map(numbering.__getitem__, formulas), dtype=np.intp, count=len(formulas))
+    rows, name_numbers, counts, found = _parse_tokens(list(numbering), remove_additive_cpd, handle_negative_number)
+
+    if elements is None:
+        elements = hill_order(found)
+    else:
+        elements = list(elements)
+        unknown = set(found) - set(elements)
+        if unknown:
+            raise ValueError("Elements not in list of elements: %s" % sorted(unknown))
+    column_of_found = np.array([elements.index(x) for x in found], dtype=np.intp)
+    cols = column_of_found[name_numbers]
+
+    shape = (len(numbering), len(elements))
+    if sparse:
+        # coo to csr sums counts of repeated elements
+        matrix = sp.coo_matrix((counts.astype(dtype), (rows, cols)), shape=shape).tocsr()
+        return matrix[inverse], elements
+    matrix = np.zeros(shape, dtype=dtype)
+    np.add.at(matrix, (rows, cols), counts)
+    return matrix[inverse], elements
+
+
+def formula_dicts_to_matrix(list_dicts, elements=None, dtype=np.int32):
+    '''
+    Convert a list of formula dictionaries, e.g. [{'C': 6, 'H': 12, 'O': 6}, ...],
+    into an element-count matrix. Returns matrix, elements, as parse_formula_matrix.
+    '''
+    if elements is None:
+        elements = hill_order(set().union(*list_dicts) if list_dicts else set())
+    column = {x: ii for ii, x in enumerate(elements)}
+    matrix = np.zeros((len(list_dicts), len(elements)), dtype=dtype)
+    for ii, d in enumerate(list_dicts):
+        for k, v in d.items():
+            matrix[ii, column[k]] = v
+    return matrix, list(elements)
+
+
+def matrix_to_formula_dicts(matrix, elements):
+    '''
+    Convert an element-count matrix (numpy array or scipy.sparse) into a list of formula dictionaries.
+    Elements of zero count are not included.
+    '''
+    if sp.issparse(matrix):
+        matrix = matrix.toarray()
+    matrix = np.asarray(matrix)
+    return [{elements[jj]: int(row[jj]) for jj in np.flatnonzero(row)} for row in matrix]
+
+
+def matrix_to_hill_formulas(matrix, elements):
+    '''
+    Convert an element-count matrix into a list of formula strings, same as formula.dict_to_hill_formula
+    on matrix_to_formula_dicts: C, (C13), H, then other elements in alphabetical order, zero counts left out.
+    Strings are built column by column, from the range of counts of each column, not formula by formula.
+    '''
+    if sp.issparse(matrix):
+        matrix = matrix.toarray()
+    matrix = np.asarray(matrix)
+    others = sorted(x for x in elements if x not in ('C', 'H', '(C13)'))
+    order = [x for x in ('C', '(C13)', 'H') if x in elements] + others
+    formulas = np.full(matrix.shape[0], '', dtype=object)
+    for x in order:
+        column = matrix[:, elements.index(x)]
+        rows = np.flatnonzero(column)
+        if rows.size:
+            # pieces of the range of counts in the column, looked up by count
+            low, high = int(column[rows].min()), int(column[rows].max())
+            pieces = np.array([x + (str(n) if n != 1 else '') for n in range(low, high + 1)], dtype=object)
+            formulas[rows] += pieces[column[rows] - low]
+    return formulas.tolist()
+
+
+def align_formula_matrix(matrix, elements, new_elements):
+    '''
+    Return matrix with columns reordered or expanded to new_elements, which must include all elements
+    of nonzero counts in matrix. This allows combining matrices parsed separately.
+    '''
+    if sp.issparse(matrix):
+        matrix = matrix.toarray()
+    new_matrix = np.zeros((matrix.shape[0], len(new_elements)), dtype=matrix.dtype)
+    new_column = {x: ii for ii, x in enumerate(new_elements)}
+    for jj, x in enumerate(elements):
+        if x in new_column:
+            new_matrix[:, new_column[x]] = matrix[:, jj]
+        elif matrix[:, jj].any():
+            raise ValueError("Element %s not in new_elements." % x)
+    return new_matrix
+
+
+def mass_vector(elements, massDict=None):
+    '''
+    Return masses of elements as a float64 array, aligned with the columns of an element-count matrix.
+    Default masses from NIST_MASS_VECTOR; massDict, e.g. formula.atom_mass_dict, can be used instead.
+    KeyError is raised for unknown elements.
+    '''
+    if massDict is None:
+        return NIST_MASS_VECTOR[[_NIST_COLUMN[x] for x in elements]]
+    return np.array([massDict[x] for x in elements], dtype=np.float64)
+
+
+def calculate_formula_masses(formulas, elements=None, massDict=None):
+    '''
+    Calculate monoisotopic masses of many formulae, as matrix-vector product.
+    Isotopes in brackets are included, e.g. '[13C]6H12O6'.
+
+    Input
+    =====
+    formulas: list of formula strings, or element-count matrix (numpy array or scipy.sparse).
+    elements: column names if formulas is a matrix.
+    massDict: optional dictionary of element masses. See mass_vector.
+
+    Return
+    ======
+    numpy array of masses, float64.
+    '''
+    if isinstance(formulas, np.ndarray) or sp.issparse(formulas):
+        if elements is None:
+            raise ValueError("elements are required for a formula matrix.")
+        matrix = formulas
+    else:
+        matrix, elements = parse_formula_matrix(formulas)
+    return np.asarray(matrix @ mass_vector(elements, massDict), dtype=np.float64)
+
+
+def _aligned_pair(matrix1, elements1, matrix2, elements2):
+    # both matrices as numpy arrays over the union of elements
+    elements = hill_order(set(elements1) | set(elements2))
+    return (align_formula_matrix(matrix1, elements1, elements),
+            align_formula_matrix(matrix2, elements2, elements), elements)
+
+
+def check_elemental_subset_matrix(matrix1, elements1, matrix2, elements2):
+    '''
+    Vectorized formula.check_elemental_subset: whether formula j of matrix2 is a subunit of formula i of matrix1,
+    i.e. no element has more atoms in j than in i.
+    E.g. which of N formulae can lose a fragment: check_elemental_subset_matrix(matrix, elements, fragment, fragment_elements)[:, 0].
+
+    Return
+    ======
+    boolean array of shape (number of formulae in matrix1, number of formulae in matrix2).
+    '''
+    matrix1, matrix2, elements = _aligned_pair(matrix1, elements1, matrix2, elements2)
+    result = np.ones((matrix1.shape[0], matrix2.shape[0]), dtype=bool)
+    for jj in range(len(elements)):
+        result &= matrix1[:, jj, None] >= matrix2[None, :, jj]
+    return result
+
+
+def check_formula_changes(matrix, elements, change_matrix, change_elements, multipliers=None, nonempty=False):
+    '''
+    Vectorized validity check of formula.add_formula_dict: whether change j can apply to formula i,
+    i.e. formula i + change j has no negative number of atoms.
+    E.g. which adducts or neutral losses are valid for each compound.
+
+    Input
+    =====
+    matrix, elements: element-count matrix of formulae.
+    change_matrix, change_elements: element-count matrix of formula changes, e.g. {'H': -2, 'O': -1} for loss of water.
+    multipliers: optional number of each formula per change, e.g. 2 for the adduct 2M+H[1+].
+    nonempty: also require at least one atom in the result, as compute_adducts_formulae does.
+
+    Return
+    ======
+    boolean array of shape (number of formulae, number of changes).
+    '''
+    matrix, change_matrix, elements = _aligned_pair(matrix, elements, change_matrix, change_elements)
+    if multipliers is None:
+        multipliers = np.ones(change_matrix.shape[0], dtype=int)
+    result = np.ones((matrix.shape[0], change_matrix.shape[0]), dtype=bool)
+    any_atom = np.zeros_like(result)
+    for jj in range(len(elements)):
+        counts = matrix[:, jj, None].astype(np.int64) * multipliers[None, :] + change_matrix[None, :, jj]
+        result &= counts >= 0
+        if nonempty:
+            any_atom |= counts > 0
+    if nonempty:
+        result &= any_atom
+    return result
@@ -3,6 +3,8 @@ import os
 import json
 import numpy as np
 
+from .peaks import PeakArray
+
 # from metDataModel.core import Feature
 
 # intensities is a list; mass_id links to MassTrace
@@ -122,6 +124,44 @@ def read_features(feature_table,
     return L
 
 
+def read_features_peak_array(feature_table, 
+                        id_col=0, mz_col=1, rtime_col=2, 
+                        intensity_cols=(3,4), delimiter="\t"):
+    '''
+    Read a text feature table into a compact PeakArray, without building a dictionary per feature.
+    Same parameters as read_features. 
+
+    Return
+    ------
+    PeakArray with fields 'id', 'mz', 'rtime', 'representative_intensity', 
+    where representative_intensity is mean value of intensity_cols.
+    '''
+    featureLines = open(feature_table).read().splitlines()
+    header = featureLines[0].split(delimiter)
+    print("table headers ordered: ", header[mz_col], header[rtime_col])
+    ids, mzs, rtimes, intensities = [], [], [], []
+    xstart, xend = intensity_cols
+    for ii in range(1, len(featureLines)):
+        if featureLines[ii].strip():
+            a = featureLines[ii].split(delimiter)
+            if isinstance(id_col, int):
+                ids.append(a[id_col])
+            else:
+                ids.append('row'+str(ii))
+            mzs.append(a[mz_col])
+            rtimes.append(a[rtime_col])
+            intensities.append(a[xstart: xend])
+    print("Read %d feature lines" %len(ids))
+    # a header-only table gives an empty PeakArray
+    intensities = np.array(intensities, dtype=np.float64).reshape(len(ids), -1) if ids else np.zeros((0, 1))
+    return PeakArray.from_columns(
+        id=np.array(ids, dtype=str), 
+        mz=np.array(mzs, dtype=np.float64), 
+        rtime=np.array(rtimes, dtype=np.float64),
+        representative_intensity=intensities.mean(axis=1),
+    )
+
+
 def get_json_peaklist_from_featuretable(feature_table, outfile='',
                         id_col=0, mz_col=1, rtime_col=2, intensity_cols=(11,12), delimiter="\t"):
     '''
@@ -0,0 +1,380 @@
+'''
+Isotope envelopes of chemical formulae by pruned polynomial convolution.
+
+The isotope distribution of a molecule is the product of the polynomials of its atoms,
+each atom a polynomial of its isotopes, (p_12C x^m_12C + p_13C x^m_13C)^nC (p_1H x^m_1H + p_2H x^m_2H)^nH ...
+The power of each element is computed by repeated squaring, and the elements are multiplied together.
+After each multiplication, terms below a probability threshold are pruned, so the size stays small.
+
+Two modes:
+- 'fine', the isotopic fine structure; terms of masses within fine_tolerance are merged,
+  e.g. M+1 from 13C (1.00336) and from 15N (0.99703) are separate peaks.
+- 'nominal', terms of the same nominal mass are merged, with abundance-weighted average mass.
+  The polynomials are arrays over nominal mass offsets, multiplied by scipy.signal.convolve,
+  which uses FFT for long arrays.
+
+Isotopic compositions are from source_data/NIST_isotopic_composition.py, masses from NIST_isotope_data.
+Labeled atoms in formula, e.g. '[13C]2C4H12O6' or 'D3', are counted at their isotopic mass, abundance 1.
+
+For whole compound databases, isotope_patterns_batch computes envelopes in a process pool,
+and keeps them in a size-bounded disk cache (cache.DiskCache) shared by jobs.
+
+Observed isotopic clusters are scored against theoretical envelopes of candidate formulae in bulk,
+as matrices of intensities at M+0, M+1, ..., see cluster_intensity_matrix, envelope_matrix and score_isotope_patterns.
+
+Example
+-------
+masses, abundances = isotope_envelope('C64H120O6', mode='nominal', min_abundance=0.001)
+patterns = isotope_patterns_batch(list_formulas, min_abundance=0.01)
+
+observed = cluster_intensity_matrix(peaks['mz'], peaks['height'], anchor_rows, rtimes=peaks['apex'])
+theoretical, valid = envelope_matrix(candidate_formulas)
+scores = score_isotope_patterns(observed, theoretical)     # (clusters, formulae)
+cluster_numbers, formula_numbers = np.nonzero(scores >= 0.95)
+'''
+
+import os
+import multiprocessing
+from functools import lru_cache, partial
+import numpy as np
+from scipy.signal import convolve
+
+from . import __version__
+from .cache import DiskCache, get_cache_dir
+from .formula import parse_chemformula_dict_comprehensive
+from .formula_matrix import calculate_formula_masses
+from .mass_index import SortedMassIndex, MzRtGridIndex
+from .source_data.NIST_isotope_data import NIST_ISOTOPE_DATA
+from .source_data.NIST_isotopic_composition import NIST_ISOTOPIC_COMPOSITION
+
+# m/z spacing of isotopic peaks of charge 1, 13C - 12C
+ISOTOPE_SPACING = 1.003355
+
+# terms are pruned during multiplication at min_abundance * _PRUNE_FACTOR,
+# so that sums of pruned terms are unlikely to reach min_abundance in final peaks
+_PRUNE_FACTOR = 1e-3
+
+
+def _mass_number(isotope):
+    # e.g. '[13C]' -> 13
+    return int(isotope[1:].rstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz]'))
+
+
+@lru_cache(maxsize=None)
+def element_isotopes(element):
+    '''
+    Return isotopes of element in natural abundance, as arrays (masses, abundances, nominal_offsets),
+    nominal_offsets being mass numbers relative to the lightest isotope.
+    Labeled isotopes, e.g. '[13C]' and 'D', have a single isotope of abundance 1.
+    '''
+    if element in NIST_ISOTOPIC_COMPOSITION:
+        isotopes = [(k, v) for k, v in NIST_ISOTOPIC_COMPOSITION[element].items() if v > 0]
+        masses = np.array([NIST_ISOTOPE_DATA['isotopes'][k] for k, v in isotopes])
+        abundances = np.array([v for k, v in isotopes])
+        numbers = np.array([_mass_number(k) for k, v in isotopes])
+    elif element in NIST_ISOTOPE_DATA['isotopes']:
+        masses, abundances, numbers = np.array([NIST_ISOTOPE_DATA['isotopes'][element]]), np.ones(1), np.zeros(1, int)
+    else:
+        raise ValueError("No isotopic composition for element %s." % element)
+    offsets = numbers - numbers.min()
+    for x in (masses, abundances, offsets):
+        x.setflags(write=False)
+    return masses, abundances, offsets
+
+
+def _merge_fine(masses, probabilities, tolerance):
+    # merge terms of masses within tolerance, at abundance-weighted average mass
+    order = np.argsort(masses, kind='stable')
+    masses, probabilities = masses[order], probabilities[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(masses) > tolerance])
+    merged = np.add.reduceat(probabilities, starts)
+    return np.add.reduceat(probabilities * masses, starts) / merged, merged
+
+
+def _multiply_fine(d1, d2, prune, tolerance):
+    probabilities = np.outer(d1[1], d2[1]).ravel()
+    masses = np.add.outer(d1[0], d2[0]).ravel()
+    keep = probabilities >= prune
+    return _merge_fine(masses[keep], probabilities[keep], tolerance)
+
+
+def _multiply_nominal(d1, d2, prune):
+    # d as (start offset, probabilities, probabilities * masses) over consecutive nominal offsets
+    probabilities = convolve(d1[1], d2[1])
+    weighted_masses = convolve(d1[2], d2[1]) + convolve(d1[1], d2[2])
+    keep = np.flatnonzero(probabilities >= prune)
+    if not keep.size:
+        return (d1[0] + d2[0], np.zeros(0), np.zeros(0))
+    first, last = keep[0], keep[-1] + 1
+    return (d1[0] + d2[0] + first, probabilities[first:last], weighted_masses[first:last])
+
+
+def _power(base, n, multiply, identity):
+    result = identity
+    while n:
+        if n & 1:
+            result = multiply(result, base)
+        n >>= 1
+        if n:
+            base = multiply(base, base)
+    return result
+
+
+@lru_cache(maxsize=4096)
+def element_envelope(element, count, mode='fine', prune=1e-7, fine_tolerance=1e-5):
+    '''
+    Isotope distribution of count atoms of element, as in isotope_envelope,
+    pruned at probability prune. Cached, as the same elements and counts recur in many formulae.
+    '''
+    masses, abundances, offsets = element_isotopes(element)
+    if mode == 'fine':
+        result = _power((masses, abundances), count,
+                        lambda d1, d2: _multiply_fine(d1, d2, prune, fine_tolerance), (np.zeros(1), np.ones(1)))
+    elif mode == 'nominal':
+        probabilities = np.zeros(offsets.max() + 1)
+        weighted_masses = np.zeros(offsets.max() + 1)
+        np.add.at(probabilities, offsets, abundances)
+        np.add.at(weighted_masses, offsets, abundances * masses)
+        result = _power((0, probabilities, weighted_masses), count,
+                        lambda d1, d2: _multiply_nominal(d1, d2, prune), (0, np.ones(1), np.zeros(1)))
+    else:
+        raise ValueError("mode must be 'fine' or 'nominal'.")
+    for x in result[1:] if mode == 'nominal' else result:
+        x.setflags(write=False)
+    return result
+
+
+def isotope_envelope(formula, mode='fine', min_abundance=0.001, fine_tolerance=1e-5):
+    '''
+    Compute the isotope envelope of a formula.
+
+    Input
+    =====
+    formula: formula string, e.g. 'C64H120O6', '[13C]6H12O6', or formula dictionary.
+    mode: 'fine' for isotopic fine structure, or 'nominal' for peaks at nominal masses.
+    min_abundance: minimal abundance of peaks to return, as probability (same as min_NAP in IsotopologueEnumerator).
+    fine_tolerance: in fine mode, peaks within this mass difference (Da) are merged.
+
+    Return
+    ======
+    masses, abundances; numpy arrays sorted by mass. Abundances are probabilities, summing to 1 before pruning.
+    Masses are of neutral molecules; add adducts and divide by charge for m/z.
+    '''
+    if isinstance(formula, str):
+        formula = parse_chemformula_dict_comprehensive(formula)
+    if any(count < 0 for count in formula.values()):
+        raise ValueError("Negative number of atoms in formula %s." % formula)
+    prune = min_abundance * _PRUNE_FACTOR
+    if mode == 'fine':
+        result = (np.zeros(1), np.ones(1))
+        for element, count in sorted(formula.items()):
+            if count:
+                result = _multiply_fine(result, element_envelope(element, count, mode, prune, fine_tolerance),
+                                        prune, fine_tolerance)
+        masses, abundances = result
+    elif mode == 'nominal':
+        result = (0, np.ones(1), np.zeros(1))
+        for element, count in sorted(formula.items()):
+            if count:
+                result = _multiply_nominal(result, element_envelope(element, count, mode, prune), prune)
+        abundances = result[1]
+        masses = result[2] / np.where(abundances > 0, abundances, 1)
+    else:
+        raise ValueError("mode must be 'fine' or 'nominal'.")
+    keep = abundances >= min_abundance
+    return masses[keep], abundances[keep]
+
+
+def _encode_pattern(pattern):
+    # masses and abundances as one little-endian float64 blob
+    return np.concatenate(pattern).astype('<f8').tobytes()
+
+
+def _decode_pattern(blob):
+    values = np.frombuffer(blob, dtype='<f8')
+    half = len(values) // 2
+    return values[:half].copy(), values[half:].copy()
+
+
+def _isotope_envelope_or_none(formula, **parameters):
+    # invalid formulae give None, not failing the batch
+    try:
+        return isotope_envelope(formula, **parameters)
+    except (ValueError, KeyError):
+        return None
+
+
+def isotope_patterns_batch(formulas, mode='fine', min_abundance=0.001, fine_tolerance=1e-5,
+                           workers=None, use_cache=True, cache_dir=None, max_cache_bytes=2**30, chunksize=64):
+    '''
+    Compute isotope envelopes of many formulae, e.g. all formulae of a compound database,
+    in a process pool and through a disk cache, so that patterns are computed once across jobs.
+
+    Input
+    =====
+    formulas: list of formula strings. Duplicates are computed once.
+    mode, min_abundance, fine_tolerance: as in isotope_envelope.
+    workers: number of processes. Default os.cpu_count(). If 1, run in the current process.
+    use_cache: read and write patterns in the cache, file isotope_patterns.sqlite in the cache directory,
+            keyed by formula, mode, min_abundance, fine_tolerance and version of mass2chem.
+    cache_dir: cache directory, see cache.get_cache_dir.
+    max_cache_bytes: size limit of the cache; least recently used patterns are evicted beyond it.
+    chunksize: number of formulae sent to a process at a time.
+
+    Return
+    ======
+    Dictionary of formula to (masses, abundances) as returned by isotope_envelope,
+    or None for formulae that cannot be computed, e.g. of unknown elements or negative counts.
+    '''
+    unique_formulas = list(dict.fromkeys(formulas))
+    parameters = dict(mode=mode, min_abundance=min_abundance, fine_tolerance=fine_tolerance)
+    patterns = {}
+    if use_cache:
+        cache = DiskCache(os.path.join(get_cache_dir(cache_dir), 'isotope_patterns.sqlite'), max_cache_bytes)
+        prefix = '%s|%s|%r|%r|' % (__version__, mode, min_abundance, fine_tolerance)
+        found = cache.get_many([prefix + x for x in unique_formulas])
+        for x in unique_formulas:
+            if prefix + x in found:
+                patterns[x] = _decode_pattern(found[prefix + x])
+
+    missing = [x for x in unique_formulas if x not in patterns]
+    workers = workers or os.cpu_count() or 1
+    compute = partial(_isotope_envelope_or_none, **parameters)
+    if workers == 1 or len(missing) <= chunksize:
+        computed = [compute(x) for x in missing]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            computed = pool.map(compute, missing, chunksize=chunksize)
+    patterns.update(zip(missing, computed))
+
+    if use_cache and missing:
+        cache.set_many({prefix + x: _encode_pattern(pattern)
+                        for x, pattern in zip(missing, computed) if pattern is not None})
+    return {x: patterns[x] for x in unique_formulas}
+
+
+def envelope_matrix(formulas, number_peaks=4, min_abundance=0.0001, **batch_parameters):
+    '''
+    Theoretical isotope envelopes of formulae at nominal mass offsets, as a matrix.
+
+    Input
+    =====
+    formulas: list of formula strings, e.g. candidate formulae.
+    number_peaks: number of peaks, M+0 to M+(number_peaks-1).
+    min_abundance: as in isotope_envelope; lower peaks are zero.
+    batch_parameters: other arguments to isotope_patterns_batch, e.g. workers, use_cache, cache_dir.
+
+    Return
+    ======
+    matrix, valid; matrix of abundances (probabilities) of shape (len(formulas), number_peaks),
+    valid a boolean array, False for formulae that cannot be computed, whose rows are zeros.
+    '''
+    patterns = isotope_patterns_batch(formulas, mode='nominal', min_abundance=min_abundance, **batch_parameters)
+    unique_formulas = [x for x, pattern in patterns.items() if pattern is not None]
+    monoisotopic = dict(zip(unique_formulas, calculate_formula_masses(unique_formulas)))
+    matrix = np.zeros((len(formulas), number_peaks))
+    valid = np.zeros(len(formulas), dtype=bool)
+    for ii, x in enumerate(formulas):
+        if patterns[x] is not None:
+            masses, abundances = patterns[x]
+            offsets = np.rint(masses - monoisotopic[x]).astype(np.intp)
+            keep = (offsets >= 0) & (offsets < number_peaks)
+            matrix[ii, offsets[keep]] = abundances[keep]
+            valid[ii] = True
+    return matrix, valid
+
+
+def cluster_intensity_matrix(mzs, intensities, anchor_numbers, number_peaks=4, charges=1,
+                             mz_tolerance_ppm=5, rtimes=None, rt_tolerance=5):
+    '''
+    Observed intensities of isotopic clusters, at anchor m/z + n * ISOTOPE_SPACING / charge.
+
+    Input
+    =====
+    mzs, intensities: arrays of peaks, e.g. peaks['mz'] and peaks['height'] of a PeakArray.
+    anchor_numbers: row numbers of the M+0 peaks of clusters.
+    number_peaks: number of peaks, M+0 to M+(number_peaks-1).
+    charges: charge of each cluster, scalar or array aligned with anchor_numbers; sign is ignored.
+    mz_tolerance_ppm: m/z tolerance of M+n peaks. Intensities of all peaks within tolerance are summed,
+            so that a wider tolerance merges isotopic fine structure (e.g. 13C and 15N at M+1).
+    rtimes, rt_tolerance: optional retention times (e.g. peaks['apex']), to require M+n peaks to coelute.
+
+    Return
+    ======
+    matrix of intensities of shape (len(anchor_numbers), number_peaks), zero where no peak is found.
+    Column 0 is the intensity of the anchor peak.
+    '''
+    mzs = np.asarray(mzs, dtype=np.float64)
+    intensities = np.asarray(intensities, dtype=np.float64)
+    anchor_numbers = np.asarray(anchor_numbers, dtype=np.intp)
+    charges = np.abs(np.broadcast_to(np.asarray(charges, dtype=np.float64), anchor_numbers.shape))
+    matrix = np.zeros((len(anchor_numbers), number_peaks))
+    matrix[:, 0] = intensities[anchor_numbers]
+    if number_peaks < 2:
+        return matrix
+    # queries of M+1 ... M+n, as rows of (clusters, number_peaks - 1) flattened
+    steps = np.arange(1, number_peaks)
+    query_mzs = (mzs[anchor_numbers, None] + steps[None, :] * ISOTOPE_SPACING / charges[:, None]).ravel()
+    if rtimes is None:
+        query_numbers, rows = SortedMassIndex(mzs).find_all_batch(query_mzs, mz_tolerance_ppm)
+    else:
+        rtimes = np.asarray(rtimes, dtype=np.float64)
+        index = MzRtGridIndex(mzs, rtimes, rt_cell_width=max(rt_tolerance, 1))
+        query_numbers, rows = index.find_all_batch(query_mzs, np.repeat(rtimes[anchor_numbers], number_peaks - 1),
+                                                   mz_tolerance_ppm, rt_tolerance)
+    summed = np.bincount(query_numbers, weights=intensities[rows], minlength=len(query_mzs))
+    matrix[:, 1:] = summed.reshape(len(anchor_numbers), number_peaks - 1)
+    return matrix
+
+
+def _normalize_rows(matrix, ord):
+    norms = np.linalg.norm(matrix, ord=ord, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def score_isotope_patterns(observed, theoretical, pairs=None, method='cosine', chunk_size=1000):
+    '''
+    Spectral-fit scores of observed isotopic clusters against theoretical envelopes, in batch.
+
+    Input
+    =====
+    observed: matrix of intensities of clusters, (N, K), e.g. from cluster_intensity_matrix.
+    theoretical: matrix of abundances of formulae, (F, K), e.g. from envelope_matrix.
+    pairs: optional (cluster_numbers, formula_numbers) arrays, to score only these combinations.
+            Default all N x F combinations.
+    method: 'cosine', cosine similarity of intensity vectors (spectral contrast);
+            or 'overlap', 1 - half the sum of absolute differences of sum-normalized vectors.
+            Both are in [0, 1], 1 for identical patterns; intensity scale does not matter.
+    chunk_size: number of clusters scored at a time in 'overlap' method of all combinations.
+
+    Return
+    ======
+    scores, array of shape (N, F), or aligned with pairs.
+    Observed clusters or theoretical envelopes of all zeros score 0.
+    '''
+    observed = np.asarray(observed, dtype=np.float64)
+    theoretical = np.asarray(theoretical, dtype=np.float64)
+    if observed.shape[1] != theoretical.shape[1]:
+        raise ValueError("observed and theoretical must have the same number of peaks.")
+    if method == 'cosine':
+        observed, theoretical = _normalize_rows(observed, 2), _normalize_rows(theoretical, 2)
+        if pairs is None:
+            return observed @ theoretical.T
+        cluster_numbers, formula_numbers = pairs
+        return np.einsum('ij,ij->i', observed[cluster_numbers], theoretical[formula_numbers])
+    elif method == 'overlap':
+        observed, theoretical = _normalize_rows(observed, 1), _normalize_rows(theoretical, 1)
+        observed_empty, theoretical_empty = observed.sum(axis=1) == 0, theoretical.sum(axis=1) == 0
+        if pairs is None:
+            scores = np.empty((observed.shape[0], theoretical.shape[0]))
+            for start in range(0, observed.shape[0], chunk_size):
+                chunk = observed[start: start + chunk_size, None, :]
+                scores[start: start + chunk_size] = 1 - 0.5 * np.abs(chunk - theoretical[None, :, :]).sum(axis=2)
+            scores[observed_empty, :] = 0
+            scores[:, theoretical_empty] = 0
+            return scores
+        cluster_numbers, formula_numbers = pairs
+        scores = 1 - 0.5 * np.abs(observed[cluster_numbers] - theoretical[formula_numbers]).sum(axis=1)
+        scores[observed_empty[cluster_numbers] | theoretical_empty[formula_numbers]] = 0
+        return scores
+    raise ValueError("method must be 'cosine' or 'overlap'.")
@@ -0,0 +1,267 @@
+'''
+Stable isotope tracer experiments, e.g. 13C, 15N or 2H labeling.
+
+A compound of n atoms of the tracer element is observed as mass isotopologues M+0 ... M+n,
+at m/z of M+0 plus multiples of the tracer mass shift (e.g. 13C - 12C) divided by charge.
+The mass isotopomer distribution (MID) is the fraction of each of M+0, M+1, ...;
+it combines the labeling of tracer atoms and the natural abundance of all atoms.
+
+Functions here operate on arrays of features and formulae:
+- labeled_isotopologue_mzs and find_labeled_partners, m/z of M+n and search of M+n partners of features;
+- tracer_envelope_matrix, expected MIDs of formulae at given enrichments;
+- correct_natural_abundance, MIDs of labeled atoms from observed MIDs, by solving per feature
+  the matrix of natural abundance contributions, in batch.
+
+Natural abundances are from source_data/NIST_isotopic_composition.py, see isotopes.py.
+
+Example
+-------
+feature_i, feature_j, number_labels = find_labeled_partners(peaks['mz'], max_labels=40, rtimes=peaks['apex'])
+corrected = correct_natural_abundance(observed_mids, formulas, tracer='13C')
+'''
+
+import numpy as np
+from scipy.stats import binom
+
+from .formula_matrix import parse_formula_matrix, mass_vector
+from .isotopes import isotope_envelope
+from .mass_index import SortedMassIndex, MzRtGridIndex, _expand_ranges
+from .source_data.NIST_isotope_data import NIST_ISOTOPE_DATA
+from .source_data.NIST_isotopic_composition import NIST_ISOTOPIC_COMPOSITION
+
+# tracer: (element, light isotope, heavy isotope)
+TRACERS = {
+    '13C': ('C', '[12C]', '[13C]'),
+    '15N': ('N', '[14N]', '[15N]'),
+    '2H': ('H', '[1H]', '[2H]'),
+}
+
+
+def _tracer(tracer):
+    if tracer not in TRACERS:
+        raise ValueError("tracer must be one of %s." % list(TRACERS))
+    return TRACERS[tracer]
+
+
+def tracer_mass_shift(tracer='13C'):
+    '''Mass difference of heavy and light isotopes of tracer, e.g. 1.003355 for 13C.'''
+    element, light, heavy = _tracer(tracer)
+    return NIST_ISOTOPE_DATA['isotopes'][heavy] - NIST_ISOTOPE_DATA['isotopes'][light]
+
+
+def tracer_natural_abundance(tracer='13C'):
+    '''Natural abundance of the heavy isotope of tracer, e.g. 0.0107 for 13C.'''
+    element, light, heavy = _tracer(tracer)
+    return NIST_ISOTOPIC_COMPOSITION[element][heavy]
+
+
+def labeled_isotopologue_mzs(mzs, label_counts, tracer='13C', charges=1):
+    '''
+    Return m/z of labeled isotopologues M+0 ... M+n of features.
+
+    Input
+    =====
+    mzs: m/z of M+0 (unlabeled) of features.
+    label_counts: number of atoms of tracer element per feature, e.g. carbon counts, scalar or array.
+    tracer: '13C', '15N' or '2H'.
+    charges: charge per feature, scalar or array; sign is ignored.
+
+    Return
+    ======
+    matrix of shape (len(mzs), max(label_counts) + 1), column n the m/z of M+n, NaN where n > label count.
+    '''
+    mzs = np.asarray(mzs, dtype=np.float64)
+    label_counts = np.broadcast_to(np.asarray(label_counts, dtype=np.intp), mzs.shape)
+    charges = np.abs(np.broadcast_to(np.asarray(charges, dtype=np.float64), mzs.shape))
+    steps = np.arange(label_counts.max(initial=0) + 1)
+    matrix = mzs[:, None] + steps[None, :] * tracer_mass_shift(tracer) / charges[:, None]
+    matrix[steps[None, :] > label_counts[:, None]] = np.nan
+    return matrix
+
+
+def find_labeled_partners(mzs, label_counts=None, tracer='13C', charges=1, max_labels=40,
+                          mz_tolerance_ppm=5, rtimes=None, rt_tolerance=5):
+    '''
+    Find all M+n labeled partners of every feature, taking each feature as M+0.
+
+    Input
+    =====
+    mzs: m/z of features.
+    label_counts: optional maximal number of labels per feature, e.g. carbon count of its formula.
+            Default max_labels for all features.
+    tracer: '13C', '15N' or '2H'.
+    charges: charge per feature, scalar or array; sign is ignored.
+    max_labels: maximal n, if label_counts is not given.
+    mz_tolerance_ppm: m/z tolerance of partners.
+    rtimes, rt_tolerance: optional retention times of features (e.g. apex), to require coelution.
+
+    Return
+    ======
+    feature_i, feature_j, number_labels; aligned arrays, feature_j found at m/z of M+n of feature_i, n >= 1.
+    Sorted by feature_i, then number_labels.
+    '''
+    mzs = np.asarray(mzs, dtype=np.float64)
+    if label_counts is None:
+        label_counts = max_labels
+    label_counts = np.broadcast_to(np.asarray(label_counts, dtype=np.intp), mzs.shape)
+    charges = np.abs(np.broadcast_to(np.asarray(charges, dtype=np.float64), mzs.shape))
+    # one query per feature and n in 1 ... label count
+    query_features, positions = _expand_ranges(np.zeros(len(mzs), dtype=np.intp), label_counts)
+    number_labels = positions + 1
+    query_mzs = mzs[query_features] + number_labels * tracer_mass_shift(tracer) / charges[query_features]
+    if rtimes is None:
+        query_numbers, feature_j = SortedMassIndex(mzs).find_all_batch(query_mzs, mz_tolerance_ppm)
+    else:
+        rtimes = np.asarray(rtimes, dtype=np.float64)
+        index = MzRtGridIndex(mzs, rtimes, rt_cell_width=max(rt_tolerance, 1))
+        query_numbers, feature_j = index.find_all_batch(query_mzs, rtimes[query_features],
+                                                        mz_tolerance_ppm, rt_tolerance)
+    return query_features[query_numbers], feature_j, number_labels[query_numbers]
+
+
+def _split_tracer(formulas, element):
+    # counts of tracer element, and unique rows of the other elements with their inverse
+    matrix, elements = parse_formula_matrix(formulas)
+    if element in elements:
+        column = elements.index(element)
+        label_counts = matrix[:, column].astype(np.intp)
+        matrix = np.delete(matrix, column, axis=1)
+        elements = elements[:column] + elements[column + 1:]
+    else:
+        label_counts = np.zeros(len(formulas), dtype=np.intp)
+    rest, inverse = np.unique(matrix, axis=0, return_inverse=True)
+    return label_counts, rest, elements, inverse.ravel()
+
+
+def _natural_matrix(rest, elements, number_peaks, min_abundance):
+    # natural isotope envelopes of formulae at nominal offsets 0 ... number_peaks - 1 from the monoisotopic mass
+    monoisotopic = rest @ mass_vector(elements)
+    result = np.zeros((len(rest), number_peaks))
+    for ii, row in enumerate(rest):
+        masses, abundances = isotope_envelope({x: int(n) for x, n in zip(elements, row) if n},
+                                              mode='nominal', min_abundance=min_abundance)
+        offsets = np.rint(masses - monoisotopic[ii]).astype(np.intp)
+        # peaks below the monoisotopic mass, e.g. of 54Fe, are not in M+0 ... M+n
+        keep = (offsets >= 0) & (offsets < number_peaks)
+        result[ii, offsets[keep]] = abundances[keep]
+    return result
+
+
+def _binomial_matrix(counts, probabilities, number_peaks):
+    # rows of binomial probabilities of 0 ... number_peaks - 1 heavy atoms
+    return binom.pmf(np.arange(number_peaks)[None, :], counts[:, None], probabilities[:, None])
+
+
+def _convolve_rows(a, b):
+    # row-wise convolution, truncated to the number of columns
+    number_peaks = a.shape[1]
+    # power of 2, as FFT of lengths of large prime factors is slow
+    size = 1 << (2 * number_peaks - 1).bit_length()
+    result = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:, :number_peaks]
+    return np.clip(result, 0, None)
+
+
+def tracer_envelope_matrix(formulas, enrichments, tracer='13C', number_peaks=None, min_abundance=1e-6):
+    '''
+    Expected mass isotopomer distributions of formulae, each tracer atom being the heavy isotope
+    with probability of enrichment, the other elements at natural abundance.
+
+    Input
+    =====
+    formulas: list of formula strings.
+    enrichments: fraction of heavy isotope in tracer element, scalar or array aligned with formulas,
+            e.g. 0.0107 for natural abundance of 13C, 0.99 for uniformly labeled.
+    tracer: '13C', '15N' or '2H'.
+    number_peaks: number of columns, M+0 ... M+(number_peaks-1). Default maximal count of tracer element + 1.
+    min_abundance: abundances of natural envelopes of other elements below this are ignored.
+
+    Return
+    ======
+    matrix of shape (len(formulas), number_peaks), rows as fractions at nominal offsets from the monoisotopic mass.
+    Molecules lighter than monoisotopic, e.g. of 54Fe, are not included.
+    '''
+    element = _tracer(tracer)[0]
+    label_counts, rest, elements, inverse = _split_tracer(formulas, element)
+    if number_peaks is None:
+        number_peaks = int(label_counts.max(initial=0)) + 1
+    enrichments = np.broadcast_to(np.asarray(enrichments, dtype=np.float64), label_counts.shape)
+    natural = _natural_matrix(rest, elements, number_peaks, min_abundance)[inverse]
+    return _convolve_rows(natural, _binomial_matrix(label_counts, enrichments, number_peaks))
+
+
+def _correction_matrices(natural, label_counts, natural_abundance, tracer_purity):
+    # column j of each matrix, the distribution of M+0, M+1, ... given j labeled atoms
+    size, number_peaks = natural.shape
+    correction = np.empty((size, number_peaks, number_peaks))
+    for j in range(number_peaks):
+        unlabeled = np.maximum(label_counts - j, 0)
+        labeled = np.minimum(label_counts, j)
+        column = _convolve_rows(natural, _binomial_matrix(unlabeled, np.full(size, natural_abundance), number_peaks))
+        if tracer_purity == 1:
+            # labeled atoms shift by one each
+            shifted = np.zeros_like(column)
+            for k in np.unique(labeled):
+                rows = labeled == k
+                shifted[rows, k:] = column[rows, :number_peaks - k]
+            column = shifted
+        else:
+            column = _convolve_rows(column, _binomial_matrix(labeled, np.full(size, tracer_purity), number_peaks))
+        correction[:, :, j] = column
+    # j over the label count is not possible; identity columns keep matrices invertible
+    rows, cols = np.nonzero(np.arange(number_peaks)[None, :] > label_counts[:, None])
+    correction[rows, :, cols] = 0
+    correction[rows, cols, cols] = 1
+    return correction
+
+
+def correct_natural_abundance(observed, formulas, tracer='13C', tracer_purity=1.0, min_abundance=1e-6,
+                              chunk_size=2000):
+    '''
+    Correct observed mass isotopomer distributions for natural abundance and tracer purity,
+    giving the distributions of the number of labeled atoms.
+
+    For a feature of n tracer atoms, column j of its correction matrix is the distribution of M+0, M+1, ...
+    given j labeled atoms: the j labeled atoms at tracer_purity, the other n - j at natural abundance,
+    and the other elements at natural abundance. The matrix is inverted once per distinct formula,
+    and applied to the observed of all its features; negative values are set to zero, and rows normalized to sum 1.
+
+    Input
+    =====
+    observed: matrix of intensities of M+0, M+1, ... of features, shape (N, K).
+    formulas: list of N formula strings, unlabeled, of features.
+    tracer: '13C', '15N' or '2H'.
+    tracer_purity: fraction of heavy isotope in labeled positions, e.g. 0.99.
+    min_abundance: abundances of natural envelopes of other elements below this are ignored.
+    chunk_size: number of distinct formulae whose correction matrices are computed at a time.
+
+    Return
+    ======
+    matrix of shape (N, K), column j the fraction of molecules of j labeled atoms;
+    zero for j over the count of tracer element, and for rows of no intensity.
+    '''
+    observed = np.asarray(observed, dtype=np.float64)
+    element = _tracer(tracer)[0]
+    label_counts, rest, elements, inverse = _split_tracer(formulas, element)
+    number_peaks = observed.shape[1]
+    natural = _natural_matrix(rest, elements, number_peaks, min_abundance)
+    # one correction matrix per distinct formula, inverted once and applied to all its features
+    combinations, feature_combinations = np.unique(np.stack([inverse, label_counts], axis=1),
+                                                   axis=0, return_inverse=True)
+    feature_combinations = feature_combinations.ravel()
+    order = np.argsort(feature_combinations, kind='stable')
+    bounds = np.searchsorted(feature_combinations[order], np.arange(len(combinations) + 1))
+
+    corrected = np.zeros_like(observed)
+    for start in range(0, len(combinations), chunk_size):
+        stop = min(start + chunk_size, len(combinations))
+        correction = _correction_matrices(natural[combinations[start: stop, 0]], combinations[start: stop, 1],
+                                          tracer_natural_abundance(tracer), tracer_purity)
+        inverted = np.linalg.inv(correction)
+        features = order[bounds[start]: bounds[stop]]
+        corrected[features] = np.einsum('nij,nj->ni', inverted[feature_combinations[features] - start],
+                                        observed[features])
+
+    corrected[np.arange(number_peaks)[None, :] > label_counts[:, None]] = 0
+    corrected = np.clip(corrected, 0, None)
+    totals = corrected.sum(axis=1, keepdims=True)
+    return corrected / np.where(totals > 0, totals, 1)
@@ -0,0 +1,556 @@
+'''
+Array based indexing of peaks/features by mass, complementary to the centurion_tree in search.py.
+
+The centurion_tree is a dictionary of Python lists, which is simple and fast for single queries.
+When a whole feature table is searched against many patterns, the cost is dominated by
+Python-level dictionary lookups. Here masses are kept in a sorted NumPy array,
+next to the permutation back to the original order of peaks,
+so that one query or millions of queries are answered by np.searchsorted.
+
+Indices returned by the index classes always refer to the original order of input masses/peaks.
+
+SortedMassIndex and MzRtGridIndex can be saved to disk and reopened memory-mapped (save_index, load_index),
+or placed in shared memory for worker processes (share_index, attach_shared_index),
+so that one copy of the arrays serves all processes on a host.
+'''
+
+import os
+import sys
+import json
+import numpy as np
+from multiprocessing import shared_memory
+
+from .peaks import PeakArray
+
+
+def _expand_ranges(starts, ends):
+    '''
+    Expand ranges [starts[i], ends[i]) into flat arrays of (range_number, position).
+    This is the vectorized equivalent of
+    [(i, j) for i in range(len(starts)) for j in range(starts[i], ends[i])].
+    '''
+    counts = np.maximum(ends - starts, 0)
+    total = int(counts.sum())
+    range_numbers = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(starts, counts) + offsets
+    return range_numbers, positions
+
+
+class SortedMassIndex:
+    '''
+    Index of masses as a sorted NumPy array, with `order` as the permutation to original indices.
+    Matching follows find_all_matches_centurion_indexed_list, i.e. abs(mass - query_mz) < query_mz * limit_ppm * 1e-6.
+
+    Example
+    -------
+    index = SortedMassIndex.from_peaks(list_peaks)
+    query_numbers, peak_indices = index.find_all_batch(mz_array + 1.003355, limit_ppm=5)
+    '''
+    # attributes needed by queries, used to persist and share the index
+    _array_fields = ('order', 'sorted_masses')
+    _scalar_fields = ()
+
+    def __init__(self, masses, peaks=None):
+        '''
+        masses: list or array of mass values, e.g. m/z or neutral mass.
+        peaks: optional list of peaks in the same order of masses, returned by find_all_matches.
+        '''
+        masses = np.asarray(masses, dtype=np.float64)
+        self.order = np.argsort(masses, kind='stable')
+        self.sorted_masses = masses[self.order]
+        self.peaks = peaks
+
+    @classmethod
+    def from_peaks(cls, list_peaks, key='mz'):
+        '''
+        list_peaks: [{'parent_masstrace_id': 1670, 'mz': 133.09702315984987, 'apex': 654, 'height': 14388.0,
+                    'left_base': 648, 'right_base': 655, 'id_number': 555}, ...]
+        key: key used in list_peaks for mass value. Default 'mz'.
+        list_peaks can also be a PeakArray.
+        '''
+        if isinstance(list_peaks, PeakArray):
+            return cls(list_peaks[key], peaks=list_peaks)
+        return cls([p[key] for p in list_peaks], peaks=list_peaks)
+
+    def __len__(self):
+        return len(self.sorted_masses)
+
+    @property
+    def masses(self):
+        '''Masses in original order.'''
+        _m = np.empty_like(self.sorted_masses)
+        _m[self.order] = self.sorted_masses
+        return _m
+
+    def range_bounds(self, low, high):
+        '''
+        Return positions in sorted_masses, (lower, upper), for low < mass < high.
+        low and high can be scalars or arrays.
+        '''
+        return (np.searchsorted(self.sorted_masses, low, side='right'),
+                np.searchsorted(self.sorted_masses, high, side='left'))
+
+    def tolerance_bounds(self, query_mz, limit_ppm=5):
+        '''
+        Return positions in sorted_masses, (lower, upper), of masses within limit_ppm of query_mz.
+        query_mz can be a scalar or an array.
+        '''
+        query_mz = np.asarray(query_mz, dtype=np.float64)
+        mz_tol = query_mz * limit_ppm * 0.000001
+        return self.range_bounds(query_mz - mz_tol, query_mz + mz_tol)
+
+    def find_all(self, query_mz, limit_ppm=5):
+        '''
+        Return indices (original order) of all masses within limit_ppm of a single query_mz.
+        '''
+        lower, upper = self.tolerance_bounds(query_mz, limit_ppm)
+        return self.order[lower: upper]
+
+    def find_all_batch(self, query_mzs, limit_ppm=5):
+        '''
+        Return all matches to an array of query_mzs as two aligned arrays,
+        (query_numbers, indices), where query_numbers are positions in query_mzs
+        and indices are original indices of matched masses.
+        Pairs are ordered by query, then by mass.
+        limit_ppm can be a scalar or an array aligned to query_mzs.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        lower, upper = self.tolerance_bounds(query_mzs, limit_ppm)
+        query_numbers, positions = _expand_ranges(lower, upper)
+        # exact check of boundary values, to be consistent with centurion_tree functions
+        mz_tol = np.broadcast_to(query_mzs * np.asarray(limit_ppm) * 0.000001, query_mzs.shape)
+        _good = np.abs(self.sorted_masses[positions] - query_mzs[query_numbers]) < mz_tol[query_numbers]
+        return query_numbers[_good], self.order[positions[_good]]
+
+    def find_best(self, query_mz, limit_ppm=2):
+        '''
+        Return index (original order) of the closest mass within limit_ppm of query_mz, or None.
+        '''
+        best = self.find_best_batch(np.array([query_mz]), limit_ppm)[0]
+        if best < 0:
+            return None
+        return int(best)
+
+    def find_best_batch(self, query_mzs, limit_ppm=2):
+        '''
+        Return an array aligned to query_mzs, of indices (original order) of the closest mass
+        within limit_ppm, or -1 if no match.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        best = np.full(query_mzs.shape, -1, dtype=np.int64)
+        if len(self.sorted_masses) == 0:
+            return best
+        mz_tol = query_mzs * limit_ppm * 0.000001
+        right = np.searchsorted(self.sorted_masses, query_mzs)
+        left = np.clip(right - 1, 0, len(self.sorted_masses) - 1)
+        right = np.clip(right, 0, len(self.sorted_masses) - 1)
+        d_left = np.abs(self.sorted_masses[left] - query_mzs)
+        d_right = np.abs(self.sorted_masses[right] - query_mzs)
+        use_right = d_right < d_left
+        positions = np.where(use_right, right, left)
+        _d = np.where(use_right, d_right, d_left)
+        # first in input order among identical masses, as in centurion_tree functions
+        positions = np.searchsorted(self.sorted_masses, self.sorted_masses[positions], side='left')
+        _good = _d < mz_tol
+        best[_good] = self.order[positions[_good]]
+        return best
+
+    def find_all_matches(self, query_mz, limit_ppm=5):
+        '''
+        Return matched peaks within limit_ppm of query_mz,
+        same as find_all_matches_centurion_indexed_list. Requires the index built with peaks.
+        '''
+        return [self.peaks[ii] for ii in self.find_all(query_mz, limit_ppm)]
+
+    def find_best_match(self, query_mz, limit_ppm=2):
+        '''
+        Return best matched peak within limit_ppm of query_mz, or None,
+        same as find_best_match_centurion_indexed_list. Requires the index built with peaks.
+        '''
+        ii = self.find_best(query_mz, limit_ppm)
+        if ii is None:
+            return None
+        return self.peaks[ii]
+
+
+class MzRtGridIndex:
+    '''
+    Joint index of m/z and retention time (apex), for coelution-constrained lookups.
+    Peaks are binned into retention time cells of rt_cell_width, and sorted by m/z within each cell.
+    A query searches only the cells overlapping its RT window, 
+    so that candidates eluting far away are never returned.
+    Cells and m/z are combined into one sorted key, so that bulk queries use np.searchsorted.
+    Matching follows find_all_matches_centurion_indexed_list for m/z, 
+    and abs(rt - query_rt) <= rt_tolerance for retention time.
+
+    Example
+    -------
+    index = MzRtGridIndex.from_peaks(list_peaks, rt_cell_width=10)
+    query_numbers, peak_indices = index.find_all_batch(mz_array + 1.003355, apex_array, 
+                                                       limit_ppm=5, rt_tolerance=5)
+    '''
+    # attributes needed by queries, used to persist and share the index
+    _array_fields = ('order', 'sorted_keys', 'sorted_masses', 'sorted_rtimes')
+    _scalar_fields = ('rt_cell_width', 'mz_min', 'rt_min', 'cell_span', 'max_cell')
+
+    def __init__(self, masses, rtimes, rt_cell_width=10, peaks=None):
+        '''
+        masses: list or array of mass values, e.g. m/z.
+        rtimes: list or array of retention time, e.g. apex in scan numbers or seconds.
+        rt_cell_width: width of retention time cells, best similar to the RT tolerance used in queries.
+        peaks: optional list of peaks in the same order of masses, returned by find_all_matches.
+        '''
+        masses = np.asarray(masses, dtype=np.float64)
+        rtimes = np.asarray(rtimes, dtype=np.float64)
+        self.rt_cell_width = float(rt_cell_width)
+        self.peaks = peaks
+        if len(masses):
+            self.mz_min, self.rt_min = masses.min(), rtimes.min()
+            # key span per cell, wider than the m/z range so that cells do not overlap
+            self.cell_span = 2 ** np.ceil(np.log2(masses.max() - self.mz_min + 2))
+        else:
+            self.mz_min, self.rt_min, self.cell_span = 0.0, 0.0, 1.0
+        cells = self._rt_cell(rtimes)
+        keys = cells * self.cell_span + (masses - self.mz_min)
+        self.order = np.lexsort((masses, cells))
+        self.sorted_keys = keys[self.order]
+        self.sorted_masses = masses[self.order]
+        self.sorted_rtimes = rtimes[self.order]
+        self.max_cell = int(cells.max()) if len(masses) else -1
+
+    @classmethod
+    def from_peaks(cls, list_peaks, mz_key='mz', rt_key='apex', rt_cell_width=10):
+        '''
+        list_peaks: [{'parent_masstrace_id': 1670, 'mz': 133.09702315984987, 'apex': 654, 'height': 14388.0,
+                    'left_base': 648, 'right_base': 655, 'id_number': 555}, ...]
+        mz_key, rt_key: keys used in list_peaks for m/z and retention time.
+        list_peaks can also be a PeakArray.
+        '''
+        if isinstance(list_peaks, PeakArray):
+            return cls(list_peaks[mz_key], list_peaks[rt_key], rt_cell_width=rt_cell_width, peaks=list_peaks)
+        return cls([p[mz_key] for p in list_peaks], [p[rt_key] for p in list_peaks], 
+                   rt_cell_width=rt_cell_width, peaks=list_peaks)
+
+    def __len__(self):
+        return len(self.sorted_masses)
+
+    @property
+    def masses(self):
+        '''Masses in original order.'''
+        _m = np.empty_like(self.sorted_masses)
+        _m[self.order] = self.sorted_masses
+        return _m
+
+    @property
+    def rtimes(self):
+        '''Retention times in original order.'''
+        _rt = np.empty_like(self.sorted_rtimes)
+        _rt[self.order] = self.sorted_rtimes
+        return _rt
+
+    def _rt_cell(self, rtimes):
+        return np.floor((np.asarray(rtimes, dtype=np.float64) - self.rt_min) / self.rt_cell_width).astype(np.int64)
+
+    def find_all_batch(self, query_mzs, query_rtimes, limit_ppm=5, rt_tolerance=10):
+        '''
+        Return all peaks within limit_ppm of query_mzs and within rt_tolerance of query_rtimes,
+        as two aligned arrays (query_numbers, indices), 
+        where query_numbers are positions in query_mzs and indices are original indices of matched peaks.
+        Pairs are ordered by query, then by RT cell and m/z.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        query_rtimes = np.broadcast_to(np.asarray(query_rtimes, dtype=np.float64), query_mzs.shape)
+        mz_tol = query_mzs * limit_ppm * 0.000001
+        first_cells = np.maximum(self._rt_cell(query_rtimes - rt_tolerance), 0)
+        last_cells = np.minimum(self._rt_cell(query_rtimes + rt_tolerance), self.max_cell)
+        number_cells = int((last_cells - first_cells).max(initial=-1)) + 1
+
+        all_queries, all_positions = [], []
+        for k in range(number_cells):
+            cells = first_cells + k
+            valid = np.flatnonzero(cells <= last_cells)
+            base = cells[valid] * self.cell_span - self.mz_min
+            lower = np.searchsorted(self.sorted_keys, base + query_mzs[valid] - mz_tol[valid], side='left')
+            upper = np.searchsorted(self.sorted_keys, base + query_mzs[valid] + mz_tol[valid], side='right')
+            range_numbers, positions = _expand_ranges(lower, upper)
+            all_queries.append(valid[range_numbers])
+            all_positions.append(positions)
+        if not all_queries:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        query_numbers, positions = np.concatenate(all_queries), np.concatenate(all_positions)
+        # exact checks, as the combined keys are only used to find candidates
+        _good = (np.abs(self.sorted_masses[positions] - query_mzs[query_numbers]) < mz_tol[query_numbers]) & (
+                 np.abs(self.sorted_rtimes[positions] - query_rtimes[query_numbers]) <= rt_tolerance)
+        query_numbers, positions = query_numbers[_good], positions[_good]
+        _order = np.lexsort((positions, query_numbers))
+        return query_numbers[_order], self.order[positions[_order]]
+
+    def find_all(self, query_mz, query_rt, limit_ppm=5, rt_tolerance=10):
+        '''
+        Return indices (original order) of all peaks within limit_ppm of query_mz and rt_tolerance of query_rt.
+        '''
+        return self.find_all_batch(np.array([query_mz]), np.array([query_rt]), limit_ppm, rt_tolerance)[1]
+
+    def find_all_matches(self, query_mz, query_rt, limit_ppm=5, rt_tolerance=10):
+        '''
+        Return matched peaks within limit_ppm of query_mz and rt_tolerance of query_rt. 
+        Requires the index built with peaks.
+        '''
+        return [self.peaks[ii] for ii in self.find_all(query_mz, query_rt, limit_ppm, rt_tolerance)]
+
+
+class IncrementalMassIndex:
+    '''
+    Mass index supporting insertion and removal of peaks, e.g. for streaming acquisition,
+    where features are added as samples finish, without rebuilding the index.
+
+    New masses go to a small buffer, which is merged into the main sorted arrays 
+    when it grows over merge_fraction of the main arrays, so that insertion is amortized O(1) plus sorting.
+    Removal marks a peak as removed in O(1), and removed peaks are dropped at the next merge.
+    Each inserted mass/peak gets an integer handle, used in query results and for removal.
+    Queries follow SortedMassIndex, and the index can be used in place of a centurion_tree in
+    find_all_matches_centurion_indexed_list and find_best_match_centurion_indexed_list.
+
+    Example
+    -------
+    index = IncrementalMassIndex()
+    handles = index.insert_batch([p['mz'] for p in new_peaks], new_peaks)
+    index.remove(handles[0])
+    matched_peaks = index.find_all_matches(133.0970, limit_ppm=5)
+    '''
+    def __init__(self, masses=(), peaks=None, merge_fraction=0.1, min_buffer_size=1024):
+        '''
+        masses, peaks: optional initial masses and peaks in the same order.
+        merge_fraction: buffer is merged when larger than merge_fraction * size of main arrays.
+        min_buffer_size: buffer is not merged below this size.
+        '''
+        self.merge_fraction = merge_fraction
+        self.min_buffer_size = min_buffer_size
+        self._masses = np.zeros(0, dtype=np.float64)          # by handle
+        self._alive = np.zeros(0, dtype=bool)                 # by handle
+        self._peaks = []                                      # by handle
+        self._number_handles = 0
+        self._main = SortedMassIndex([])
+        self._main_handles = np.zeros(0, dtype=np.int64)
+        self._buffer_handles = []
+        self._buffer = None                                   # cached SortedMassIndex of buffer
+        if len(masses):
+            self.insert_batch(masses, peaks)
+            self.merge()
+
+    def __len__(self):
+        return int(self._alive[:self._number_handles].sum())
+
+    def _reserve(self, N):
+        # grow arrays by handle geometrically
+        if self._number_handles + N > len(self._masses):
+            size = max(2 * len(self._masses), self._number_handles + N, 16)
+            self._masses = np.concatenate((self._masses, np.zeros(size - len(self._masses))))
+            self._alive = np.concatenate((self._alive, np.zeros(size - len(self._alive), dtype=bool)))
+
+    def insert(self, mass, peak=None):
+        '''
+        Insert one mass, optionally with its peak. Return its handle.
+        '''
+        return int(self.insert_batch([mass], None if peak is None else [peak])[0])
+
+    def insert_batch(self, masses, peaks=None):
+        '''
+        Insert masses, optionally with peaks in the same order. Return array of handles.
+        '''
+        masses = np.asarray(masses, dtype=np.float64)
+        N = len(masses)
+        self._reserve(N)
+        handles = np.arange(self._number_handles, self._number_handles + N)
+        self._masses[handles] = masses
+        self._alive[handles] = True
+        self._peaks.extend(peaks if peaks is not None else [None] * N)
+        self._number_handles += N
+        self._buffer_handles.extend(handles.tolist())
+        self._buffer = None
+        if len(self._buffer_handles) > max(self.min_buffer_size, self.merge_fraction * len(self._main_handles)):
+            self.merge()
+        return handles
+
+    def remove(self, handle):
+        '''
+        Remove the mass/peak of handle. 
+        '''
+        self._alive[handle] = False
+
+    def remove_batch(self, handles):
+        '''
+        Remove masses/peaks of an array of handles. 
+        '''
+        self._alive[np.asarray(handles, dtype=np.int64)] = False
+
+    def merge(self):
+        '''
+        Merge buffer into main sorted arrays, and drop removed masses.
+        '''
+        handles = np.concatenate((self._main_handles, np.array(self._buffer_handles, dtype=np.int64)))
+        handles = handles[self._alive[handles]]
+        self._main = SortedMassIndex(self._masses[handles])
+        self._main_handles = handles
+        self._buffer_handles = []
+        self._buffer = None
+
+    def _buffer_index(self):
+        if self._buffer is None:
+            self._buffer = SortedMassIndex(self._masses[self._buffer_handles])
+        return self._buffer
+
+    def get_peak(self, handle):
+        return self._peaks[handle]
+
+    def find_all_batch(self, query_mzs, limit_ppm=5):
+        '''
+        Return all matches to an array of query_mzs as two aligned arrays, (query_numbers, handles).
+        Pairs are ordered by query, then by mass.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        q1, h1 = self._main.find_all_batch(query_mzs, limit_ppm)
+        h1 = self._main_handles[h1]
+        q2, h2 = self._buffer_index().find_all_batch(query_mzs, limit_ppm)
+        h2 = np.array(self._buffer_handles, dtype=np.int64)[h2]
+        query_numbers, handles = np.concatenate((q1, q2)), np.concatenate((h1, h2))
+        _good = self._alive[handles]
+        query_numbers, handles = query_numbers[_good], handles[_good]
+        _order = np.lexsort((handles, self._masses[handles], query_numbers))
+        return query_numbers[_order], handles[_order]
+
+    def find_best_batch(self, query_mzs, limit_ppm=2):
+        '''
+        Return an array aligned to query_mzs, of handles of the closest mass within limit_ppm, or -1 if no match.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        best = np.full(query_mzs.shape, -1, dtype=np.int64)
+        query_numbers, handles = self.find_all_batch(query_mzs, limit_ppm)
+        _order = np.lexsort((handles, np.abs(self._masses[handles] - query_mzs[query_numbers]), query_numbers))
+        query_numbers, handles = query_numbers[_order], handles[_order]
+        _first = np.ones(len(handles), dtype=bool)
+        _first[1:] = query_numbers[1:] != query_numbers[:-1]
+        best[query_numbers[_first]] = handles[_first]
+        return best
+
+    def find_all(self, query_mz, limit_ppm=5):
+        '''
+        Return handles of all masses within limit_ppm of a single query_mz.
+        '''
+        return self.find_all_batch(np.array([query_mz]), limit_ppm)[1]
+
+    def find_best(self, query_mz, limit_ppm=2):
+        '''
+        Return handle of the closest mass within limit_ppm of query_mz, or None.
+        '''
+        best = self.find_best_batch(np.array([query_mz]), limit_ppm)[0]
+        if best < 0:
+            return None
+        return int(best)
+
+    def find_all_matches(self, query_mz, limit_ppm=5):
+        '''
+        Return matched peaks within limit_ppm of query_mz, same as find_all_matches_centurion_indexed_list. 
+        '''
+        return [self._peaks[ii] for ii in self.find_all(query_mz, limit_ppm)]
+
+    def find_best_match(self, query_mz, limit_ppm=2):
+        '''
+        Return best matched peak within limit_ppm of query_mz, or None,
+        same as find_best_match_centurion_indexed_list.
+        '''
+        ii = self.find_best(query_mz, limit_ppm)
+        if ii is None:
+            return None
+        return self._peaks[ii]
+
+
+_PERSISTED_INDEX_CLASSES = {'SortedMassIndex': SortedMassIndex, 'MzRtGridIndex': MzRtGridIndex}
+
+def _index_from_arrays(class_name, arrays, scalars):
+    # rebuild an index from its arrays without sorting again; peaks are not persisted
+    index = object.__new__(_PERSISTED_INDEX_CLASSES[class_name])
+    for k, v in arrays.items():
+        setattr(index, k, v)
+    for k, v in scalars.items():
+        setattr(index, k, v)
+    index.peaks = None
+    return index
+
+def _index_scalars(index):
+    return {k: getattr(index, k).item() if isinstance(getattr(index, k), np.generic) else getattr(index, k)
+            for k in index._scalar_fields}
+
+def save_index(index, path):
+    '''
+    Save a SortedMassIndex or MzRtGridIndex to directory path, 
+    as one .npy file per array and index.json for class and parameters.
+    Peaks are not saved; queries on the reopened index return indices in the original order of peaks.
+    '''
+    os.makedirs(path, exist_ok=True)
+    for k in index._array_fields:
+        np.save(os.path.join(path, k + '.npy'), np.ascontiguousarray(getattr(index, k)))
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({'class': type(index).__name__, 'scalars': _index_scalars(index)}, f, indent=2)
+
+def load_index(path, mmap_mode='r'):
+    '''
+    Reopen an index saved by save_index. 
+    By default arrays are memory-mapped read-only, so that processes on a host share the same pages 
+    through the OS page cache, without a copy of the arrays per process.
+    Use mmap_mode=None to read the arrays into memory.
+    '''
+    with open(os.path.join(path, 'index.json')) as f:
+        meta = json.load(f)
+    fields = _PERSISTED_INDEX_CLASSES[meta['class']]._array_fields
+    arrays = {k: np.load(os.path.join(path, k + '.npy'), mmap_mode=mmap_mode) for k in fields}
+    return _index_from_arrays(meta['class'], arrays, meta['scalars'])
+
+def _attach_shared_memory(name):
+    # only the owner from share_index should unlink the segment.
+    # Before Python 3.13, attaching registers the segment again to the resource_tracker, 
+    # which is shared with processes started by multiprocessing, so no cleanup happens in workers.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+def share_index(index):
+    '''
+    Copy the arrays of a SortedMassIndex or MzRtGridIndex into multiprocessing.shared_memory.
+
+    Return
+    ======
+    (descriptor, shared_memory_blocks), 
+    where descriptor is a small picklable dictionary to pass to worker processes for attach_shared_index,
+    which are best started by multiprocessing (before Python 3.13, unrelated processes may unlink segments at exit; 
+    use save_index and load_index for those),
+    and shared_memory_blocks are owned by the caller, to be closed and unlinked when all workers are done:
+    for shm in shared_memory_blocks: shm.close(); shm.unlink()
+    '''
+    descriptor = {'class': type(index).__name__, 'scalars': _index_scalars(index), 'arrays': {}}
+    blocks = []
+    for k in index._array_fields:
+        _a = np.ascontiguousarray(getattr(index, k))
+        shm = shared_memory.SharedMemory(create=True, size=max(_a.nbytes, 1))
+        np.ndarray(_a.shape, dtype=_a.dtype, buffer=shm.buf)[...] = _a
+        descriptor['arrays'][k] = (shm.name, _a.shape, _a.dtype.str)
+        blocks.append(shm)
+    return descriptor, blocks
+
+def attach_shared_index(descriptor):
+    '''
+    Return an index whose arrays are views of the shared memory described by descriptor, from share_index.
+    No array is copied. The arrays are read-only.
+    '''
+    arrays, blocks = {}, []
+    for k, (name, shape, dtype) in descriptor['arrays'].items():
+        shm = _attach_shared_memory(name)
+        _a = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+        _a.flags.writeable = False
+        arrays[k] = _a
+        blocks.append(shm)
+    index = _index_from_arrays(descriptor['class'], arrays, descriptor['scalars'])
+    index._shared_memory_blocks = blocks            # keep attached for the life of index
+    return index
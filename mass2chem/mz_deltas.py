@@ -9,12 +9,17 @@ This module provides functions to retrieve the data from source data (immutable)
 2. lib:
   1. lib_mzdiff_bioreaction: List of common mass differences in bioreactions from difference sources. Function: lib_mzdiff_bioreaction()
   2. lib_mzdiff_in_source: List of common mass differences in in-source fragmentation if different instruments/ion modes. Function: lib_mzdiff_in_source()
+3. Mining:
+  1. Frequent mz deltas can be regenerated from one's own feature tables, in the same format as source data, with function: mine_frequent_deltas()
 '''
 
 import os
 import json
+from collections.abc import Mapping
 import pkg_resources
+import numpy as np
 import pandas as pd
+from scipy.signal import find_peaks
 
 def harmonize_instrument_mode(instrument, mode):
     # todo - this should be moved to a common asari utils repository
@@ -198,4 +203,112 @@ def lib_mzdiff_in_source():
         return {}  
     except Exception as e:
         print(f"Unexpected error: {e}")
-        return {}
\ No newline at end of file
+        return {}
+
+def _iter_mzdiff_chunks(mz, max_delta, min_delta=0, max_pairs=5000000):
+    """
+    Iterate over all pairs (i, j) of sorted mz, mz[j] - mz[i] in [min_delta, max_delta], 
+    in chunks of rows so that no more than about max_pairs are held in memory.
+    Yields (rows_i, rows_j) as numpy arrays.
+    """
+    N = len(mz)
+    lower = np.maximum(np.searchsorted(mz, mz + min_delta, side='left'), np.arange(1, N + 1))
+    upper = np.searchsorted(mz, mz + max_delta, side='right')
+    counts = np.maximum(upper - lower, 0)
+    cumulative = np.cumsum(counts)
+    start = 0
+    while start < N:
+        # rows up to the chunk limit, at least one row
+        end = max(int(np.searchsorted(cumulative, cumulative[start] - counts[start] + max_pairs, side='right')), start + 1)
+        _counts = counts[start: end]
+        rows_i = np.repeat(np.arange(start, end), _counts)
+        offsets = np.arange(int(_counts.sum())) - np.repeat(np.cumsum(_counts) - _counts, _counts)
+        rows_j = np.repeat(lower[start: end], _counts) + offsets
+        yield rows_i, rows_j
+        start = end
+
+def _read_mz_rtime(feature_table, mz_col='mz', rtime_col='rtime'):
+    """
+    Return mz and rtime arrays from a feature table, which can be a file path (tab delimited), 
+    a DataFrame, or a list of feature dictionaries like [{'id': 'F1', 'mz': 60.0808, 'rtime': 117.7, ...}, ...].
+    """
+    if isinstance(feature_table, str):
+        feature_table = pd.read_csv(feature_table, sep='\t')
+    elif not isinstance(feature_table, pd.DataFrame):
+        feature_table = pd.DataFrame(feature_table)
+    rtime = feature_table[rtime_col].values.astype(np.float64) if rtime_col in feature_table.columns else None
+    return feature_table[mz_col].values.astype(np.float64), rtime
+
+def mine_frequent_deltas(feature_tables, 
+                         max_delta=140, 
+                         min_delta=0.5,
+                         bin_width=0.0005,
+                         rt_tolerance=None,
+                         min_count=20,
+                         peak_half_width=3,
+                         max_pairs=5000000,
+                         mz_col='mz',
+                         rtime_col='rtime'):
+    """
+    Mine frequent mz deltas from feature tables, by histogram of all pairwise m/z differences,
+    to regenerate lists like those in source_data (chi2025_isf_*.tsv) for one's own instrument and method.
+    Pairs are counted within each feature table, in chunks of bounded memory, 
+    and histogram peaks are reported as frequent deltas.
+
+    Parameters
+    ----------
+    feature_tables: a feature table or a list of them. Each is a tab delimited file path, a DataFrame, 
+        or a list of feature dictionaries, with columns for m/z and retention time.
+    max_delta, min_delta: range of m/z differences to count.
+    bin_width: width of histogram bins in m/z, e.g. 0.0005 for orbitrap data; use wider bins for TOF.
+    rt_tolerance: if given, count only pairs of coeluting features, abs(rtime difference) <= rt_tolerance.
+    min_count: minimal count of a histogram peak to report.
+    peak_half_width: number of bins on each side of a peak, summed into count_estimate.
+    max_pairs: max number of feature pairs held in memory at once.
+    mz_col, rtime_col: column names for m/z and retention time.
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns 'delta_mz' and 'count_estimate', sorted by count_estimate in descending order.
+        delta_mz is the count weighted center of each peak, rounded to 4 decimals.
+
+    Examples
+    --------
+    >>> import mass2chem.mz_deltas
+    >>> mass2chem.mz_deltas.mine_frequent_deltas(['batch1_features.tsv', 'batch2_features.tsv'], rt_tolerance=2)
+    """
+    if isinstance(feature_tables, (str, pd.DataFrame)) or (
+            isinstance(feature_tables, list) and feature_tables and isinstance(feature_tables[0], Mapping)):
+        # a single table, including a list of feature dictionaries
+        feature_tables = [feature_tables]
+    number_bins = int(np.ceil(max_delta / bin_width)) + 1
+    histogram = np.zeros(number_bins, dtype=np.int64)
+    for table in feature_tables:
+        mz, rtime = _read_mz_rtime(table, mz_col, rtime_col)
+        if rt_tolerance is not None and rtime is None:
+            raise ValueError(f"The column {rtime_col} is required for rt_tolerance but not found in feature table")
+        order = np.argsort(mz, kind='stable')
+        mz = mz[order]
+        if rtime is not None:
+            rtime = rtime[order]
+        for rows_i, rows_j in _iter_mzdiff_chunks(mz, max_delta, min_delta, max_pairs):
+            if rt_tolerance is not None:
+                _good = np.abs(rtime[rows_j] - rtime[rows_i]) <= rt_tolerance
+                rows_i, rows_j = rows_i[_good], rows_j[_good]
+            bins = ((mz[rows_j] - mz[rows_i]) / bin_width).astype(np.int64)
+            histogram += np.bincount(bins, minlength=number_bins)[:number_bins]
+
+    # smoothing by peak_half_width before peak detection
+    window = np.ones(2 * peak_half_width + 1, dtype=np.int64)
+    smoothed = np.convolve(histogram, window, mode='same')
+    peaks, _ = find_peaks(smoothed, height=min_count, distance=2 * peak_half_width + 1)
+    centers = (np.arange(number_bins) + 0.5) * bin_width
+    delta_mz, count_estimate = [], []
+    for p in peaks:
+        _s, _e = max(p - peak_half_width, 0), min(p + peak_half_width + 1, number_bins)
+        counts = histogram[_s: _e]
+        delta_mz.append(round(float(np.sum(centers[_s: _e] * counts) / counts.sum()), 4))
+        count_estimate.append(int(counts.sum()))
+    mined = pd.DataFrame({'delta_mz': delta_mz, 'count_estimate': count_estimate})
+    return mined.sort_values(by='count_estimate', ascending=False, kind='stable').reset_index(drop=True)
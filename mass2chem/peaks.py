@@ -0,0 +1,146 @@
+'''
+Compact array-backed representation of peaks/features.
+
+Peaks are passed around in mass2chem as dictionaries, e.g.
+{'parent_masstrace_id': 1670, 'mz': 133.09702315984987, 'apex': 654, 'height': 14388.0,
+'left_base': 648, 'right_base': 655, 'id_number': 555},
+which cost hundreds of bytes per peak.
+PeakArray keeps the same fields in a numpy structured array, about 60 bytes per peak in the default fields.
+
+PeakArray works with both lines of search functions in search.py:
+- peak_array['mz'] returns a column, so it is a peak_table for the columnar functions, e.g. find_signatures_columnar.
+- peak_array[ii] and iteration return PeakView, a read-only dictionary-like view of one peak,
+  so it is a list_peaks for the dictionary based functions, e.g. build_centurion_tree, get_seed_empCpd_signatures.
+'''
+
+from collections.abc import Mapping
+import numpy as np
+
+# default fields and types, following the peak format from asari
+peak_dtype = [
+    ('id_number', np.int64),
+    ('mz', np.float64),
+    ('apex', np.float64),
+    ('height', np.float64),
+    ('left_base', np.float64),
+    ('right_base', np.float64),
+]
+
+
+class PeakView(Mapping):
+    '''
+    Read-only, dictionary-like view of one peak in a PeakArray.
+    Missing keys raise KeyError, as for dictionaries.
+    '''
+    __slots__ = ('_data', '_row')
+
+    def __init__(self, data, row):
+        self._data = data
+        self._row = row
+
+    def __getitem__(self, key):
+        try:
+            return self._data[key][self._row].item()
+        except ValueError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._data.dtype.names)
+
+    def __len__(self):
+        return len(self._data.dtype.names)
+
+    def __contains__(self, key):
+        return key in self._data.dtype.names
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class PeakArray:
+    '''
+    Peaks as a numpy structured array, with column access by field name and
+    dictionary-like access by row.
+
+    Example
+    -------
+    peaks = PeakArray.from_dicts(list_peaks)
+    peaks['mz']                 # numpy array of m/z
+    peaks[0]['mz']              # m/z of first peak
+    mztree = build_centurion_tree(peaks)
+    signatures = find_signatures_columnar(peaks, isotopic_patterns, apex_rt_tolerance=5)
+    '''
+    def __init__(self, data):
+        '''
+        data: numpy structured array, e.g. np.zeros(N, dtype=peak_dtype).
+        '''
+        self.data = data
+
+    @classmethod
+    def from_columns(cls, **columns):
+        '''
+        Build from arrays of equal length, e.g. PeakArray.from_columns(id_number=ids, mz=mzs, apex=apexes).
+        Types are taken from the arrays.
+        '''
+        columns = {k: np.asarray(v) for k, v in columns.items()}
+        N = len(next(iter(columns.values()))) if columns else 0
+        data = np.empty(N, dtype=[(k, v.dtype) for k, v in columns.items()])
+        for k, v in columns.items():
+            data[k] = v
+        return cls(data)
+
+    @classmethod
+    def from_dicts(cls, list_peaks, fields=None):
+        '''
+        Build from a list of peak dictionaries.
+        fields: list of (name, type). Default the fields of peak_dtype present in the first peak.
+                Use type 'U' for strings, e.g. ('id_number', 'U') for IDs like 'F123'.
+        '''
+        if fields is None:
+            first = list_peaks[0] if list_peaks else {}
+            fields = [(name, 'U' if isinstance(first[name], str) else _type) 
+                      for name, _type in peak_dtype if name in first]
+        columns = {}
+        for name, _type in fields:
+            columns[name] = np.array([p[name] for p in list_peaks], dtype=_type)
+        return cls.from_columns(**columns)
+
+    def to_dicts(self):
+        '''Return a list of peak dictionaries.'''
+        names = self.data.dtype.names
+        return [dict(zip(names, row)) for row in self.data.tolist()]
+
+    @property
+    def fields(self):
+        return self.data.dtype.names
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for ii in range(len(self.data)):
+            yield PeakView(self.data, ii)
+
+    def __getitem__(self, key):
+        '''
+        key as field name returns a column; as integer returns a PeakView;
+        as slice, boolean mask or array of integers returns a PeakArray.
+        '''
+        if isinstance(key, str):
+            if key not in self.data.dtype.names:
+                raise KeyError(key)
+            return self.data[key]
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self.data)
+            if not 0 <= key < len(self.data):
+                raise IndexError(key)
+            return PeakView(self.data, key)
+        return PeakArray(self.data[key])
+
+    def __repr__(self):
+        return 'PeakArray(%d peaks, fields=%s)' %(len(self.data), self.data.dtype.names)
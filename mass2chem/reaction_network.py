@@ -0,0 +1,176 @@
+'''
+Formula differences between compounds in bulk, for building metabolite reaction networks.
+
+Compounds i and j are connected by a reaction if formula(j) - formula(i) equals the formula change of the reaction,
+e.g. {'C': -6, 'H': -8, 'O': -7} for deglucuronidation.
+Reactions default to those in lib/mzdiff_bioreaction.json (see mz_deltas.lib_mzdiff_bioreaction).
+
+Formulae and formula changes are encoded as packed keys (formula_key.FormulaCodec), with a layout fitted to the data,
+so that a formula difference is an integer subtraction. Keys are further reduced to a linear 64-bit hash,
+and pairs are found by lookup of hashes in a table, then verified on element counts.
+Two ways of searching are supported:
+- all pairs, by joining formula(i) + change(r) against all formulae, without enumerating pairs;
+- candidate pairs, e.g. preselected by mass difference with candidate_pairs_by_mass.
+
+Example
+-------
+edges = find_reaction_edges(list_formulas, ids=list_ids)
+list(zip(edges['compound_i'], edges['compound_j'], edges['reaction']))
+'''
+
+import ast
+import numpy as np
+
+from .formula_matrix import parse_formula_matrix, formula_dicts_to_matrix, align_formula_matrix, hill_order
+from .formula_key import FormulaCodec
+from .mass_index import SortedMassIndex, _expand_ranges
+from .mz_deltas import lib_mzdiff_bioreaction
+
+def load_bioreactions(sources=None):
+    '''
+    Return reactions from lib/mzdiff_bioreaction.json, as list of [mass, description, formula change dictionary].
+
+    sources: list of keys in the JSON file, e.g. ['zhao2024_drug_exposure']. Default all.
+    '''
+    lib = lib_mzdiff_bioreaction()
+    reactions = []
+    for source in sources or list(lib):
+        for mass, description, formula_change in lib[source]:
+            reactions.append([mass, description, ast.literal_eval(formula_change)])
+    return reactions
+
+
+def _hash_keys(codec, keys):
+    # linear in keys: hash(k1 + k2) = hash(k1) + hash(k2) modulo 2**64, as uint64 wraps
+    words = codec.words(keys)
+    # fixed odd multipliers, one per word
+    multipliers = np.random.default_rng(0).integers(0, 2**63, size=len(words), dtype=np.uint64) * 2 + 1
+    h = np.zeros(len(words[0]), dtype=np.uint64)
+    for w, multiplier in zip(words, multipliers):
+        h += w * multiplier
+    return h
+
+
+def _hash_lookup(hashes, targets):
+    '''
+    Return (target_numbers, rows) of all hashes[rows] == targets[target_numbers],
+    by bucketing sorted hashes on their top bits, a direct-address table faster than binary search.
+    '''
+    order = np.argsort(hashes, kind='stable')
+    sorted_hashes = hashes[order]
+    bits = max(1, int(len(hashes)).bit_length() + 1)
+    shift = np.uint64(64 - bits)
+    bucket_starts = np.searchsorted(sorted_hashes >> shift, np.arange(2**bits + 1, dtype=np.uint64))
+    target_buckets = (targets >> shift).astype(np.intp)
+    target_numbers, positions = _expand_ranges(bucket_starts[target_buckets], bucket_starts[target_buckets + 1])
+    equal = sorted_hashes[positions] == targets[target_numbers]
+    return target_numbers[equal], order[positions[equal]]
+
+
+def _prepare(formulas, reactions):
+    '''
+    Return aligned element-count matrices of compounds and reaction changes, a fitted codec and their keys.
+    '''
+    if reactions is None:
+        reactions = load_bioreactions()
+    compound_matrix, compound_elements = parse_formula_matrix(formulas)
+    changes = [ast.literal_eval(x[2]) if isinstance(x[2], str) else x[2] for x in reactions]
+    change_matrix, change_elements = formula_dicts_to_matrix(changes)
+    elements = hill_order(set(compound_elements) | set(change_elements))
+    compound_matrix = align_formula_matrix(compound_matrix, compound_elements, elements)
+    change_matrix = align_formula_matrix(change_matrix, change_elements, elements)
+    codec = FormulaCodec.fit(np.vstack([compound_matrix, change_matrix]), elements)
+    return (reactions, compound_matrix, change_matrix,
+            codec.encode_matrix(compound_matrix, elements), codec.encode_matrix(change_matrix, elements), codec)
+
+
+def _edges(reactions, compound_i, compound_j, reaction_numbers, ids):
+    # sorted by compound_i, compound_j, reaction
+    order = np.lexsort((reaction_numbers, compound_j, compound_i))
+    compound_i, compound_j, reaction_numbers = compound_i[order], compound_j[order], reaction_numbers[order]
+    if ids is not None:
+        ids = np.asarray(ids)
+        compound_i, compound_j = ids[compound_i], ids[compound_j]
+    return {
+        'compound_i': compound_i,
+        'compound_j': compound_j,
+        'reaction_number': reaction_numbers,
+        'reaction': [reactions[r][1] for r in reaction_numbers.tolist()],
+    }
+
+
+def candidate_pairs_by_mass(masses, reaction_masses, mz_tolerance_ppm=5):
+    '''
+    Preselect pairs of compounds by mass difference.
+
+    Input
+    =====
+    masses: neutral masses of compounds.
+    reaction_masses: mass changes of reactions, e.g. [x[0] for x in load_bioreactions()].
+    mz_tolerance_ppm: tolerance of masses[j] to masses[i] + reaction mass, relative to masses[i] + reaction mass.
+
+    Return
+    ======
+    compound_i, compound_j; arrays of row numbers, unique pairs with i != j.
+    '''
+    masses = np.asarray(masses, dtype=np.float64)
+    index = SortedMassIndex(masses)
+    targets = (masses[:, None] + np.asarray(reaction_masses, dtype=np.float64)[None, :]).ravel()
+    query_numbers, compound_j = index.find_all_batch(targets, mz_tolerance_ppm)
+    compound_i = query_numbers // len(reaction_masses)
+    pairs = np.unique(np.stack([compound_i, compound_j], axis=1), axis=0)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return pairs[:, 0], pairs[:, 1]
+
+
+def find_reaction_edges(formulas, reactions=None, candidate_pairs=None, ids=None, chunk_size=4000000):
+    '''
+    Find pairs of compounds whose formula difference matches a reaction, formula(j) - formula(i) = change(r).
+    Vectorized replacement of formula.calculate_formula_diff over pairs of compounds.
+
+    Input
+    =====
+    formulas: list of formulae of compounds.
+    reactions: list of [mass, description, formula change], the change as dictionary or its string,
+            as in lib/mzdiff_bioreaction.json. Default load_bioreactions().
+    candidate_pairs: optional (compound_i, compound_j) arrays of row numbers, e.g. from candidate_pairs_by_mass.
+            Default all ordered pairs of compounds.
+    ids: optional compound IDs, to report in place of row numbers.
+    chunk_size: number of compound-reaction combinations hashed at a time, when searching all pairs.
+
+    Return
+    ======
+    Edge list as dictionary of aligned arrays,
+    {'compound_i': [], 'compound_j': [], 'reaction_number': [], 'reaction': [description, ...]},
+    sorted by compound_i, compound_j and reaction_number.
+    '''
+    reactions, compound_matrix, change_matrix, compound_keys, change_keys, codec = _prepare(formulas, reactions)
+    compound_hashes = _hash_keys(codec, compound_keys)
+    # hash of formula + change is compound_hash + change_hash - hash of empty formula (the bias)
+    empty_hash = _hash_keys(codec, codec.encode_matrix(np.zeros((1, 0)), []))[0]
+    change_hashes = _hash_keys(codec, change_keys) - empty_hash
+
+    found_i, found_j, found_r = [], [], []
+    if candidate_pairs is None:
+        chunk_reactions = max(1, chunk_size // max(1, len(compound_hashes)))
+        for start in range(0, len(change_hashes), chunk_reactions):
+            targets = (compound_hashes[:, None] + change_hashes[None, start: start + chunk_reactions]).ravel()
+            target_numbers, rows = _hash_lookup(compound_hashes, targets)
+            width = min(chunk_reactions, len(change_hashes) - start)
+            found_i.append(target_numbers // width)
+            found_r.append(start + target_numbers % width)
+            found_j.append(rows)
+    else:
+        compound_i, compound_j = (np.asarray(x, dtype=np.intp) for x in candidate_pairs)
+        pair_numbers, rows = _hash_lookup(change_hashes, compound_hashes[compound_j] - compound_hashes[compound_i])
+        found_i.append(compound_i[pair_numbers])
+        found_j.append(compound_j[pair_numbers])
+        found_r.append(rows)
+
+    compound_i = np.concatenate(found_i) if found_i else np.zeros(0, dtype=np.intp)
+    compound_j = np.concatenate(found_j) if found_j else np.zeros(0, dtype=np.intp)
+    reaction_numbers = np.concatenate(found_r) if found_r else np.zeros(0, dtype=np.intp)
+    # verify on element counts, against hash collisions; no self pairs
+    exact = (compound_matrix[compound_j] - compound_matrix[compound_i] == change_matrix[reaction_numbers]).all(axis=1)
+    keep = exact & (compound_i != compound_j)
+    return _edges(reactions, compound_i[keep], compound_j[keep], reaction_numbers[keep], ids)
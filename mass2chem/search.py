@@ -1,7 +1,12 @@
 '''
 Two lines of search methods:
 - A centurion_tree is an indexed dictionary of peaks/features.
+  The array based SortedMassIndex (mass_index.py) can be used in place of a centurion_tree,
+  and supports batched queries of many m/z values at once.
 - We also use DataFrame based vector operations for some cases (less often, less useful).
+- Columnar searches (e.g. find_signatures_columnar) take arrays of peak attributes,
+  and evaluate all patterns and coelution rules as array operations.
+  A compact PeakArray (peaks.py) can be used as list_peaks or as columns of peaks in both lines of methods.
 
 Emperical compounds are constructed by co-eluting isotopic and adduct patterns.
 # isotopic_signatures: example as [(182, 'anchor'), (191, 'M(13C)'), (205, 'M(18O)')]
@@ -24,6 +29,14 @@ search_patterns: Use seed_empCpd_patterns. May update after seeing experimental
 
 '''
 
+import os
+import multiprocessing
+import numpy as np
+
+from .mass_index import (SortedMassIndex, MzRtGridIndex, IncrementalMassIndex, 
+                         share_index, attach_shared_index)
+from .peaks import PeakArray
+
 # Mass difference and Abundance of natually occuring isotopic elements.
 # (mz difference, notion, ratio low limit, ratio high limit)
 # Ratio is loose to leave room for 1) multiple atoms, e.g. 40 C atoms lead to ~ 40*1% in abundance
@@ -97,6 +110,8 @@ def build_centurion_tree(list_peaks, key='mz'):
     Return a dictionary, indexing mzList by 100*mz bins.
     Because most high-resolution mass spectrometers measure well under 0.01 amu, 
     one only needs to search the corresponding 0.01 bin and two adjacent bins (to capture bordering values).
+    The query functions extend the number of searched bins when the tolerance window is wider than 0.01,
+    e.g. 5 ppm at m/z above 2000, so that matches are not missed for large molecules.
     list_mass_tracks has similar format as list_peaks.
     '''
     d = {}
@@ -129,14 +144,28 @@ def build_centurion_tree_mzlist(mzList):
             d[cent] = [(mzList[ii], ii)]
     return d
 
+def _centurion_bins(query_mz, mz_tol):
+    '''
+    Return the 0.01 bins to search in a centurion_tree for query_mz +/- mz_tol.
+    This is the corresponding bin and two adjacent bins, 
+    extended if the tolerance window is wider than 0.01, e.g. 5 ppm at m/z above 2000.
+    '''
+    q = int(query_mz * 100)
+    if mz_tol < 0.01:
+        return (q-1, q, q+1)
+    else:
+        return range(int((query_mz - mz_tol) * 100), int((query_mz + mz_tol) * 100) + 1)
+
 def find_all_matches_centurion_indexed_list(query_mz, mz_centurion_tree, limit_ppm=5, key='mz'):
     '''
     Return matched peaks in mz_centurion_tree by m/z diff within limit_ppm.
+    mz_centurion_tree can also be a SortedMassIndex built from peaks, or an IncrementalMassIndex.
     '''
-    q = int(query_mz * 100)
+    if isinstance(mz_centurion_tree, (SortedMassIndex, IncrementalMassIndex)):
+        return mz_centurion_tree.find_all_matches(query_mz, limit_ppm)
     mz_tol = query_mz * limit_ppm * 0.000001
     results = []
-    for ii in (q-1, q, q+1):
+    for ii in _centurion_bins(query_mz, mz_tol):
         L = mz_centurion_tree.get(ii, [])
         for peak in L:
             if abs(peak[key]-query_mz) < mz_tol:
@@ -147,11 +176,13 @@ def find_all_matches_centurion_indexed_list(query_mz, mz_centurion_tree, limit_p
 def find_best_match_centurion_indexed_list(query_mz, mz_centurion_tree, limit_ppm=2, key='mz'):
     '''
     Return matched indices in mz_centurion_tree (based on peak list).
+    mz_centurion_tree can also be a SortedMassIndex built from peaks, or an IncrementalMassIndex.
     '''
-    q = int(query_mz * 100)
+    if isinstance(mz_centurion_tree, (SortedMassIndex, IncrementalMassIndex)):
+        return mz_centurion_tree.find_best_match(query_mz, limit_ppm)
     mz_tol = query_mz * limit_ppm * 0.000001
     result = (None, 999)
-    for ii in (q-1, q, q+1):
+    for ii in _centurion_bins(query_mz, mz_tol):
         L = mz_centurion_tree.get(ii, [])
         for peak in L:
             _d = abs(peak[key]-query_mz)
@@ -295,6 +326,7 @@ def find_isotopic_signatures(list_peaks, mztree, isotopic_patterns, mz_tolerance
     Input
     =====
     isotopic_patterns = [(1.003355, '13C/12C', (0, 0.8)), ...], the third item is optional limits of abundance ratio.
+    The limits are loose; to compare clusters with envelopes of candidate formulae, see isotopes.score_isotope_patterns.
 
     Return
     ======
@@ -368,6 +400,7 @@ def find_mzdiff_pairs_from_masstracks(list_mass_tracks, list_mz_diff=[1.003355,
     '''
     Find all pairs in list_mass_tracks that match a pattern in list_mz_diff, and return their id_numbers as pairs.
     This function does not use coeluction (rtime) rules. 
+    Uses find_mzdiff_pairs in best match mode.
 
     Input
     =====
@@ -378,16 +411,408 @@ def find_mzdiff_pairs_from_masstracks(list_mass_tracks, list_mz_diff=[1.003355,
     ======
     list of pairs of mass tracks numbers.
     '''
-    pairs = []
     # list_mass_tracks has similar format as list_peaks.
-    mztree = build_centurion_tree(list_mass_tracks)
-    for mzdiff in list_mz_diff:
-        for P1 in list_mass_tracks:
-            P2 = find_best_match_centurion_indexed_list(P1['mz'] + mzdiff, mztree, mz_tolerance_ppm)
-            if P2:
-                pairs.append((P1['id_number'], P2['id_number']))
+    _, rows1, rows2 = find_mzdiff_pairs([P['mz'] for P in list_mass_tracks], 
+                                        list_mz_diff, mz_tolerance_ppm, best_match=True)
+    return [(list_mass_tracks[ii]['id_number'], list_mass_tracks[jj]['id_number']) 
+            for ii, jj in zip(rows1.tolist(), rows2.tolist())]
+
+def find_mzdiff_pairs(masses, list_mz_diff, mz_tolerance_ppm=5, best_match=True):
+    '''
+    Find all pairs of masses whose difference matches any of list_mz_diff, 
+    i.e. abs(masses[j] - masses[i] - mz_diff) < (masses[i] + mz_diff) * mz_tolerance_ppm * 1e-6.
+    Masses are sorted once, and all differences are searched as one batched query on the sorted array,
+    so that the cost is O((n + k) log n) for n masses and k matched pairs, instead of n x d Python lookups.
+
+    Input
+    =====
+    masses: list or array of m/z values, e.g. of mass tracks.
+    list_mz_diff: mass differences, e.g. [1.003355, 21.9820].
+    mz_tolerance_ppm: ppm tolerance on the target mass.
+    best_match: if True, only the closest mass is kept for each mass and difference, 
+            as in find_best_match_centurion_indexed_list; otherwise all matches.
+
+    Return
+    ======
+    Three aligned numpy arrays (diff_numbers, rows1, rows2), 
+    where masses[rows2] - masses[rows1] matches list_mz_diff[diff_numbers].
+    Pairs are ordered by difference, then by rows1.
+    '''
+    masses = np.asarray(masses, dtype=np.float64)
+    mz_diffs = np.asarray(list_mz_diff, dtype=np.float64)
+    if len(masses) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    index = SortedMassIndex(masses)
+    queries = (mz_diffs[:, None] + masses[None, :]).ravel()
+    if best_match:
+        best = index.find_best_batch(queries, mz_tolerance_ppm)
+        query_numbers = np.flatnonzero(best >= 0)
+        rows2 = best[query_numbers]
+    else:
+        query_numbers, rows2 = index.find_all_batch(queries, mz_tolerance_ppm)
+    diff_numbers, rows1 = np.divmod(query_numbers, len(masses))
+    return diff_numbers, rows1, rows2
+
+
+#
+# -----------------------------------------------------------------------------
+# Columnar searches, on arrays of peak attributes instead of lists of peak dictionaries
+#
+
+def _get_column(peak_table, key):
+    '''
+    Return peak_table[key] as a numpy array, or None if key is not in peak_table.
+    peak_table can be a dictionary of arrays, a numpy structured array or a pandas DataFrame.
+    '''
+    try:
+        return np.asarray(peak_table[key])
+    except (KeyError, ValueError, IndexError):
+        return None
+
+def peaks_to_columns(list_peaks, keys=('id_number', 'mz', 'apex', 'height', 'left_base', 'right_base')):
+    '''
+    Convert list_peaks to a dictionary of arrays, used by the columnar search functions.
+    Keys not present in the first peak are skipped. A PeakArray returns its columns without copy.
+    '''
+    if isinstance(list_peaks, PeakArray):
+        return {k: list_peaks[k] for k in keys if k in list_peaks.fields}
+    if not list_peaks:
+        return {k: np.array([]) for k in keys}
+    return {k: np.array([p[k] for p in list_peaks]) for k in keys if k in list_peaks[0]}
+
+def match_patterns_columnar(peak_table, 
+                    search_patterns,
+                    mz_tolerance_ppm=5, 
+                    apex_rt_tolerance=None, 
+                    coelution_rt_tolerance=20,
+                    check_abundance_ratio=True,
+                    anchors=None,
+                    mz_index=None,
+                    ):
+    '''
+    Vectorized matching of all search_patterns for all anchor peaks in a single batched query.
+    The RT, coelution and abundance ratio rules are evaluated as array masks,
+    following get_seed_empCpd_signatures, find_isotopic_signatures and find_adduct_signatures.
+
+    Input
+    =====
+    peak_table: columns of peaks, e.g. {'mz': array, 'apex': array, 'height': array, 
+                'left_base': array, 'right_base': array}. See peaks_to_columns.
+                'height' is needed only if abundance ratios are checked. 
+                If 'left_base' or 'right_base' is missing, coelution falls back to apex distance,
+                as in is_coeluted_by_overlap.
+    search_patterns: e.g. [(1.003355, '13C/12C', (0, 0.8)), (1.0078, 'H'), (21.9820, 'Na/H'), ],
+                the third item is optional limits of abundance ratio.
+    mz_tolerance_ppm: ppm tolerance in examining m/z patterns.
+    apex_rt_tolerance: if not None, required max difference in apex, e.g. isotope_rt_tolerance.
+    coelution_rt_tolerance: apex distance for coelution if peak boundaries are not given.
+    check_abundance_ratio: whether to check abundance ratio when given in search_patterns.
+    anchors: optional array of row numbers in peak_table to use as anchors. Default all peaks.
+    mz_index: optional SortedMassIndex of peak_table['mz'], to reuse a prebuilt index.
+            Can be a MzRtGridIndex of peak_table['mz'] and peak_table['apex'], 
+            which returns only candidates within the apex RT window, 
+            when apex_rt_tolerance is given or coelution is by apex distance.
+
+    Return
+    ======
+    Three aligned arrays (anchor_rows, partner_rows, pattern_numbers), 
+    ordered by anchor, pattern, then in the same order as centurion_tree searches.
+    '''
+    mz = _get_column(peak_table, 'mz').astype(np.float64)
+    apex = _get_column(peak_table, 'apex')
+    if anchors is None:
+        anchors = np.arange(len(mz))
+    anchors = np.asarray(anchors, dtype=np.int64)
+    left_base, right_base = _get_column(peak_table, 'left_base'), _get_column(peak_table, 'right_base')
+    # max apex distance implied by the coelution rules, used for MzRtGridIndex
+    rt_window = []
+    if apex_rt_tolerance is not None:
+        rt_window.append(apex_rt_tolerance)
+    if left_base is None or right_base is None:
+        rt_window.append(coelution_rt_tolerance)
+    if mz_index is None or (isinstance(mz_index, MzRtGridIndex) and not rt_window):
+        mz_index = SortedMassIndex(mz)
+
+    num_patterns = len(search_patterns)
+    mass_differences = np.array([x[0] for x in search_patterns], dtype=np.float64)
+    queries = (mz[anchors][None, :] + mass_differences[:, None]).ravel()
+    if isinstance(mz_index, MzRtGridIndex):
+        query_numbers, partners = mz_index.find_all_batch(queries, np.tile(apex[anchors], num_patterns), 
+                                                          mz_tolerance_ppm, min(rt_window))
+    else:
+        query_numbers, partners = mz_index.find_all_batch(queries, mz_tolerance_ppm)
+    pattern_numbers, anchor_rows = np.divmod(query_numbers, len(anchors))
+    anchor_rows = anchors[anchor_rows]
+
+    _good = np.ones(len(partners), dtype=bool)
+    if apex_rt_tolerance is not None:
+        _good &= np.abs(apex[anchor_rows] - apex[partners]) <= apex_rt_tolerance
+
+    if left_base is None or right_base is None:
+        _good &= np.abs(apex[anchor_rows] - apex[partners]) <= coelution_rt_tolerance
+    else:
+        len1 = right_base[anchor_rows] - left_base[anchor_rows]
+        len2 = right_base[partners] - left_base[partners]
+        overlap = np.minimum(right_base[anchor_rows], right_base[partners]
+                             ) - np.maximum(left_base[anchor_rows], left_base[partners])
+        _good &= overlap > 0.5 * np.minimum(len1, len2)
+
+    if check_abundance_ratio:
+        ratio_limits = np.array([x[2] if len(x) > 2 else (-np.inf, np.inf) for x in search_patterns], 
+                                dtype=np.float64).reshape(num_patterns, 2)
+        has_ratio = np.array([len(x) > 2 for x in search_patterns], dtype=bool)
+        _check = has_ratio[pattern_numbers]
+        if _check.any():
+            height = _get_column(peak_table, 'height').astype(np.float64)
+            h1, h2 = height[anchor_rows], height[partners]
+            _in_ratio = (ratio_limits[pattern_numbers, 0] * h1 < h2) & (h2 < ratio_limits[pattern_numbers, 1] * h1)
+            _good &= ~_check | _in_ratio
+
+    return _sort_matches(mz, anchors, anchor_rows[_good], partners[_good], pattern_numbers[_good])
+
+def _sort_matches(mz, anchors, anchor_rows, partner_rows, pattern_numbers):
+    '''
+    Sort matches by order of anchors as given, then patterns, then as centurion_tree bins and input order.
+    '''
+    anchor_positions = np.empty(len(mz), dtype=np.int64)
+    anchor_positions[anchors] = np.arange(len(anchors))
+    _order = np.lexsort((partner_rows, (mz[partner_rows] * 100).astype(np.int64), 
+                         pattern_numbers, anchor_positions[anchor_rows]))
+    return anchor_rows[_order], partner_rows[_order], pattern_numbers[_order]
+
+def signatures_from_matches(ids, relations, anchor_rows, partner_rows, pattern_numbers):
+    '''
+    Convert matched arrays from match_patterns_columnar to signatures,
+    [ [(195, 'anchor'), (206, '13C/12C')], ...], using ids of peaks and relations of patterns.
+    '''
+    signatures = []
+    if len(anchor_rows) == 0:
+        return signatures
+    breaks = np.flatnonzero(np.diff(anchor_rows)) + 1
+    starts, ends = np.concatenate(([0], breaks)), np.concatenate((breaks, [len(anchor_rows)]))
+    ids = ids.tolist() if isinstance(ids, np.ndarray) else list(ids)
+    partner_ids = [ids[ii] for ii in partner_rows]
+    partner_relations = [relations[ii] for ii in pattern_numbers]
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        matched = [(ids[anchor_rows[start]], 'anchor')] + list(
+                        zip(partner_ids[start: end], partner_relations[start: end]))
+        signatures.append(matched)
+    return signatures
+
+def find_signatures_columnar(peak_table, 
+                    search_patterns,
+                    mz_tolerance_ppm=5, 
+                    apex_rt_tolerance=None, 
+                    coelution_rt_tolerance=20,
+                    check_abundance_ratio=True,
+                    anchors=None,
+                    mz_index=None,
+                    id_key='id_number',
+                    ):
+    '''
+    Columnar version of signature searches, returning same signatures as the peak dictionary versions:
+    - get_seed_empCpd_signatures(list_peaks, mztree, search_patterns, mz_tolerance_ppm, 
+            isotope_rt_tolerance, coelution_rt_tolerance) is equivalent to 
+            find_signatures_columnar(peak_table, search_patterns, mz_tolerance_ppm, 
+            apex_rt_tolerance=isotope_rt_tolerance, coelution_rt_tolerance=coelution_rt_tolerance).
+    - find_isotopic_signatures(list_peaks, mztree, isotopic_patterns, mz_tolerance_ppm, rt_tolerance_scans) 
+            is equivalent to find_signatures_columnar(peak_table, isotopic_patterns, mz_tolerance_ppm, 
+            apex_rt_tolerance=rt_tolerance_scans).
+    - find_adduct_signatures(list_peaks, mztree, adduct_patterns, mz_tolerance_ppm) is equivalent to
+            find_signatures_columnar(peak_table, adduct_patterns, mz_tolerance_ppm, check_abundance_ratio=False).
+    Coelution is by overlap of peak boundaries as in is_coeluted_by_overlap. 
+    See match_patterns_columnar for parameters.
+    id_key: column for peak IDs. Row numbers are used if not in peak_table.
+
+    Return
+    ======
+    list of lists of peak IDs that match search_patterns, e.g.
+    [ [(195, 'anchor'), (206, '13C/12C')],  ...]
+    '''
+    anchor_rows, partner_rows, pattern_numbers = match_patterns_columnar(peak_table, 
+                    search_patterns, mz_tolerance_ppm, apex_rt_tolerance, coelution_rt_tolerance,
+                    check_abundance_ratio, anchors, mz_index)
+    ids = _get_column(peak_table, id_key)
+    if ids is None:
+        ids = np.arange(len(_get_column(peak_table, 'mz')))
+    return signatures_from_matches(ids, [x[1] for x in search_patterns], 
+                                   anchor_rows, partner_rows, pattern_numbers)
+
+
+def _init_slab_worker(peak_table, index, search_patterns, parameters):
+    # shared read-only by all slabs in a worker process, inherited without copy on fork.
+    # index is a SortedMassIndex, or a descriptor from share_index to attach without copy.
+    global _SLAB_DATA
+    if isinstance(index, dict):
+        index = attach_shared_index(index)
+    _SLAB_DATA = (peak_table, index, search_patterns, parameters)
+
+def _match_patterns_slab(slab):
+    '''
+    Match patterns for anchors in one m/z slab, against the shared index of all peaks.
+    slab: (anchor_start, anchor_end), as positions in the m/z order of the shared index.
+    '''
+    peak_table, index, search_patterns, parameters = _SLAB_DATA
+    anchor_start, anchor_end = slab
+    return match_patterns_columnar(peak_table, search_patterns, 
+                        anchors=index.order[anchor_start: anchor_end], mz_index=index, **parameters)
 
-    return pairs
+def match_patterns_parallel(peak_table, 
+                    search_patterns,
+                    mz_tolerance_ppm=5, 
+                    apex_rt_tolerance=None, 
+                    coelution_rt_tolerance=20,
+                    check_abundance_ratio=True,
+                    workers=None,
+                    number_slabs=None,
+                    ):
+    '''
+    Multi-process version of match_patterns_columnar, returning identical results.
+    Anchor peaks are partitioned into m/z slabs of equal size. 
+    One SortedMassIndex of all peaks is built in the calling process and shared with workers 
+    through share_index, so that no worker builds or copies an index. 
+    The peak table is shared read-only by worker processes, and results are merged in serial order.
+
+    Input
+    =====
+    See match_patterns_columnar for shared parameters.
+    workers: number of processes. Default os.cpu_count(). If 1, run in the current process.
+    number_slabs: number of m/z slabs. Default 4 slabs per worker, for load balance.
+
+    Return
+    ======
+    Three aligned arrays (anchor_rows, partner_rows, pattern_numbers), same as match_patterns_columnar.
+    '''
+    workers = workers or os.cpu_count() or 1
+    number_slabs = number_slabs or 4 * workers
+    keys = [k for k in ('mz', 'apex', 'height', 'left_base', 'right_base') 
+            if _get_column(peak_table, k) is not None]
+    columns = {k: _get_column(peak_table, k) for k in keys}
+    mz = columns['mz'] = columns['mz'].astype(np.float64)
+    index = SortedMassIndex(mz)
+    bounds = np.linspace(0, len(mz), min(number_slabs, len(mz)) + 1).astype(np.int64)
+    slabs = [(int(anchor_start), int(anchor_end)) for anchor_start, anchor_end in zip(bounds[:-1], bounds[1:])
+             if anchor_end > anchor_start]
+
+    parameters = {'mz_tolerance_ppm': mz_tolerance_ppm, 'apex_rt_tolerance': apex_rt_tolerance, 
+                  'coelution_rt_tolerance': coelution_rt_tolerance, 'check_abundance_ratio': check_abundance_ratio}
+    if workers == 1:
+        _init_slab_worker(columns, index, search_patterns, parameters)
+        results = [_match_patterns_slab(slab) for slab in slabs]
+    else:
+        descriptor, blocks = share_index(index)
+        try:
+            with multiprocessing.Pool(workers, initializer=_init_slab_worker, 
+                                      initargs=(columns, descriptor, search_patterns, parameters)) as pool:
+                results = pool.map(_match_patterns_slab, slabs)
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    if not results:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    anchor_rows, partner_rows, pattern_numbers = [np.concatenate(x) for x in zip(*results)]
+    return _sort_matches(mz, np.arange(len(mz)), anchor_rows, partner_rows, pattern_numbers)
+
+def find_signatures_parallel(peak_table, 
+                    search_patterns,
+                    mz_tolerance_ppm=5, 
+                    apex_rt_tolerance=None, 
+                    coelution_rt_tolerance=20,
+                    check_abundance_ratio=True,
+                    workers=None,
+                    number_slabs=None,
+                    id_key='id_number',
+                    ):
+    '''
+    Multi-process version of find_signatures_columnar, returning identical signatures.
+    See match_patterns_parallel for parameters.
+    '''
+    anchor_rows, partner_rows, pattern_numbers = match_patterns_parallel(peak_table, 
+                    search_patterns, mz_tolerance_ppm, apex_rt_tolerance, coelution_rt_tolerance,
+                    check_abundance_ratio, workers, number_slabs)
+    ids = _get_column(peak_table, id_key)
+    if ids is None:
+        ids = np.arange(len(_get_column(peak_table, 'mz')))
+    return signatures_from_matches(ids, [x[1] for x in search_patterns], 
+                                   anchor_rows, partner_rows, pattern_numbers)
+
+
+def union_find_components(number_nodes, nodes1, nodes2):
+    '''
+    Connected components of a graph by array-backed union-find, in vectorized rounds:
+    roots of each edge are linked to the smaller root, then paths are compressed by pointer jumping.
+
+    Input
+    =====
+    number_nodes: nodes are 0, 1, ... number_nodes-1, e.g. row numbers of peaks.
+    nodes1, nodes2: aligned arrays of edges, e.g. anchor_rows and partner_rows of matched pairs.
+
+    Return
+    ======
+    Array of roots for all nodes, the smallest node number in each component.
+    '''
+    parent = np.arange(number_nodes)
+    nodes1, nodes2 = np.asarray(nodes1, dtype=np.int64), np.asarray(nodes2, dtype=np.int64)
+    while True:
+        roots1, roots2 = parent[nodes1], parent[nodes2]
+        _diff = roots1 != roots2
+        if not _diff.any():
+            return parent
+        np.minimum.at(parent, np.maximum(roots1[_diff], roots2[_diff]), np.minimum(roots1[_diff], roots2[_diff]))
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                break
+            parent = grand_parent
+
+def build_empCpd_table(number_peaks, anchor_rows, partner_rows, relations, ids=None):
+    '''
+    Group matched peak pairs from isotope and adduct searches into empirical compounds (empCpds),
+    as connected components by union_find_components, 
+    instead of merging overlapping per-anchor signatures.
+
+    Input
+    =====
+    number_peaks: number of peaks, rows in peak table.
+    anchor_rows, partner_rows: aligned arrays of matched pairs, 
+            e.g. concatenated from match_patterns_columnar of isotopic and adduct patterns.
+    relations: labels aligned to pairs, e.g. np.array([x[1] for x in search_patterns])[pattern_numbers].
+    ids: optional peak IDs by row number.
+
+    Return
+    ======
+    Dictionary of aligned arrays, one row per grouped peak, ordered by empCpd and row:
+    {'peak_row': [], 'empCpd': [], 'relation': [], 'id': []}, 
+    where empCpd numbers are 0, 1, ... in the order of the first peak row in each group, and 
+    relation is 'anchor' for peaks not matched as partners, otherwise all matched relations joined by ';',
+    as in merge_confused_peak_matches.
+    '''
+    anchor_rows, partner_rows = np.asarray(anchor_rows, dtype=np.int64), np.asarray(partner_rows, dtype=np.int64)
+    roots = union_find_components(number_peaks, anchor_rows, partner_rows)
+    peak_rows = np.unique(np.concatenate((anchor_rows, partner_rows)))
+    _, empCpds = np.unique(roots[peak_rows], return_inverse=True)       # peak_rows are sorted, so are roots
+    _order = np.lexsort((peak_rows, empCpds))
+    peak_rows, empCpds = peak_rows[_order], empCpds[_order]
+
+    relation_names, relation_codes = np.unique(np.asarray(relations, dtype=str), return_inverse=True)
+    relation_names = relation_names.tolist()
+    pairs = np.unique(np.stack((partner_rows, relation_codes.reshape(-1))), axis=1)
+    matched_relations = {}
+    for row, code in zip(pairs[0].tolist(), pairs[1].tolist()):
+        if row in matched_relations:
+            matched_relations[row] += ';' + relation_names[code]
+        else:
+            matched_relations[row] = relation_names[code]
+    table = {
+        'peak_row': peak_rows,
+        'empCpd': empCpds,
+        'relation': np.array([matched_relations.get(row, 'anchor') for row in peak_rows.tolist()], dtype=object),
+    }
+    if ids is not None:
+        table['id'] = np.asarray(ids)[peak_rows]
+    return table
 
 
 #
@@ -403,14 +828,76 @@ def search_formula_mass_dataframe(query_mz, DFDB, limit_ppm=10):
     Not using idxmin,   #ii = DFDB.tmp.idxmin()
     # in pd.DF, index not necessarily integer; can be sequence if more than one match, but they are trying to fix in pandas dev version
     '''
-    DFDB['tmp'] = abs(DFDB.mz - query_mz)
-    ii = DFDB.tmp.values.argmin()
+    ii = np.abs(DFDB.mz.values - query_mz).argmin()      # not writing to DFDB, safe for concurrent use
     ppm = 1000000 * (query_mz - DFDB.iloc[ii].mz)/query_mz
     if  abs(ppm) < limit_ppm:
         return (DFDB.iloc[ii].name, ppm)            # name is formula_mass
     else:
         return None
 
+class FormulaMassSearch:
+    '''
+    Prebuilt, immutable search of a formula_mass database, answering arrays of query m/z values.
+    Same matching as search_formula_mass_dataframe, but using a sorted index instead of a scan per query,
+    and never modifying the input database. 
+    ppm is signed to capture the direction of mass shift, 1000000 * (query_mz - db_mz)/query_mz.
+
+    Example
+    -------
+    FMS = FormulaMassSearch(DFDB)           # DFDB indexed by formula_mass, with column 'mz'
+    names, ppms = FMS.search_best(feature_mzs, limit_ppm=10)
+    '''
+    def __init__(self, DFDB=None, mz=None, names=None, mz_col='mz'):
+        '''
+        DFDB: pandas DataFrame of reference database, index as names (e.g. formula_mass) and column mz_col.
+        mz, names: alternative to DFDB, arrays of m/z values and their names.
+        '''
+        if DFDB is not None:
+            mz, names = DFDB[mz_col].values, DFDB.index.values
+        self.mz = np.array(mz, dtype=np.float64)
+        self.names = np.array(names if names is not None else np.arange(len(self.mz)), dtype=object)
+        self.index = SortedMassIndex(self.mz)
+        for x in (self.mz, self.names, self.index.order, self.index.sorted_masses):
+            x.flags.writeable = False
+
+    def __len__(self):
+        return len(self.mz)
+
+    def _ppm(self, query_mzs, rows):
+        return 1000000 * (query_mzs - self.mz[rows]) / query_mzs
+
+    def search_best(self, query_mzs, limit_ppm=10):
+        '''
+        Return best match for each of query_mzs, as two arrays aligned to query_mzs, (names, ppms).
+        None and nan if no match under limit_ppm.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        rows = self.index.find_best_batch(query_mzs, limit_ppm)
+        _good = rows >= 0
+        names = np.full(query_mzs.shape, None, dtype=object)
+        ppms = np.full(query_mzs.shape, np.nan)
+        names[_good] = self.names[rows[_good]]
+        ppms[_good] = self._ppm(query_mzs[_good], rows[_good])
+        return names, ppms
+
+    def search_all(self, query_mzs, limit_ppm=10):
+        '''
+        Return all matches under limit_ppm, as aligned arrays (query_numbers, names, ppms),
+        where query_numbers are positions in query_mzs.
+        '''
+        query_mzs = np.asarray(query_mzs, dtype=np.float64)
+        query_numbers, rows = self.index.find_all_batch(query_mzs, limit_ppm)
+        return query_numbers, self.names[rows], self._ppm(query_mzs[query_numbers], rows)
+
+    def search(self, query_mz, limit_ppm=10):
+        '''
+        Return best match for a single query_mz, (name, ppm) or None, same as search_formula_mass_dataframe.
+        '''
+        names, ppms = self.search_best(np.array([query_mz]), limit_ppm)
+        if names[0] is None:
+            return None
+        return (names[0], float(ppms[0]))
+
 def is_matched_lcms_peaks(peak1, peak2, mz_tolerance_ppm=5, rt_tolerance=10):
     '''
     Check if two peaks are matched by mz and rtime.
@@ -422,3 +909,66 @@ def is_matched_lcms_peaks(peak1, peak2, mz_tolerance_ppm=5, rt_tolerance=10):
         matched = True
     return matched
 
+
+
+def _mz_rtime_arrays(feature_table, mz_key='mz', rt_key='rtime'):
+    '''
+    Return arrays of m/z and rtime from list of feature dictionaries, dictionary of arrays or DataFrame.
+    '''
+    if isinstance(feature_table, list):
+        return (np.array([f[mz_key] for f in feature_table], dtype=np.float64), 
+                np.array([f[rt_key] for f in feature_table], dtype=np.float64))
+    return (_get_column(feature_table, mz_key).astype(np.float64), 
+            _get_column(feature_table, rt_key).astype(np.float64))
+
+def match_lcms_peaks_bulk(table1, table2, mz_tolerance_ppm=5, rt_tolerance=10, 
+                          best_only=False, mz_key='mz', rt_key='rtime', index2=None):
+    '''
+    Match two feature tables by mz and rtime, following the rules of is_matched_lcms_peaks,
+    abs(mz2 - mz1) < mz1 * mz_tolerance_ppm * 1e-6 and abs(rtime2 - rtime1) < rt_tolerance.
+    Uses a MzRtGridIndex on table2 instead of the O(n*m) loop of pairwise comparisons.
+
+    Input
+    =====
+    table1, table2: features as [{'id': 'F1', 'mz': 60.0808, 'rtime': 117.7, ...}, ...], 
+            or dictionaries of arrays or DataFrames with columns mz_key and rt_key.
+    best_only: if True, keep only the best match in table2 for each feature in table1,
+            by the smallest sum of squared deviations in mz and rtime, each scaled by its tolerance.
+    index2: optional prebuilt MzRtGridIndex of table2, e.g. when matching many tables to a reference.
+
+    Return
+    ======
+    Two aligned arrays (rows1, rows2) of matched row numbers in table1 and table2, ordered by rows1.
+    '''
+    mz1, rt1 = _mz_rtime_arrays(table1, mz_key, rt_key)
+    if index2 is None:
+        mz2, rt2 = _mz_rtime_arrays(table2, mz_key, rt_key)
+        index2 = MzRtGridIndex(mz2, rt2, rt_cell_width=rt_tolerance or 1)
+    else:
+        mz2, rt2 = index2.masses, index2.rtimes
+    rows1, rows2 = index2.find_all_batch(mz1, rt1, mz_tolerance_ppm, rt_tolerance)
+    _good = np.abs(rt2[rows2] - rt1[rows1]) < rt_tolerance       # strict as in is_matched_lcms_peaks
+    rows1, rows2 = rows1[_good], rows2[_good]
+    if best_only and len(rows1):
+        score = ((mz2[rows2] - mz1[rows1]) / (mz1[rows1] * mz_tolerance_ppm * 0.000001))**2 + (
+                 (rt2[rows2] - rt1[rows1]) / rt_tolerance)**2
+        _order = np.lexsort((rows2, score, rows1))
+        rows1, rows2 = rows1[_order], rows2[_order]
+        _first = np.concatenate(([True], rows1[1:] != rows1[:-1]))
+        rows1, rows2 = rows1[_first], rows2[_first]
+    return rows1, rows2
+
+def match_lcms_tables_to_reference(reference, list_tables, mz_tolerance_ppm=5, rt_tolerance=10, 
+                                   best_only=True, mz_key='mz', rt_key='rtime'):
+    '''
+    Match many feature tables, e.g. processing batches, against a reference table,
+    using match_lcms_peaks_bulk with the index of reference built only once.
+    
+    Return
+    ======
+    List of (rows_in_table, rows_in_reference) for list_tables.
+    '''
+    mz, rtime = _mz_rtime_arrays(reference, mz_key, rt_key)
+    index = MzRtGridIndex(mz, rtime, rt_cell_width=rt_tolerance or 1)
+    return [match_lcms_peaks_bulk(table, None, mz_tolerance_ppm, rt_tolerance, 
+                                  best_only, mz_key, rt_key, index2=index) for table in list_tables]
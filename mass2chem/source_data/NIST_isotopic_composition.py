@@ -0,0 +1,46 @@
+"""
+Natural isotopic compositions (abundance as mole fraction) of stable isotopes, for elements common in metabolomics.
+
+Isotope information sourced from:
+
+https://www.nist.gov/pml/atomic-weights-and-isotopic-compositions-relative-atomic-masses
+
+Coursey, J.S., Schwab, D.J., Tsai, J.J., and Dragoset, R.A. (2015),
+Atomic Weights and Isotopic Compositions (version 4.1).
+[Online] Available: http://physics.nist.gov/Comp
+National Institute of Standards and Technology, Gaithersburg, MD.
+
+Keys of isotopes are as in NIST_isotope_data.NIST_ISOTOPE_DATA['isotopes'], where their masses are.
+"""
+
+NIST_ISOTOPIC_COMPOSITION = {
+    "H": {"[1H]": 0.999885, "[2H]": 0.000115},
+    "He": {"[3He]": 0.00000134, "[4He]": 0.99999866},
+    "Li": {"[6Li]": 0.0759, "[7Li]": 0.9241},
+    "B": {"[10B]": 0.199, "[11B]": 0.801},
+    "C": {"[12C]": 0.9893, "[13C]": 0.0107},
+    "N": {"[14N]": 0.99636, "[15N]": 0.00364},
+    "O": {"[16O]": 0.99757, "[17O]": 0.00038, "[18O]": 0.00205},
+    "F": {"[19F]": 1.0},
+    "Na": {"[23Na]": 1.0},
+    "Mg": {"[24Mg]": 0.7899, "[25Mg]": 0.1000, "[26Mg]": 0.1101},
+    "Al": {"[27Al]": 1.0},
+    "Si": {"[28Si]": 0.92223, "[29Si]": 0.04685, "[30Si]": 0.03092},
+    "P": {"[31P]": 1.0},
+    "S": {"[32S]": 0.9499, "[33S]": 0.0075, "[34S]": 0.0425, "[36S]": 0.0001},
+    "Cl": {"[35Cl]": 0.7576, "[37Cl]": 0.2424},
+    "K": {"[39K]": 0.932581, "[40K]": 0.000117, "[41K]": 0.067302},
+    "Ca": {"[40Ca]": 0.96941, "[42Ca]": 0.00647, "[43Ca]": 0.00135, "[44Ca]": 0.02086,
+           "[46Ca]": 0.00004, "[48Ca]": 0.00187},
+    "Mn": {"[55Mn]": 1.0},
+    "Fe": {"[54Fe]": 0.05845, "[56Fe]": 0.91754, "[57Fe]": 0.02119, "[58Fe]": 0.00282},
+    "Co": {"[59Co]": 1.0},
+    "Ni": {"[58Ni]": 0.68077, "[60Ni]": 0.26223, "[61Ni]": 0.011399, "[62Ni]": 0.036346, "[64Ni]": 0.009255},
+    "Cu": {"[63Cu]": 0.6915, "[65Cu]": 0.3085},
+    "Zn": {"[64Zn]": 0.4917, "[66Zn]": 0.2773, "[67Zn]": 0.0404, "[68Zn]": 0.1845, "[70Zn]": 0.0061},
+    "As": {"[75As]": 1.0},
+    "Se": {"[74Se]": 0.0089, "[76Se]": 0.0937, "[77Se]": 0.0763, "[78Se]": 0.2377, "[80Se]": 0.4961,
+           "[82Se]": 0.0873},
+    "Br": {"[79Br]": 0.5069, "[81Br]": 0.4931},
+    "I": {"[127I]": 1.0},
+}
@@ -1,16 +1,26 @@
-import json
 from functools import cache
 import numpy as np
 from scipy.stats import multinomial
 from mass2chem.formula import parse_chemformula_dict
+from mass2chem.source_data.NIST_isotope_data import NIST_ISOTOPE_DATA
+from mass2chem.source_data.NIST_isotopic_composition import NIST_ISOTOPIC_COMPOSITION
 from itertools import product
 import heapq
 
 @cache
-# this loads the isotope data file, need to consolidate to one representation
-def isotopes(iso_path="/Users/mitchjo/Projects/ChemoselectiveDerivatizationTools/New/isotopes.json"):
-    with open(iso_path) as isotope_fh:
-        return json.load(isotope_fh)
+# isotopes of each element from the bundled NIST data, as (names, masses, abundances) in order of mass number,
+# masses and abundances as numpy vectors for vectorized calculations; isotopes of zero abundance are left out
+def isotopes():
+    table = {}
+    for ele, composition in NIST_ISOTOPIC_COMPOSITION.items():
+        present = [k for k, v in composition.items() if v > 0]
+        masses = np.array([NIST_ISOTOPE_DATA['isotopes'][k] for k in present], dtype=np.float64)
+        abundances = np.array([composition[k] for k in present], dtype=np.float64)
+        abundances /= abundances.sum()
+        masses.setflags(write=False)
+        abundances.setflags(write=False)
+        table[ele] = (tuple(k.strip('[]') for k in present), masses, abundances)
+    return table
 
 @cache
 # this builds and stores the multinomial object for use in calc_iso_nap
@@ -48,16 +58,21 @@ def formula_to_components(formula):
     formula = parse_chemformula_dict(formula) if isinstance(formula, str) else formula
     components = {ele: [] for ele in formula}
     for ele, count in formula.items():
-        for c_vec in __permute(len(isotopes()[ele][0]), count):
+        names, masses, abundances = isotopes()[ele]
+        c_vecs = __permute(len(names), count)
+        # all iso combinations of the element at once, as a matrix of vectors
+        vectors = np.array(c_vecs)
+        naps = multinomial(count, abundances).pmf(vectors)
+        vector_masses = vectors @ masses
+        for ii in np.argsort(-naps, kind='stable'):
             components[ele].append({
-                "nap": calc_iso_nap(ele, c_vec),
-                "mass": calc_mass(ele, c_vec),
-                "vector": c_vec
+                "nap": naps[ii],
+                "mass": vector_masses[ii],
+                "vector": c_vecs[ii]
             })
-        components[ele] = sorted(components[ele], key=lambda x: -x['nap'])
     return components
 
-@cache
+# not cached: a cached generator is exhausted after first use. See isotopes.isotope_patterns_batch
 def generate_isotopologues(formula, min_NAP=0.01):
     formula = parse_chemformula_dict(formula)
     components = formula_to_components(formula)
@@ -0,0 +1,88 @@
+import unittest
+import tempfile
+import os
+
+from mass2chem.formula import compute_adducts_formulae, get_adduct_table, ADDUCT_DEFINITIONS
+from mass2chem.adduct_db import build_adduct_db, AdductDB
+
+COMPOUNDS = [
+    {'id': 'HMDB0000122', 'formula': 'C6H12O6', 'neutral_mass': 180.06339},
+    {'id': 'HMDB0000123', 'formula': 'C2H5NO2', 'neutral_mass': 75.03203},
+    {'id': 'HMDB0000159', 'formula': 'C9H11NO2', 'neutral_mass': 165.07898},
+    {'id': 'HMDB0000660', 'formula': 'C6H12O6', 'neutral_mass': 180.06339},
+]
+
+
+class TestAdductDB(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_build_matches_per_compound(self):
+        for mode in ('pos', 'neg'):
+            DB = build_adduct_db(COMPOUNDS, mode=mode, primary_only=False, use_cache=False)
+            expected = []
+            for c in COMPOUNDS:
+                for mz, ion, formula in compute_adducts_formulae(c['neutral_mass'], c['formula'], mode, False):
+                    expected.append((c['id'], ion, formula, mz))
+            self.assertEqual(list(zip(DB.compound_ids.tolist(), DB.ions.tolist(),
+                                      DB.formulas.tolist(), DB.mz.tolist())), expected)
+
+    def test_repeated_elements_and_additive_compounds(self):
+        # summed and removed here, unlike compute_adducts_formulae which parses by formula.parse_chemformula_dict
+        compounds = [{'id': 'acetic acid', 'formula': 'CH3COOH', 'neutral_mass': 60.02113},
+                     {'id': 'salt', 'formula': 'C2H4O2·HCl', 'neutral_mass': 60.02113}]
+        DB = build_adduct_db(compounds, use_cache=False)
+        ions = {(x, ion): formula for x, ion, formula in zip(DB.compound_ids, DB.ions, DB.formulas)}
+        self.assertEqual(ions[('acetic acid', 'M+H[1+]')], 'C2H5O2')
+        self.assertEqual(ions[('salt', 'M+H[1+]')], 'C2H5O2')
+        per_compound = {ion: formula for mz, ion, formula in compute_adducts_formulae(60.02113, 'CH3COOH', 'pos', True)}
+        self.assertEqual(per_compound['M+H[1+]'], 'CH2O')
+
+    def test_user_defined_adducts(self):
+        table = get_adduct_table('neg', True).extend(ADDUCT_DEFINITIONS['neg']['multimer'])
+        DB = build_adduct_db(COMPOUNDS, adduct_table=table, cache_dir=self.cache_dir)
+        expected = []
+        for c in COMPOUNDS:
+            for mz, ion, formula in compute_adducts_formulae(c['neutral_mass'], c['formula'], adduct_table=table):
+                expected.append((c['id'], ion, formula, mz))
+        self.assertEqual(list(zip(DB.compound_ids.tolist(), DB.ions.tolist(),
+                                  DB.formulas.tolist(), DB.mz.tolist())), expected)
+        self.assertIn('2M-H[-]', DB.ions.tolist())
+
+    def test_cache(self):
+        DB = build_adduct_db(COMPOUNDS, cache_dir=self.cache_dir)
+        cached = [f for f in os.listdir(self.cache_dir) if f.endswith('.npz')]
+        self.assertEqual(len(cached), 1)
+        DB2 = build_adduct_db(COMPOUNDS, cache_dir=self.cache_dir)
+        self.assertEqual(DB2.mz.tolist(), DB.mz.tolist())
+        self.assertEqual(DB2.ions.tolist(), DB.ions.tolist())
+        # different parameters give a different cache entry
+        build_adduct_db(COMPOUNDS, mode='neg', cache_dir=self.cache_dir)
+        self.assertEqual(len([f for f in os.listdir(self.cache_dir) if f.endswith('.npz')]), 2)
+
+    def test_annotate_features(self):
+        DB = build_adduct_db(COMPOUNDS, mode='pos', use_cache=False)
+        features = [{'id_number': 'F1', 'mz': 181.07067}, {'id_number': 'F2', 'mz': 300.0},
+                    {'id_number': 'F3', 'mz': 166.08626}]
+        result = DB.annotate_features(features, limit_ppm=5)
+        found = sorted(zip(result['query_number'].tolist(), result['compound_id'].tolist(),
+                           result['ion'].tolist()))
+        self.assertEqual(found, [(0, 'HMDB0000122', 'M+H[1+]'), (0, 'HMDB0000660', 'M+H[1+]'),
+                                 (2, 'HMDB0000159', 'M+H[1+]')])
+        self.assertTrue((abs(result['ppm']) < 5).all())
+
+    def test_save_load(self):
+        DB = build_adduct_db(COMPOUNDS, use_cache=False)
+        path = os.path.join(self.cache_dir, 'db.npz')
+        DB.save(path)
+        DB2 = AdductDB.load(path)
+        self.assertEqual(len(DB2), len(DB))
+        self.assertEqual(DB2.compound_ids.tolist(), DB.compound_ids.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
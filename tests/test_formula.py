@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+
+from mass2chem.formula import (
+    PROTON,
+    ELECTRON,
+    ADDUCT_DEFINITIONS,
+    get_adduct_table,
+    compute_adducts_formulae,
+    calculate_formula_diff,
+)
+from mass2chem.source_data.NIST_isotope_data import NIST_ISOTOPE_DATA
+
+
+class TestAdductTable(unittest.TestCase):
+    def test_mz(self):
+        mw = 180.06339
+        table = get_adduct_table('pos', primary_only=False)
+        self.assertIs(table, get_adduct_table('pos', primary_only=False))
+        mz = dict(zip(table.ions, table.compute_mz([mw])[0]))
+        self.assertAlmostEqual(mz['M+H[1+]'], mw + PROTON, places=6)
+        self.assertAlmostEqual(mz['M+2H[2+]'], mw/2 + PROTON, places=6)
+        self.assertAlmostEqual(mz['M+Na[1+]'], mw + 21.9820 + PROTON, places=3)
+        self.assertAlmostEqual(mz['M(C13)+3H[3+]'], mw/3 + 0.3344 + PROTON, places=3)
+        mz = {x[1]: x[0] for x in compute_adducts_formulae(mw, 'C6H12O6', 'neg')}
+        self.assertAlmostEqual(mz['M-H[-]'], mw - PROTON, places=6)
+        self.assertAlmostEqual(mz['M+K-2H[-]'], mw + 38.9628 - 2*PROTON, places=3)
+
+    def test_mz_changes(self):
+        # m/z at mw 180.06339 from the rounded constants of mass2chem <= 0.5.1, and from exact masses now
+        mw = 180.06339
+        changes = {
+            'pos': {'M+K[1+]': (219.0261665, 219.0265475)},
+            'neg': {'M+K-2H[-]': (217.0116371, 217.0119954),
+                    'M+Cl[-]': (215.03229, 215.0327917),
+                    'M+Cl37[-]': (217.02929, 217.0298416),
+                    'M+Br[-]': (258.98169, 258.9822766),
+                    'M+Br81[-]': (260.97969, 260.9802287),
+                    'M+HCOO[-]': (225.061035, 225.0615933),
+                    'M+CH3COO[-]': (239.076685, 239.0772433)},
+        }
+        for mode, ions in changes.items():
+            table = get_adduct_table(mode, primary_only=False)
+            mz = dict(zip(table.ions, table.compute_mz([mw])[0]))
+            for ion, (old_mz, new_mz) in ions.items():
+                self.assertAlmostEqual(mz[ion], new_mz, places=6)
+                self.assertGreater(mz[ion] - old_mz, 0.00035)
+                self.assertLess(mz[ion] - old_mz, 0.0006)
+        # anions gain an electron
+        mz = dict(zip(get_adduct_table('neg').ions, get_adduct_table('neg').compute_mz([mw])[0]))
+        self.assertAlmostEqual(mz['M+Cl[-]'], mw + NIST_ISOTOPE_DATA['isotopes']['[35Cl]'] + ELECTRON, places=7)
+
+    def test_vectorized(self):
+        masses = np.array([75.03203, 180.06339, 165.07898])
+        table = get_adduct_table('neg', primary_only=True)
+        mz = table.compute_mz(masses)
+        self.assertEqual(mz.shape, (3, len(table)))
+        for ii, mw in enumerate(masses):
+            self.assertEqual(mz[ii].tolist(), table.compute_mz([mw])[0].tolist())
+
+    def test_multimers(self):
+        table = get_adduct_table('pos', True).extend(ADDUCT_DEFINITIONS['pos']['multimer'])
+        adducts = compute_adducts_formulae(180.06339, 'C6H12O6', adduct_table=table)
+        self.assertEqual(len(adducts), len(table))
+        self.assertEqual(adducts[-3][1:], ['2M+H[1+]', 'C12H25O12'])
+        self.assertAlmostEqual(adducts[-3][0], 2 * 180.06339 + PROTON, places=6)
+        # invalid ions are excluded, e.g. no C for C13 isotopes
+        adducts = compute_adducts_formulae(17.02655, 'H3N', 'pos')
+        self.assertNotIn('M(C13)+H[1+]', [x[1] for x in adducts])
+
+
+class TestFormulaDiff(unittest.TestCase):
+    def test_calculate_formula_diff(self):
+        d1, d2 = {'C': 6, 'H': 12, 'O': 6}, {'C': 6, 'H': 10, 'O': 5}
+        self.assertEqual(calculate_formula_diff(d1, d2), {'H': 2, 'O': 1})
+        self.assertEqual(d1, {'C': 6, 'H': 12, 'O': 6})
+        with self.assertWarns(UserWarning):
+            self.assertEqual(calculate_formula_diff({'C': 2, 'O': 1}, {'C': 1, 'N': 1}), {'C': 1, 'O': 1, 'N': -1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import numpy as np
+
+from mass2chem.formula_matrix import parse_formula_matrix, matrix_to_formula_dicts
+from mass2chem.formula import dict_to_hill_formula
+from mass2chem.formula_key import FormulaCodec
+from mass2chem.lib.formula_coordinate import formula_coordinate
+
+
+class TestFormulaCodec(unittest.TestCase):
+    def setUp(self):
+        self.codec = FormulaCodec()
+
+    def test_roundtrip(self):
+        formulas = [x[1] for x in formula_coordinate if '(' not in x[1]]
+        matrix, elements = parse_formula_matrix(formulas)
+        known = [all(x in self.codec.elements or not matrix[ii, jj] for jj, x in enumerate(elements))
+                 for ii in range(len(formulas))]
+        matrix = matrix[known]
+        keys = self.codec.encode_matrix(matrix, elements)
+        decoded, decoded_elements = self.codec.decode_matrix(keys)
+        self.assertEqual(matrix_to_formula_dicts(decoded, decoded_elements),
+                         matrix_to_formula_dicts(matrix, elements))
+        hill = self.codec.to_hill(keys)
+        self.assertEqual(self.codec.to_int(self.codec.from_hill(hill)), self.codec.to_int(keys))
+        # same formula, same key
+        self.assertEqual(len(set(self.codec.to_int(keys))), len(set(hill)))
+
+    def test_hill(self):
+        keys = self.codec.from_hill(['H12O6C6', 'C6H12O6', '[13C]6H12O6', 'NaCl', 'C-1H-2'])
+        self.assertEqual(self.codec.to_hill(keys), ['C6H12O6', 'C6H12O6', 'H12O6[13C]6', 'ClNa', 'C-1H-2'])
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(self.codec.decode(self.codec.encode({'C': 2, 'H': -4, 'O': 1})), {'C': 2, 'H': -4, 'O': 1})
+        self.assertEqual(self.codec.encode({'C': 1, '(C13)': 1}), self.codec.encode({'C': 1, '[13C]': 1}))
+
+    def test_hill_paren_isotopes(self):
+        # '(C13)' as written by formula.dict_to_hill_formula and compute_adducts_formulae
+        formula = dict_to_hill_formula({'C': 5, '(C13)': 1, 'H': 12})
+        self.assertEqual(formula, 'C5(C13)H12')
+        codec = FormulaCodec()
+        keys = codec.from_hill([formula, 'C5[13C]H12'])
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(codec.decode(codec.to_int(keys)[0]), {'C': 5, 'H': 12, '[13C]': 1})
+
+    def test_arithmetic(self):
+        glucose = self.codec.from_hill(['C6H12O6', 'C6H12O6'])
+        water = self.codec.from_hill(['H2O', 'C2H4O2'])
+        self.assertEqual(self.codec.to_hill(self.codec.subtract(glucose, water)), ['C6H10O5', 'C4H8O4'])
+        self.assertEqual(self.codec.to_hill(self.codec.add(glucose, water)), ['C6H14O7', 'C8H16O8'])
+        # formula changes with negative counts
+        loss = self.codec.from_hill(['C-1O-2', 'H-2O-1'])
+        self.assertEqual(self.codec.to_hill(self.codec.add(glucose, loss)), ['C5H12O4', 'C6H10O5'])
+        self.assertEqual(len(np.unique(self.codec.add(glucose, loss))), 2)
+
+    def test_unique(self):
+        keys = self.codec.from_hill(['C6H12O6', 'H2O', 'C6H12O6', 'C2H4O2', 'H2O', 'H-2O-1'])
+        unique_keys, inverse = self.codec.unique(keys, return_inverse=True)
+        expected, expected_inverse = np.unique(keys, return_inverse=True)
+        self.assertEqual(unique_keys.tolist(), expected.tolist())
+        self.assertEqual(inverse.tolist(), expected_inverse.ravel().tolist())
+        self.assertEqual(len(self.codec.unique(keys[:0])), 0)
+
+    def test_one_word_layout(self):
+        codec = FormulaCodec([[('C', 12), ('H', 13), ('N', 9), ('O', 10), ('P', 6), ('S', 6)]])
+        keys = codec.from_hill(['C6H12O6', 'C3H7NO2S'])
+        self.assertEqual(keys.dtype, np.uint64)
+        self.assertEqual(codec.to_hill(codec.subtract(keys, codec.from_hill(['O', 'S']))), ['C6H12O5', 'C3H7NO2'])
+        with self.assertRaises(ValueError):
+            codec.from_hill(['NaCl'])
+        with self.assertRaises(ValueError):
+            codec.from_hill(['C4000'])
+        with self.assertRaises(ValueError):
+            FormulaCodec([[('C', 40), ('H', 40)]])
+
+
+if __name__ == '__main__':
+    unittest.main()
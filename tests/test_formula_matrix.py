@@ -0,0 +1,98 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from mass2chem.formula import (parse_chemformula_dict_comprehensive, calculate_formula_mass,
+                               check_elemental_subset, add_formula_dict, dict_to_hill_formula)
+from mass2chem.formula_matrix import (parse_formula_matrix, formula_dicts_to_matrix,
+                                      matrix_to_formula_dicts, align_formula_matrix,
+                                      calculate_formula_masses, check_elemental_subset_matrix,
+                                      check_formula_changes, matrix_to_hill_formulas)
+from mass2chem.lib.formula_coordinate import formula_coordinate
+
+SPECIAL_FORMULAS = ['C3H6N2O2', 'C-2H12O5H-4·H2O', '[13C]4H12N2·2HCl', 'CH2O2H24O4', 'C6H12O6',
+                    '[13C]6H12O6', 'D2O', 'C2H12O-5', 'NaCl', '', 'C6H12O6']
+
+
+class TestFormulaMatrix(unittest.TestCase):
+    def test_same_as_comprehensive_parser(self):
+        formulas = [x[1] for x in formula_coordinate] + SPECIAL_FORMULAS
+        for negative in (True, False):
+            matrix, elements = parse_formula_matrix(formulas, handle_negative_number=negative)
+            self.assertEqual(matrix.shape, (len(formulas), len(elements)))
+            dicts = matrix_to_formula_dicts(matrix, elements)
+            for f, d in zip(formulas, dicts):
+                expected = parse_chemformula_dict_comprehensive(f, handle_negative_number=negative)
+                self.assertEqual(d, {k: v for k, v in expected.items() if v != 0})
+
+    def test_elements_and_sparse(self):
+        matrix, elements = parse_formula_matrix(pd.Series(['C6H12O6', 'C2H5NO2', None]))
+        self.assertEqual(elements, ['C', 'H', 'N', 'O'])
+        self.assertEqual(matrix.tolist(), [[6, 12, 0, 6], [2, 5, 1, 2], [0, 0, 0, 0]])
+        smatrix, _ = parse_formula_matrix(['C6H12O6', 'C2H5NO2', None], elements=elements, sparse=True)
+        self.assertEqual(smatrix.toarray().tolist(), matrix.tolist())
+        with self.assertRaises(ValueError):
+            parse_formula_matrix(['NaCl'], elements=elements)
+
+    def test_dicts_and_align(self):
+        list_dicts = [{'C': 1, 'O': 2}, {'H': 2, 'O': 1}]
+        matrix, elements = formula_dicts_to_matrix(list_dicts)
+        self.assertEqual(elements, ['C', 'H', 'O'])
+        self.assertEqual(matrix_to_formula_dicts(matrix, elements), list_dicts)
+        aligned = align_formula_matrix(matrix, elements, ['C', 'H', 'N', 'O'])
+        self.assertEqual(aligned.tolist(), [[1, 0, 0, 2], [0, 2, 0, 1]])
+
+    def test_hill_formulas(self):
+        formulas = [x[1] for x in formula_coordinate[:3000]]
+        matrix, elements = parse_formula_matrix(formulas)
+        expected = [dict_to_hill_formula(d) for d in matrix_to_formula_dicts(matrix, elements)]
+        self.assertEqual(matrix_to_hill_formulas(matrix, elements), expected)
+        list_dicts = [{'C': 5, '(C13)': 1, 'H': 12}, {'Na': 1, 'Cl': 1}, {'C': -1, 'H': -2}, {}]
+        matrix, elements = formula_dicts_to_matrix(list_dicts)
+        self.assertEqual(matrix_to_hill_formulas(matrix, elements), [dict_to_hill_formula(d) for d in list_dicts])
+
+    def test_formula_masses(self):
+        # calculate_formula_mass does not sum repeated elements, as in polymers, e.g. '(C2H2Cl2)nC2H6'
+        formulas = [x[1] for x in formula_coordinate if '(' not in x[1]]
+        expected = [calculate_formula_mass(f) for f in formulas]
+        masses = calculate_formula_masses(formulas)
+        self.assertEqual(masses.dtype, np.float64)
+        np.testing.assert_allclose(masses, expected, rtol=1e-10)
+        matrix, elements = parse_formula_matrix(formulas, sparse=True)
+        np.testing.assert_allclose(calculate_formula_masses(matrix, elements), expected, rtol=1e-10)
+        # isotopes
+        masses = calculate_formula_masses(['[13C]6H12O6', 'C6H12O6', 'D2O'])
+        self.assertAlmostEqual(masses[0] - masses[1], 6 * 1.0033548, places=6)
+        self.assertAlmostEqual(masses[2], 20.023118, places=5)
+
+    def test_elemental_subset(self):
+        formulas = [x[1] for x in formula_coordinate if '(' not in x[1]][:300]
+        fragments = ['H2O', 'CO2', 'C6H10O5', 'HPO3', 'NH3', 'C2H4O2', 'SO3', 'C3H6O3']
+        matrix, elements = parse_formula_matrix(formulas)
+        fragment_matrix, fragment_elements = parse_formula_matrix(fragments)
+        result = check_elemental_subset_matrix(matrix, elements, fragment_matrix, fragment_elements)
+        self.assertEqual(result.shape, (len(formulas), len(fragments)))
+        dicts = matrix_to_formula_dicts(matrix, elements)
+        fragment_dicts = matrix_to_formula_dicts(fragment_matrix, fragment_elements)
+        expected = [[check_elemental_subset(d, f) for f in fragment_dicts] for d in dicts]
+        self.assertEqual(result.tolist(), expected)
+
+    def test_formula_changes(self):
+        formulas = [x[1] for x in formula_coordinate if '(' not in x[1]][:300]
+        changes = [{'H': -2, 'O': -1}, {'H': 1}, {'C': -1, 'O': -2, 'H': 1}, {'Na': 1, 'H': -2}, {'N': -1, 'H': -3}]
+        matrix, elements = parse_formula_matrix(formulas)
+        change_matrix, change_elements = formula_dicts_to_matrix(changes)
+        result = check_formula_changes(matrix, elements, change_matrix, change_elements)
+        dicts = matrix_to_formula_dicts(matrix, elements)
+        expected = [[add_formula_dict(d, c) is not None for c in changes] for d in dicts]
+        self.assertEqual(result.tolist(), expected)
+        # 2M - H3N is valid for NH3
+        nh3, nh3_elements = parse_formula_matrix(['H3N'])
+        self.assertEqual(check_formula_changes(nh3, nh3_elements, change_matrix[-1:], change_elements,
+                                               nonempty=True).tolist(), [[False]])
+        self.assertEqual(check_formula_changes(nh3, nh3_elements, change_matrix[-1:], change_elements,
+                                               multipliers=np.array([2]), nonempty=True).tolist(), [[True]])
+
+
+if __name__ == '__main__':
+    unittest.main()
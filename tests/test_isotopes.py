@@ -0,0 +1,164 @@
+import os
+import unittest
+import tempfile
+from itertools import product
+import numpy as np
+from scipy.stats import multinomial
+
+from mass2chem.isotopes import (isotope_envelope, element_isotopes, isotope_patterns_batch,
+                                envelope_matrix, cluster_intensity_matrix, score_isotope_patterns)
+from mass2chem.cache import DiskCache
+from mass2chem.formula_matrix import calculate_formula_masses
+
+
+def brute_force_envelope(formula):
+    # all isotopic compositions, as (mass, probability)
+    per_element = []
+    for element, count in formula.items():
+        masses, abundances, _ = element_isotopes(element)
+        terms = []
+        for vector in product(range(count + 1), repeat=len(masses)):
+            if sum(vector) == count:
+                terms.append((np.dot(vector, masses), multinomial(count, abundances).pmf(vector)))
+        per_element.append(terms)
+    return [(sum(t[0] for t in combo), np.prod([t[1] for t in combo])) for combo in product(*per_element)]
+
+
+class TestIsotopeEnvelope(unittest.TestCase):
+    def test_fine_exact(self):
+        formula = {'C': 3, 'H': 6, 'N': 1, 'O': 2, 'S': 1}
+        masses, abundances = isotope_envelope(formula, mode='fine', min_abundance=1e-6, fine_tolerance=1e-7)
+        expected = sorted(x for x in brute_force_envelope(formula) if x[1] >= 1e-6)
+        self.assertEqual(len(masses), len(expected))
+        np.testing.assert_allclose(masses, [x[0] for x in expected], rtol=1e-12)
+        np.testing.assert_allclose(abundances, [x[1] for x in expected], rtol=1e-9)
+
+    def test_nominal(self):
+        masses, abundances = isotope_envelope('C64H120O6', mode='nominal', min_abundance=1e-5)
+        self.assertTrue(np.all(np.diff(masses) > 0.99))
+        self.assertAlmostEqual(masses[0], calculate_formula_masses(['C64H120O6'])[0], places=6)
+        self.assertAlmostEqual(abundances.sum(), 1, places=4)
+        # same as fine structure summed by nominal mass
+        fine_masses, fine_abundances = isotope_envelope('C64H120O6', mode='fine', min_abundance=1e-9)
+        nominal = np.round(fine_masses - masses[0]).astype(int)
+        summed = np.bincount(nominal, weights=fine_abundances)[:4]
+        np.testing.assert_allclose(abundances[:4], summed, rtol=1e-5)
+
+    def test_labeled_and_large(self):
+        m1, a1 = isotope_envelope('C6H12O6', mode='nominal')
+        m2, a2 = isotope_envelope('[13C]6H12O6', mode='nominal')
+        self.assertAlmostEqual(m2[0] - m1[0], 6 * 1.003354835, places=6)
+        self.assertGreater(a2[0], a1[0])
+        masses, abundances = isotope_envelope('C250H400N60O80S3', mode='fine', min_abundance=1e-4)
+        self.assertTrue(len(masses) > 50)
+        self.assertTrue(np.all(np.diff(masses) > 0))
+        with self.assertRaises(ValueError):
+            isotope_envelope('C6H12O6', mode='other')
+        with self.assertRaises(ValueError):
+            isotope_envelope('C6H12Xx', mode='fine')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestIsotopePatternsBatch(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = self._tmp.name
+        self.formulas = ['C6H12O6', 'C5H9NO4', 'C10H16N5O13P3', 'C6H12O6', 'C3H7NO2S', 'C2H3', 'X9', 'C-2']
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_batch_matches_envelope(self):
+        for workers in (1, 2):
+            patterns = isotope_patterns_batch(self.formulas, min_abundance=0.01, workers=workers,
+                                              use_cache=False, chunksize=2)
+            self.assertEqual(list(patterns), list(dict.fromkeys(self.formulas)))
+            self.assertIsNone(patterns['X9'])
+            self.assertIsNone(patterns['C-2'])
+            for x in ['C6H12O6', 'C10H16N5O13P3', 'C3H7NO2S']:
+                masses, abundances = isotope_envelope(x, min_abundance=0.01)
+                np.testing.assert_array_equal(patterns[x][0], masses)
+                np.testing.assert_array_equal(patterns[x][1], abundances)
+
+    def test_cache(self):
+        first = isotope_patterns_batch(self.formulas, min_abundance=0.01, workers=1, cache_dir=self.cache_dir)
+        cache = DiskCache(os.path.join(self.cache_dir, 'isotope_patterns.sqlite'))
+        self.assertEqual(len(cache), 5)
+        second = isotope_patterns_batch(self.formulas, min_abundance=0.01, workers=1, cache_dir=self.cache_dir)
+        for x in first:
+            if first[x] is None:
+                self.assertIsNone(second[x])
+            else:
+                np.testing.assert_array_equal(first[x][0], second[x][0])
+                np.testing.assert_array_equal(first[x][1], second[x][1])
+        # other min_abundance is a different key
+        isotope_patterns_batch(['C6H12O6'], min_abundance=0.001, workers=1, cache_dir=self.cache_dir)
+        self.assertEqual(len(cache), 6)
+
+    def test_eviction(self):
+        cache = DiskCache(os.path.join(self.cache_dir, 'test.sqlite'), max_bytes=1000)
+        cache.set_many({'a': bytes(400), 'b': bytes(400)})
+        cache.get_many(['a'])
+        cache.set_many({'c': bytes(400)})
+        self.assertLessEqual(cache.total_bytes(), 1000)
+        self.assertEqual(sorted(cache.get_many(['a', 'b', 'c'])), ['a', 'c'])
+
+
+class TestIsotopologueEnumerator(unittest.TestCase):
+    def test_bundled_isotopes(self):
+        from mass2chem.utils.IsotopologueEnumerator import isotopes, generate_isotopologues
+        names, masses, abundances = isotopes()['C']
+        self.assertEqual(names, ('12C', '13C'))
+        np.testing.assert_allclose(masses, element_isotopes('C')[0])
+        self.assertAlmostEqual(abundances.sum(), 1)
+        found = {round(float(x['MASS']), 6): x['NAP']['unlabeled'] for x in generate_isotopologues('C6H12O6', 0.001)}
+        masses, abundances = isotope_envelope('C6H12O6', min_abundance=0.002)
+        for m, a in zip(masses, abundances):
+            self.assertAlmostEqual(found[round(float(m), 6)], a, places=9)
+
+
+class TestIsotopePatternScoring(unittest.TestCase):
+    def setUp(self):
+        self.formulas = ['C6H12O6', 'C10H16N5O13P3', 'C20H40', 'X9']
+        # clusters of C6H12O6 at charge 1 and C10H16N5O13P3 at charge 2, and an M+1 peak eluting elsewhere
+        mzs, heights, rtimes, self.anchors = [], [], [], []
+        for formula, charge, mz, rt in [('C6H12O6', 1, 203.0526, 100), ('C10H16N5O13P3', 2, 252.9957, 200)]:
+            masses, abundances = isotope_envelope(formula, mode='nominal', min_abundance=1e-4)
+            self.anchors.append(len(mzs))
+            mzs += list(mz + (masses - masses[0]) / charge)
+            heights += list(abundances * 1e6)
+            rtimes += [rt] * len(masses)
+        mzs.append(203.0526 + 1.003355)
+        heights.append(1e6)
+        rtimes.append(400)
+        self.peaks = (np.array(mzs), np.array(heights), np.array(rtimes))
+
+    def test_envelope_matrix(self):
+        matrix, valid = envelope_matrix(self.formulas, number_peaks=3, use_cache=False, workers=1)
+        np.testing.assert_array_equal(valid, [True, True, True, False])
+        masses, abundances = isotope_envelope('C6H12O6', mode='nominal', min_abundance=1e-4)
+        np.testing.assert_allclose(matrix[0], abundances[:3])
+        np.testing.assert_array_equal(matrix[3], 0)
+
+    def test_cluster_intensity_and_scores(self):
+        mzs, heights, rtimes = self.peaks
+        observed = cluster_intensity_matrix(mzs, heights, self.anchors, charges=[1, -2], rtimes=rtimes,
+                                            mz_tolerance_ppm=20)
+        theoretical, valid = envelope_matrix(self.formulas, use_cache=False, workers=1)
+        np.testing.assert_allclose(observed / observed.sum(axis=1, keepdims=True),
+                                   theoretical[:2] / theoretical[:2].sum(axis=1, keepdims=True), rtol=1e-6)
+        for method in ('cosine', 'overlap'):
+            scores = score_isotope_patterns(observed, theoretical, method=method)
+            self.assertEqual(scores.shape, (2, 4))
+            np.testing.assert_array_equal(scores.argmax(axis=1), [0, 1])
+            np.testing.assert_allclose(scores[[0, 1], [0, 1]], 1)
+            np.testing.assert_array_equal(scores[:, 3], 0)
+            pairs = (np.array([0, 1, 1]), np.array([2, 0, 3]))
+            np.testing.assert_allclose(score_isotope_patterns(observed, theoretical, pairs=pairs, method=method),
+                                       scores[pairs])
+        # without retention time, the peak eluting elsewhere adds to M+1
+        observed = cluster_intensity_matrix(mzs, heights, self.anchors, charges=[1, 2], mz_tolerance_ppm=20)
+        self.assertGreater(observed[0, 1], 1e6)
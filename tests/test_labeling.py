@@ -0,0 +1,87 @@
+import unittest
+import numpy as np
+
+from mass2chem.isotopes import isotope_envelope, envelope_matrix
+from mass2chem.formula_matrix import calculate_formula_masses
+from mass2chem.labeling import (tracer_mass_shift, tracer_natural_abundance, labeled_isotopologue_mzs,
+                                find_labeled_partners, tracer_envelope_matrix, correct_natural_abundance)
+
+
+def labeled_mid(formula, carbons, label_fractions, number_peaks):
+    # observed MID of a mixture of molecules of j 13C atoms, computed from isotope envelopes of labeled formulae
+    monoisotopic = calculate_formula_masses([formula])[0]
+    mid = np.zeros(number_peaks)
+    for j, fraction in enumerate(label_fractions):
+        if fraction:
+            labeled = '[13C]%dC%d%s' % (j, carbons - j, formula[formula.index('H'):])
+            masses, abundances = isotope_envelope(labeled, mode='nominal', min_abundance=1e-9)
+            offsets = np.rint(masses - monoisotopic).astype(int)
+            keep = offsets < number_peaks
+            np.add.at(mid, offsets[keep], fraction * abundances[keep])
+    return mid
+
+
+class TestLabeling(unittest.TestCase):
+    def test_isotopologue_mzs(self):
+        self.assertAlmostEqual(tracer_mass_shift('13C'), 1.003355, places=6)
+        self.assertAlmostEqual(tracer_natural_abundance('15N'), 0.00364)
+        matrix = labeled_isotopologue_mzs([181.0707, 300.0], [6, 2], charges=[1, -2])
+        self.assertEqual(matrix.shape, (2, 7))
+        self.assertAlmostEqual(matrix[0, 6], 181.0707 + 6 * tracer_mass_shift('13C'))
+        self.assertAlmostEqual(matrix[1, 2], 300.0 + tracer_mass_shift('13C'))
+        self.assertTrue(np.isnan(matrix[1, 3:]).all())
+        with self.assertRaises(ValueError):
+            labeled_isotopologue_mzs([100.0], 1, tracer='18O')
+
+    def test_find_labeled_partners(self):
+        rng = np.random.default_rng(1)
+        mzs = np.concatenate([rng.uniform(100, 400, 300), 150 + np.arange(8) * tracer_mass_shift('13C')])
+        rtimes = rng.uniform(0, 100, len(mzs))
+        rtimes[300:] = 50
+        label_counts = rng.integers(1, 10, len(mzs))
+        feature_i, feature_j, number_labels = find_labeled_partners(mzs, label_counts, rtimes=rtimes, rt_tolerance=5)
+        expected = set()
+        for i in range(len(mzs)):
+            for n in range(1, label_counts[i] + 1):
+                target = mzs[i] + n * tracer_mass_shift('13C')
+                for j in np.flatnonzero(np.abs(mzs - target) < target * 5e-6):
+                    if abs(rtimes[j] - rtimes[i]) <= 5:
+                        expected.add((i, j, n))
+        self.assertEqual(set(zip(feature_i.tolist(), feature_j.tolist(), number_labels.tolist())), expected)
+        # without retention time, default max_labels
+        feature_i, feature_j, number_labels = find_labeled_partners(mzs[300:], charges=2)
+        np.testing.assert_array_equal(number_labels, 2 * (feature_j - feature_i))
+        feature_i, feature_j, number_labels = find_labeled_partners(mzs[300:])
+        self.assertEqual(len(feature_i), 8 * 7 // 2)
+        np.testing.assert_array_equal(number_labels, feature_j - feature_i)
+
+    def test_tracer_envelope(self):
+        formulas = ['C6H12O6', 'C5H9NO4', 'C3H7NO2S', 'H2O']
+        natural = tracer_envelope_matrix(formulas, tracer_natural_abundance('13C'), number_peaks=5, min_abundance=1e-9)
+        expected, valid = envelope_matrix(formulas, number_peaks=5, min_abundance=1e-9, use_cache=False, workers=1)
+        np.testing.assert_allclose(natural, expected, atol=1e-8)
+        labeled = tracer_envelope_matrix(formulas, [1.0, 0.5, 1.0, 1.0])
+        self.assertEqual(labeled.shape, (4, 7))
+        self.assertAlmostEqual(labeled[0, 6], natural[0, 0] / 0.9893 ** 6, places=6)
+        self.assertLess(labeled[0, :6].max(), 1e-12)
+        self.assertAlmostEqual(labeled[1, 0], 0.5 ** 5 * natural[1, 0] / 0.9893 ** 5, places=6)
+
+    def test_correct_natural_abundance(self):
+        label_fractions = [[0.3, 0, 0.2, 0, 0, 0, 0.5], [0.1, 0.2, 0.3, 0.4]]
+        observed = np.array([labeled_mid('C6H12O6', 6, label_fractions[0], 8) * 1e6,
+                             labeled_mid('C3H7NO2S', 3, label_fractions[1], 8) * 5e4])
+        corrected = correct_natural_abundance(observed, ['C6H12O6', 'C3H7NO2S'], chunk_size=1)
+        np.testing.assert_allclose(corrected[0], label_fractions[0] + [0], atol=1e-6)
+        np.testing.assert_allclose(corrected[1], label_fractions[1] + [0] * 4, atol=1e-6)
+        # natural abundance only is M+0 after correction
+        natural = tracer_envelope_matrix(['C6H12O6'], tracer_natural_abundance('13C'), number_peaks=7)
+        np.testing.assert_allclose(correct_natural_abundance(natural, ['C6H12O6'])[0], [1] + [0] * 6, atol=1e-6)
+
+    def test_light_isotopes_below_monoisotopic(self):
+        # molecules of 54Fe, lighter than monoisotopic 56Fe, are not in M+0 ... M+n
+        natural = tracer_envelope_matrix(['C34H32FeN4O4'], tracer_natural_abundance('13C'), number_peaks=12,
+                                         min_abundance=1e-9)
+        self.assertLess(natural[0, 10:].max(), 1e-6)
+        self.assertAlmostEqual(natural.sum(), 1 - 0.05845, places=2)
+        corrected = correct_natural_abundance(natural, ['C34H32FeN4O4'])
+        np.testing.assert_allclose(corrected[0], [1] + [0] * 11, atol=1e-6)
@@ -0,0 +1,176 @@
+import unittest
+import tempfile
+import multiprocessing
+import numpy as np
+
+from mass2chem.mass_index import (
+    SortedMassIndex, 
+    MzRtGridIndex, 
+    IncrementalMassIndex,
+    save_index,
+    load_index,
+    share_index,
+    attach_shared_index,
+)
+from mass2chem.search import (
+    build_centurion_tree,
+    find_all_matches_centurion_indexed_list,
+    find_best_match_centurion_indexed_list,
+)
+
+
+def make_peaks(N=2000, seed=1):
+    rng = np.random.default_rng(seed)
+    mzs = rng.uniform(80, 1200, N)
+    # add isotopic partners so that matches exist
+    mzs[N//2:] = mzs[:N - N//2] + 1.003355 * (1 + rng.normal(0, 1e-6, N - N//2))
+    return [{'id_number': ii, 'mz': float(mz), 'apex': 100} for ii, mz in enumerate(mzs)]
+
+
+class TestSortedMassIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.peaks = make_peaks()
+        self.mztree = build_centurion_tree(self.peaks)
+        self.index = SortedMassIndex.from_peaks(self.peaks)
+
+    def test_find_all_matches_same_as_centurion_tree(self):
+        for P in self.peaks[:500]:
+            q = P['mz'] + 1.003355
+            expected = sorted(p['id_number'] for p in find_all_matches_centurion_indexed_list(q, self.mztree, 5))
+            found = sorted(p['id_number'] for p in find_all_matches_centurion_indexed_list(q, self.index, 5))
+            self.assertEqual(found, expected)
+
+    def test_find_best_match_same_as_centurion_tree(self):
+        for P in self.peaks[:500]:
+            q = P['mz'] + 1.003355
+            expected = find_best_match_centurion_indexed_list(q, self.mztree, 2)
+            found = self.index.find_best_match(q, 2)
+            self.assertEqual(found, expected)
+
+    def test_find_all_batch(self):
+        queries = np.array([p['mz'] for p in self.peaks]) + 1.003355
+        query_numbers, indices = self.index.find_all_batch(queries, limit_ppm=5)
+        expected = set()
+        for ii, q in enumerate(queries):
+            for p in find_all_matches_centurion_indexed_list(q, self.mztree, 5):
+                expected.add((ii, p['id_number']))
+        self.assertEqual(set(zip(query_numbers.tolist(), indices.tolist())), expected)
+        self.assertTrue(np.all(np.diff(query_numbers) >= 0))
+
+    def test_find_best_batch(self):
+        queries = np.array([120.0, self.peaks[3]['mz'], 5000.0])
+        best = self.index.find_best_batch(queries, limit_ppm=2)
+        self.assertEqual(best[0], -1)
+        self.assertEqual(best[1], 3)
+        self.assertEqual(best[2], -1)
+        self.assertIsNone(SortedMassIndex([]).find_best(100.0))
+
+    def test_masses_in_original_order(self):
+        self.assertTrue(np.allclose(self.index.masses, [p['mz'] for p in self.peaks]))
+
+
+class TestMzRtGridIndex(unittest.TestCase):
+
+    def test_same_as_mz_search_then_rt_filter(self):
+        rng = np.random.default_rng(2)
+        N = 5000
+        mzs, rts = rng.uniform(80, 1200, N), rng.uniform(0, 600, N)
+        mzs[N//2:], rts[N//2:] = mzs[:N//2] + 1.003355, rts[:N//2] + rng.normal(0, 4, N//2)
+        queries = mzs + 1.003355
+        grid = MzRtGridIndex(mzs, rts, rt_cell_width=7)
+        query_numbers, indices = grid.find_all_batch(queries, rts, limit_ppm=5, rt_tolerance=5)
+        q, ii = SortedMassIndex(mzs).find_all_batch(queries, limit_ppm=5)
+        _good = np.abs(rts[ii] - rts[q]) <= 5
+        self.assertGreater(len(query_numbers), 0)
+        self.assertEqual(set(zip(query_numbers.tolist(), indices.tolist())), 
+                         set(zip(q[_good].tolist(), ii[_good].tolist())))
+        self.assertTrue(np.all(np.diff(query_numbers) >= 0))
+
+    def test_find_all_matches(self):
+        peaks = [{'id_number': 0, 'mz': 200.0, 'apex': 100}, {'id_number': 1, 'mz': 200.0001, 'apex': 300},
+                 {'id_number': 2, 'mz': 200.0002, 'apex': 104}]
+        grid = MzRtGridIndex.from_peaks(peaks, rt_cell_width=5)
+        found = grid.find_all_matches(200.0, 102, limit_ppm=5, rt_tolerance=5)
+        self.assertEqual(sorted(p['id_number'] for p in found), [0, 2])
+        self.assertEqual(len(MzRtGridIndex([], []).find_all(200.0, 100)), 0)
+
+
+class TestIncrementalMassIndex(unittest.TestCase):
+
+    def test_insert_remove_same_as_rebuild(self):
+        peaks = make_peaks(3000)
+        index = IncrementalMassIndex(min_buffer_size=100)
+        handles = []
+        for ii in range(0, len(peaks), 250):
+            batch = peaks[ii: ii+250]
+            handles.extend(index.insert_batch([p['mz'] for p in batch], batch).tolist())
+        removed = set(range(0, 3000, 7))
+        index.remove_batch(sorted(removed))
+        remaining = [p for p in peaks if p['id_number'] not in removed]
+        self.assertEqual(len(index), len(remaining))
+        mztree = build_centurion_tree(remaining)
+        for P in peaks[:400]:
+            q = P['mz'] + 1.003355
+            expected = sorted(p['id_number'] for p in find_all_matches_centurion_indexed_list(q, mztree, 5))
+            found = sorted(p['id_number'] for p in find_all_matches_centurion_indexed_list(q, index, 5))
+            self.assertEqual(found, expected)
+            self.assertEqual(find_best_match_centurion_indexed_list(q, index, 2),
+                             find_best_match_centurion_indexed_list(q, mztree, 2))
+
+    def test_single_insert_and_remove(self):
+        index = IncrementalMassIndex([100.0, 200.0])
+        handle = index.insert(150.0, {'id_number': 'new'})
+        self.assertEqual(index.find_best_match(150.0001, 5), {'id_number': 'new'})
+        index.remove(handle)
+        self.assertIsNone(index.find_best(150.0001, 5))
+        self.assertEqual(index.find_best(100.0, 5), 0)
+
+
+def _query_shared_index(args):
+    descriptor, queries = args
+    index = attach_shared_index(descriptor)
+    return index.find_all_batch(np.array(queries), limit_ppm=5)[1].tolist()
+
+
+class TestPersistedIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.mzs, self.rts = rng.uniform(80, 1200, 3000), rng.uniform(0, 600, 3000)
+
+    def test_save_load_memory_mapped(self):
+        for index in (SortedMassIndex(self.mzs), MzRtGridIndex(self.mzs, self.rts, rt_cell_width=5)):
+            with tempfile.TemporaryDirectory() as path:
+                save_index(index, path)
+                reopened = load_index(path)
+                self.assertIsInstance(reopened.sorted_masses, np.memmap)
+                self.assertIs(type(reopened), type(index))
+                if isinstance(index, SortedMassIndex):
+                    expected, found = index.find_all_batch(self.mzs, 5), reopened.find_all_batch(self.mzs, 5)
+                else:
+                    expected = index.find_all_batch(self.mzs, self.rts, 5, 5)
+                    found = reopened.find_all_batch(self.mzs, self.rts, 5, 5)
+                self.assertTrue(np.array_equal(expected[1], found[1]))
+                del reopened, found
+
+    def test_shared_memory(self):
+        index = SortedMassIndex(self.mzs)
+        descriptor, blocks = share_index(index)
+        try:
+            with multiprocessing.Pool(2) as pool:
+                results = pool.map(_query_shared_index, [(descriptor, self.mzs[:5].tolist()), 
+                                                         (descriptor, self.mzs[5:9].tolist())])
+            self.assertEqual(results, [[0, 1, 2, 3, 4], [5, 6, 7, 8]])
+            shared = attach_shared_index(descriptor)
+            self.assertFalse(shared.sorted_masses.flags.writeable)
+            self.assertEqual(shared.find_best(self.mzs[10]), 10)
+            del shared
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import pandas as pd
 
 from mass2chem.mz_deltas import (
@@ -10,7 +11,8 @@ from mass2chem.mz_deltas import (
     xing2020_hypothetical_neutral_losses,
     zhao2024_drug_exposure,
     lib_mzdiff_bioreaction,
-    lib_mzdiff_in_source
+    lib_mzdiff_in_source,
+    mine_frequent_deltas
 )
 
 class TestMzDeltas(unittest.TestCase):
@@ -79,5 +81,25 @@ class TestMzDeltas(unittest.TestCase):
         self.assertIn('tof_pos', methods)
         self.assertIn('tof_neg', methods)
 
+    def test_mine_frequent_deltas(self):
+        rng = np.random.default_rng(0)
+        mz = rng.uniform(100, 900, 1000)
+        rtime = rng.uniform(0, 600, 1000)
+        table = pd.DataFrame({
+            'mz': np.concatenate([mz, mz[:300] + 1.003355, mz[:100] + 21.98194]),
+            'rtime': np.concatenate([rtime, rtime[:300], rtime[:100]]),
+        })
+        df = mine_frequent_deltas(table, max_delta=30, rt_tolerance=1, min_count=50)
+        self.assertListEqual(list(df.columns), ['delta_mz', 'count_estimate'])
+        self.assertAlmostEqual(df['delta_mz'].iloc[0], 1.0034, places=3)
+        self.assertGreaterEqual(df['count_estimate'].iloc[0], 300)
+        self.assertTrue(np.any(np.abs(df['delta_mz'] - 21.9819) < 0.001))
+        # chunks of bounded memory give the same result
+        df_small_chunks = mine_frequent_deltas([table], max_delta=30, rt_tolerance=1, min_count=50, max_pairs=1000)
+        self.assertTrue(df.equals(df_small_chunks))
+        # a single table as list of feature dictionaries
+        df_dicts = mine_frequent_deltas(table.to_dict('records'), max_delta=30, rt_tolerance=1, min_count=50)
+        self.assertTrue(df.equals(df_dicts))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+import tempfile
+from unittest import mock
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from test_search import read_test_peaks, FEATURE_TABLE
+
+from mass2chem.peaks import PeakArray
+from mass2chem.io import read_features, read_features_peak_array
+from mass2chem.mass_index import SortedMassIndex, MzRtGridIndex
+from mass2chem.search import (
+    isotopic_patterns,
+    build_centurion_tree,
+    find_isotopic_signatures,
+    find_signatures_columnar,
+    is_coeluted_by_overlap,
+)
+
+
+class TestPeakArray(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.peaks = read_test_peaks()
+        cls.peak_array = PeakArray.from_dicts(cls.peaks)
+
+    def test_dict_compatible_view(self):
+        self.assertEqual(len(self.peak_array), len(self.peaks))
+        self.assertEqual(dict(self.peak_array[5]), self.peaks[5])
+        self.assertEqual(self.peak_array[-1]['id_number'], self.peaks[-1]['id_number'])
+        self.assertIn('apex', self.peak_array[0])
+        with self.assertRaises(KeyError):
+            self.peak_array[0]['rtime']
+        self.assertEqual(self.peak_array.to_dicts()[:3], self.peaks[:3])
+        self.assertTrue(is_coeluted_by_overlap(self.peak_array[0], self.peaks[0]))
+        self.assertLess(self.peak_array.nbytes / len(self.peak_array), 100)
+
+    def test_search_functions_accept_peak_array(self):
+        expected = find_isotopic_signatures(self.peaks, build_centurion_tree(self.peaks), isotopic_patterns)
+        found = find_isotopic_signatures(self.peak_array, build_centurion_tree(self.peak_array), isotopic_patterns)
+        self.assertEqual(found, expected)
+        found = find_signatures_columnar(self.peak_array, isotopic_patterns, apex_rt_tolerance=5)
+        self.assertEqual(found, expected)
+        index = SortedMassIndex.from_peaks(self.peak_array)
+        self.assertEqual(index.find_best_match(self.peaks[7]['mz'])['mz'], self.peaks[7]['mz'])
+
+    def test_subset_and_columns(self):
+        subset = self.peak_array[self.peak_array['mz'] < 100]
+        self.assertIsInstance(subset, PeakArray)
+        self.assertTrue(np.all(subset['mz'] < 100))
+        P = PeakArray.from_columns(id_number=np.arange(3), mz=[100.0, 101.0, 102.0])
+        self.assertEqual(P[1], {'id_number': 1, 'mz': 101.0})
+
+    def test_read_features_peak_array(self):
+        peak_array = read_features_peak_array(FEATURE_TABLE, intensity_cols=(11, 13))
+        features = read_features(FEATURE_TABLE, intensity_cols=(11, 13))
+        self.assertEqual(len(peak_array), len(features))
+        for ii in (0, 100, len(features) - 1):
+            self.assertEqual(peak_array[ii]['id'], features[ii]['id'])
+            self.assertAlmostEqual(peak_array[ii]['representative_intensity'], 
+                                   features[ii]['representative_intensity'])
+
+    def test_read_header_only_table(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'features.tsv')
+            with open(path, 'w') as O:
+                O.write(open(FEATURE_TABLE).readline())
+            peak_array = read_features_peak_array(path, intensity_cols=(11, 13))
+        self.assertEqual(len(peak_array), 0)
+        self.assertEqual(len(peak_array['representative_intensity']), 0)
+        self.assertEqual(len(SortedMassIndex.from_peaks(peak_array)), 0)
+
+    def test_index_from_peak_array_columns(self):
+        # indexes are built from columns, not by iterating peaks
+        with mock.patch.object(PeakArray, '__iter__', side_effect=AssertionError('iterated')):
+            index = SortedMassIndex.from_peaks(self.peak_array)
+            grid = MzRtGridIndex.from_peaks(self.peak_array)
+        np.testing.assert_array_equal(index.masses, self.peak_array['mz'])
+        np.testing.assert_array_equal(grid.rtimes, self.peak_array['apex'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from mass2chem.formula import parse_chemformula_dict_comprehensive
+from mass2chem.formula_matrix import calculate_formula_masses, formula_dicts_to_matrix
+from mass2chem.reaction_network import load_bioreactions, find_reaction_edges, candidate_pairs_by_mass
+from mass2chem.lib.formula_coordinate import formula_coordinate
+
+
+def brute_force_edges(formulas, reactions):
+    dicts = [parse_chemformula_dict_comprehensive(f) for f in formulas]
+    edges = []
+    for ii, d1 in enumerate(dicts):
+        for jj, d2 in enumerate(dicts):
+            if ii != jj:
+                diff = {k: d2.get(k, 0) - d1.get(k, 0) for k in set(d1) | set(d2)}
+                diff = {k: v for k, v in diff.items() if v}
+                for rr, r in enumerate(reactions):
+                    if diff == r[2]:
+                        edges.append((ii, jj, rr))
+    return edges
+
+
+class TestReactionNetwork(unittest.TestCase):
+    def setUp(self):
+        self.reactions = load_bioreactions()
+        self.formulas = [x[1] for x in formula_coordinate if '(' not in x[1]][1000:1400]
+
+    def test_load_bioreactions(self):
+        reactions = load_bioreactions(['zhao2024_drug_exposure'])
+        self.assertEqual(reactions[2][1], 'deglucuronidation')
+        self.assertEqual(reactions[2][2], {'C': -6, 'H': -8, 'O': -7})
+        self.assertGreater(len(self.reactions), len(reactions))
+
+    def test_all_pairs(self):
+        reactions = self.reactions[:300] + [[18.010565, 'hydration', {'H': 2, 'O': 1}]]
+        edges = find_reaction_edges(self.formulas, reactions, chunk_size=10000)
+        found = list(zip(edges['compound_i'].tolist(), edges['compound_j'].tolist(),
+                         edges['reaction_number'].tolist()))
+        self.assertEqual(found, brute_force_edges(self.formulas, reactions))
+        self.assertIn('hydration', edges['reaction'])
+
+    def test_candidate_pairs(self):
+        masses = calculate_formula_masses(self.formulas)
+        # masses in the JSON file are not always those of the formula changes
+        reaction_masses = calculate_formula_masses(*formula_dicts_to_matrix([x[2] for x in self.reactions]))
+        pairs = candidate_pairs_by_mass(masses, reaction_masses, mz_tolerance_ppm=5)
+        edges = find_reaction_edges(self.formulas, self.reactions, candidate_pairs=pairs)
+        all_edges = find_reaction_edges(self.formulas, self.reactions)
+        for k in ('compound_i', 'compound_j', 'reaction_number'):
+            self.assertEqual(edges[k].tolist(), all_edges[k].tolist())
+        self.assertGreater(len(edges['reaction']), 0)
+
+    def test_ids(self):
+        edges = find_reaction_edges(['C6H12O6', 'C6H10O5', 'C12H22O11'],
+                                    [[-18.010565, 'dehydration', "{'H': -2, 'O': -1}"]], ids=['a', 'b', 'c'])
+        self.assertEqual(edges['compound_i'].tolist(), ['a'])
+        self.assertEqual(edges['compound_j'].tolist(), ['b'])
+        self.assertEqual(edges['reaction'], ['dehydration'])
+
+
+if __name__ == '__main__':
+    unittest.main()
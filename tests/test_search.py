@@ -0,0 +1,220 @@
+import os
+import csv
+import unittest
+import numpy as np
+import pandas as pd
+
+from mass2chem.mass_index import MzRtGridIndex
+from mass2chem.search import (
+    isotopic_patterns,
+    common_adducts,
+    seed_empCpd_patterns,
+    build_centurion_tree,
+    find_all_matches_centurion_indexed_list,
+    find_best_match_centurion_indexed_list,
+    get_seed_empCpd_signatures,
+    find_isotopic_signatures,
+    find_adduct_signatures,
+    peaks_to_columns,
+    find_signatures_columnar,
+    find_signatures_parallel,
+    find_mzdiff_pairs,
+    find_mzdiff_pairs_from_masstracks,
+    search_formula_mass_dataframe,
+    FormulaMassSearch,
+    is_matched_lcms_peaks,
+    match_lcms_peaks_bulk,
+    match_lcms_tables_to_reference,
+    match_patterns_columnar,
+    union_find_components,
+    build_empCpd_table,
+)
+
+FEATURE_TABLE = os.path.join(os.path.dirname(__file__), '..', 'testdata', 'full_Feature_table.tsv')
+
+
+def read_test_peaks(feature_table=FEATURE_TABLE):
+    # asari feature table to peak format used in search functions
+    peaks = []
+    with open(feature_table) as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            peaks.append({
+                'id_number': row['id_number'], 'mz': float(row['mz']), 'apex': float(row['rtime']),
+                'left_base': float(row['rtime_left_base']), 'right_base': float(row['rtime_right_base']),
+                'height': float(row['peak_area']),
+            })
+    return peaks
+
+
+class TestCenturionTree(unittest.TestCase):
+
+    def test_high_mz_tolerance_window(self):
+        # 5 ppm at m/z 4000 is 0.02, wider than the three 0.01 bins around the query
+        peaks = [{'id_number': 0, 'mz': 4000.0}, {'id_number': 1, 'mz': 4000.018}, {'id_number': 2, 'mz': 4000.03}]
+        mztree = build_centurion_tree(peaks)
+        found = find_all_matches_centurion_indexed_list(4000.0, mztree, limit_ppm=5)
+        self.assertEqual(sorted(p['id_number'] for p in found), [0, 1])
+        best = find_best_match_centurion_indexed_list(3999.982, mztree, limit_ppm=5)
+        self.assertEqual(best['id_number'], 0)
+        self.assertIsNone(find_best_match_centurion_indexed_list(3999.97, mztree, limit_ppm=5))
+
+    def test_low_mz_unchanged(self):
+        peaks = [{'id_number': 0, 'mz': 133.0970}, {'id_number': 1, 'mz': 133.0990}]
+        mztree = build_centurion_tree(peaks)
+        found = find_all_matches_centurion_indexed_list(133.0971, mztree, limit_ppm=5)
+        self.assertEqual([p['id_number'] for p in found], [0])
+
+
+class TestColumnarSignatures(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.peaks = read_test_peaks()
+        cls.mztree = build_centurion_tree(cls.peaks)
+        cls.columns = peaks_to_columns(cls.peaks)
+
+    def test_seed_signatures(self):
+        expected = get_seed_empCpd_signatures(self.peaks, self.mztree, seed_empCpd_patterns['pos'],
+                                              isotope_rt_tolerance=5, coelution_rt_tolerance=10)
+        found = find_signatures_columnar(self.columns, seed_empCpd_patterns['pos'],
+                                         apex_rt_tolerance=5, coelution_rt_tolerance=10)
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(found, expected)
+
+    def test_isotopic_signatures(self):
+        expected = find_isotopic_signatures(self.peaks, self.mztree, isotopic_patterns)
+        found = find_signatures_columnar(self.columns, isotopic_patterns, apex_rt_tolerance=5)
+        self.assertEqual(found, expected)
+
+    def test_adduct_signatures(self):
+        expected = find_adduct_signatures(self.peaks, self.mztree, common_adducts['pos'])
+        found = find_signatures_columnar(self.columns, common_adducts['pos'], check_abundance_ratio=False)
+        self.assertEqual(found, expected)
+
+    def test_mz_rt_grid_index(self):
+        grid = MzRtGridIndex(self.columns['mz'], self.columns['apex'], rt_cell_width=5)
+        expected = find_signatures_columnar(self.columns, isotopic_patterns, apex_rt_tolerance=5)
+        found = find_signatures_columnar(self.columns, isotopic_patterns, apex_rt_tolerance=5, mz_index=grid)
+        self.assertEqual(found, expected)
+
+    def test_parallel_same_as_serial(self):
+        expected = find_signatures_columnar(self.columns, isotopic_patterns, apex_rt_tolerance=5)
+        for workers in (1, 2):
+            found = find_signatures_parallel(self.columns, isotopic_patterns, apex_rt_tolerance=5,
+                                             workers=workers, number_slabs=5)
+            self.assertEqual(found, expected)
+
+    def test_coelution_by_distance_without_boundaries(self):
+        columns = {'id_number': [1, 2, 3], 'mz': [100.0, 101.003355, 101.003355], 'apex': [50, 55, 90]}
+        found = find_signatures_columnar(columns, [(1.003355, '13C/12C')], coelution_rt_tolerance=10)
+        self.assertEqual(found, [[(1, 'anchor'), (2, '13C/12C')]])
+
+
+class TestMzdiffPairs(unittest.TestCase):
+
+    def test_best_match_same_as_centurion_tree(self):
+        peaks = read_test_peaks()
+        mztree = build_centurion_tree(peaks)
+        expected = []
+        for mzdiff in (1.003355, 21.9820):
+            for P1 in peaks:
+                P2 = find_best_match_centurion_indexed_list(P1['mz'] + mzdiff, mztree, 5)
+                if P2:
+                    expected.append((P1['id_number'], P2['id_number']))
+        self.assertEqual(find_mzdiff_pairs_from_masstracks(peaks, [1.003355, 21.9820], 5), expected)
+
+    def test_all_matches(self):
+        masses = [100.0, 101.003355, 101.00336, 122.0, 150.0]
+        diff_numbers, rows1, rows2 = find_mzdiff_pairs(masses, [1.003355, 22.0], 5, best_match=False)
+        self.assertEqual(list(zip(diff_numbers.tolist(), rows1.tolist(), rows2.tolist())),
+                         [(0, 0, 1), (0, 0, 2), (1, 0, 3)])
+        diff_numbers, rows1, rows2 = find_mzdiff_pairs(masses, [1.003355, 22.0], 5, best_match=True)
+        self.assertEqual(list(zip(diff_numbers.tolist(), rows1.tolist(), rows2.tolist())),
+                         [(0, 0, 1), (1, 0, 3)])
+        self.assertEqual(len(find_mzdiff_pairs([], [1.003355])[0]), 0)
+
+
+class TestFormulaMassSearch(unittest.TestCase):
+
+    def setUp(self):
+        mz = [89.0477, 133.0972, 146.0579, 180.0634, 180.0639]
+        self.DFDB = pd.DataFrame({'mz': mz}, index=['C3H7NO2_89.0477', 'C6H13O3_133.0972', 
+                                  'C5H8NO4_146.0579', 'C6H12O6_180.0634', 'Cx_180.0639'])
+
+    def test_same_as_dataframe_search(self):
+        FMS = FormulaMassSearch(self.DFDB)
+        for q in (89.0479, 133.0985, 180.0636, 500.0):
+            self.assertEqual(FMS.search(q, 10), search_formula_mass_dataframe(q, self.DFDB, 10))
+        self.assertListEqual(list(self.DFDB.columns), ['mz'])
+
+    def test_batch_search(self):
+        FMS = FormulaMassSearch(self.DFDB)
+        names, ppms = FMS.search_best([89.0479, 500.0], limit_ppm=10)
+        self.assertEqual(names[0], 'C3H7NO2_89.0477')
+        self.assertAlmostEqual(ppms[0], 1e6 * (89.0479 - 89.0477) / 89.0479)
+        self.assertIsNone(names[1])
+        self.assertTrue(np.isnan(ppms[1]))
+        query_numbers, names, ppms = FMS.search_all([180.0636], limit_ppm=5)
+        self.assertEqual(sorted(names), ['C6H12O6_180.0634', 'Cx_180.0639'])
+        self.assertTrue(ppms[0] > 0 > ppms[1])
+
+
+class TestMatchLcmsPeaksBulk(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        mz, rtime = rng.uniform(60, 900, 2000), rng.uniform(0, 600, 2000)
+        self.table1 = [{'id': 'F%d' % ii, 'mz': mz[ii], 'rtime': rtime[ii]} for ii in range(2000)]
+        self.table2 = [{'id': 'G%d' % ii, 'mz': mz[ii] * (1 + rng.normal(0, 2e-6)), 
+                        'rtime': rtime[ii] + rng.normal(0, 4)} for ii in range(2000)]
+
+    def test_same_as_pairwise(self):
+        rows1, rows2 = match_lcms_peaks_bulk(self.table1, self.table2, mz_tolerance_ppm=5, rt_tolerance=10)
+        expected = set()
+        for ii, peak1 in enumerate(self.table1):
+            for jj, peak2 in enumerate(self.table2):
+                if is_matched_lcms_peaks(peak1, peak2, mz_tolerance_ppm=5, rt_tolerance=10):
+                    expected.add((ii, jj))
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(set(zip(rows1.tolist(), rows2.tolist())), expected)
+
+    def test_best_only_and_reference(self):
+        rows1, rows2 = match_lcms_peaks_bulk(self.table1, self.table2, best_only=True)
+        self.assertEqual(len(rows1), len(set(rows1.tolist())))
+        self.assertGreater(np.mean(rows1 == rows2), 0.9)
+        results = match_lcms_tables_to_reference(self.table2, [self.table1, pd.DataFrame(self.table1)])
+        for r1, r2 in results:
+            self.assertTrue(np.array_equal(r1, rows1) and np.array_equal(r2, rows2))
+
+
+class TestEmpCpdGrouping(unittest.TestCase):
+
+    def test_union_find_components(self):
+        roots = union_find_components(8, [5, 1, 2, 6], [4, 2, 0, 7])
+        self.assertEqual(roots.tolist(), [0, 0, 0, 3, 4, 4, 6, 6])
+        # a long chain in reverse order
+        roots = union_find_components(1000, np.arange(999, 0, -1), np.arange(998, -1, -1))
+        self.assertTrue(np.all(roots == 0))
+
+    def test_build_empCpd_table(self):
+        table = build_empCpd_table(7, [0, 2, 3, 0], [1, 3, 4, 1], ['13C/12C', 'Na/H', '13C/12C', '15N/14N'],
+                                   ids=['F%d' % ii for ii in range(7)])
+        self.assertEqual(table['peak_row'].tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(table['empCpd'].tolist(), [0, 0, 1, 1, 1])
+        self.assertEqual(table['relation'].tolist(), ['anchor', '13C/12C;15N/14N', 'anchor', 'Na/H', '13C/12C'])
+        self.assertEqual(table['id'].tolist(), ['F0', 'F1', 'F2', 'F3', 'F4'])
+
+    def test_groups_cover_signatures(self):
+        peaks = read_test_peaks()
+        columns = peaks_to_columns(peaks)
+        anchor_rows, partner_rows, pattern_numbers = match_patterns_columnar(columns, isotopic_patterns, 
+                                                                             apex_rt_tolerance=5)
+        relations = np.array([x[1] for x in isotopic_patterns])[pattern_numbers]
+        table = build_empCpd_table(len(peaks), anchor_rows, partner_rows, relations, ids=columns['id_number'])
+        group_of = dict(zip(table['id'].tolist(), table['empCpd'].tolist()))
+        for signature in find_signatures_columnar(columns, isotopic_patterns, apex_rt_tolerance=5):
+            self.assertEqual(len(set(group_of[x[0]] for x in signature)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()